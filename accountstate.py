@@ -0,0 +1,76 @@
+import time
+from threading import Lock
+from configuration import *
+from logger import *
+
+FINAL_ORDER_STATUSES = ['FILLED', 'CANCELED', 'EXPIRED', 'REJECTED', 'EXPIRED_IN_MATCH']
+
+
+class AccountState:
+    '''
+    In-memory copy of the futures positions and open orders, kept up to date from the user data stream
+    and reconciled against the REST API every account_reconcile_period seconds
+    '''
+    def __init__(self):
+        self.positions = {}  ## symbol: signed position amount
+        self.open_orders = {}  ## symbol: {orderId: order}, orders use the same keys as futures_get_open_orders
+        self.lock = Lock()
+        self.last_reconcile = 0
+
+    def handle_user_message(self, msg):
+        ''' Callback for the futures user socket '''
+        try:
+            if msg['e'] == 'ORDER_TRADE_UPDATE':
+                order = msg['o']
+                with self.lock:
+                    orders = self.open_orders.setdefault(order['s'], {})
+                    if order['X'] in FINAL_ORDER_STATUSES:
+                        orders.pop(order['i'], None)
+                    else:
+                        orders[order['i']] = {'symbol': order['s'], 'orderId': order['i'], 'side': order['S'], 'type': order['o'],
+                                              'origType': order['ot'], 'price': order['p'], 'stopPrice': order['sp'],
+                                              'origQty': order['q'], 'reduceOnly': order['R'], 'closePosition': order.get('cp', False)}
+            elif msg['e'] == 'ACCOUNT_UPDATE':
+                with self.lock:
+                    for position in msg['a']['P']:
+                        self.positions[position['s']] = float(position['pa'])
+        except Exception as e:
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+            log.warning(f'handle_user_message() - error occurred, msg: {msg}, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
+
+    def reconcile(self, client):
+        ''' Replaces the cached state with a REST snapshot, two account-wide requests cover every symbol '''
+        try:
+            positions = {position['symbol']: float(position['positionAmt']) for position in client.futures_position_information()}
+            open_orders = {}
+            for order in client.futures_get_open_orders():
+                open_orders.setdefault(order['symbol'], {})[order['orderId']] = order
+            with self.lock:
+                self.positions = positions
+                self.open_orders = open_orders
+                self.last_reconcile = time.time()
+        except Exception as e:
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+            log.warning(f'reconcile() - error reconciling account state, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
+
+    def reconcile_loop(self, client):
+        ''' Loop that runs constantly and corrects anything the user data stream missed '''
+        while True:
+            self.reconcile(client)
+            time.sleep(account_reconcile_period)
+
+    def position_qty(self, symbol: str):
+        with self.lock:
+            return self.positions.get(symbol, 0.0)
+
+    def get_open_orders(self, symbol: str, side: str = None, types: [str] = None):
+        with self.lock:
+            return [order for order in self.open_orders.get(symbol, {}).values()
+                    if (side is None or order['side'] == side) and (types is None or order['type'] in types)]
+
+    def remove_order(self, symbol: str, order_id):
+        ''' Drops an order we cancelled ourselves without waiting for the stream to confirm it '''
+        with self.lock:
+            self.open_orders.get(symbol, {}).pop(order_id, None)
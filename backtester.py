@@ -0,0 +1,175 @@
+import time
+import numpy as np
+import strategy as TS
+import tradingbot
+from candles import interval_to_minutes
+from configuration import *
+from logger import *
+
+ENTRY_FRACTION = 0.5  ## TradeManager.open_trade enters with half the balance
+AVG_DOWN_FRACTION = 1.0  ## and places the averaging down limit with the full balance
+
+
+def next_index(mask):
+    ''' For every candle returns the index of the first candle at or after it where mask is True, len(mask) if there is none '''
+    n = len(mask)
+    indexes = np.where(mask, np.arange(n), n)
+    return np.minimum.accumulate(indexes[::-1])[::-1]
+
+
+def first_reached(extremes, level: float, side: int, start: int, end: int, chunk: int = 64):
+    '''
+    Index of the first candle in [start, end) whose extreme is at or through level (<= for side 1, >= for side -1), end if none.
+    Searched in doubling chunks, so the cost follows the distance to the hit rather than the length of the range
+    '''
+    while start < end:
+        stop = min(start + chunk, end)
+        hit = side * (extremes[start:stop] - level) <= 0
+        if hit.any():
+            return start + int(hit.argmax())
+        start, chunk = stop, 2 * chunk
+    return end
+
+
+def backtest_arrays(Open, High, Low, Close, SMA, RSI, ATR, RSI_lower_bound=RSI_lower_bound, RSI_upper_bound=RSI_upper_bound,
+                    SL_mult=SL_mult, avg_down_mult=None, fee=0.0, starting_balance=1000.0, periods_per_year=None):
+    '''
+    Backtests the RSI strategy the way the live Bot and TradeManager trade it:
+    - a signal enters at the candle close if there is no position in that direction
+    - the opposite signal closes the position at the close and opens the other side
+    - a STOP_MARKET at SL_mult x ATR closes the position, the next signal re-enters
+    - an averaging down LIMIT at avg_down_mult x ATR (SL_mult in open_trade) adds to the position if touched first
+    Candle level work (signals, stop and limit searches, equity curve) is done with numpy, python only loops once per trade
+    '''
+    Open, High, Low, Close = (np.asarray(values, dtype=np.float64) for values in (Open, High, Low, Close))
+    ATR = np.asarray(ATR, dtype=np.float64)
+    avg_down_mult = SL_mult if avg_down_mult is None else avg_down_mult
+    if periods_per_year is None:
+        periods_per_year = 525_600 / interval_to_minutes()
+    n = len(Close)
+    signals = TS.RSI_signals(Close, SMA, RSI, RSI_lower_bound, RSI_upper_bound)
+    next_signal = next_index(signals != -99)
+    next_sell = next_index(signals == 0)
+    next_buy = next_index(signals == 1)
+
+    trades = {'entry_index': [], 'exit_index': [], 'direction': [], 'entry_price': [], 'exit_price': [], 'avg_down_price': [], 'avg_down_index': [], 'stopped': []}
+    i = next_signal[0] if n else 0
+    while i < n - 1:
+        direction = signals[i]
+        entry_price = Close[i]
+        if not ATR[i] > 0:
+            i = next_signal[i + 1]
+            continue
+        side = 1 if direction == 1 else -1
+        SL = entry_price - side * SL_mult * ATR[i]
+        avg_down_price = entry_price - side * avg_down_mult * ATR[i]
+        opposite = next_sell[i] if direction == 1 else next_buy[i]
+        end = min(opposite, n - 1)
+
+        ## STOP_MARKET, triggered by the candle extreme, gaps fill at the open
+        extremes = Low if side == 1 else High
+        exit_index = first_reached(extremes, SL, side, i + 1, end + 1)
+        stopped = exit_index <= end
+        if stopped:
+            exit_price = min(Open[exit_index], SL) if side == 1 else max(Open[exit_index], SL)
+        else:
+            exit_index = end
+            exit_price = Close[end]
+
+        ## Averaging down LIMIT, only reachable if it sits no further away than the stop
+        avg_down_index = -1
+        if avg_down_mult <= SL_mult:
+            touched = first_reached(extremes, avg_down_price, side, i + 1, exit_index + 1)
+            if touched <= exit_index:
+                avg_down_index = touched
+                avg_down_price = min(Open[avg_down_index], avg_down_price) if side == 1 else max(Open[avg_down_index], avg_down_price)
+
+        trades['entry_index'].append(i)
+        trades['exit_index'].append(exit_index)
+        trades['direction'].append(direction)
+        trades['entry_price'].append(entry_price)
+        trades['exit_price'].append(exit_price)
+        trades['avg_down_price'].append(avg_down_price)
+        trades['avg_down_index'].append(avg_down_index)
+        trades['stopped'].append(stopped)
+        ## A stop fills inside the candle so a signal on that same close re-enters, an opposite signal flips the position
+        i = next_signal[exit_index] if stopped else opposite
+
+    trades = {name: np.asarray(values) for name, values in trades.items()}
+    return summarize(trades, Close, fee, starting_balance, periods_per_year)
+
+
+def summarize(trades: {str: np.ndarray}, Close, fee: float, starting_balance: float, periods_per_year: float):
+    ''' Builds the marked to market equity curve from the trade list and reports PnL, Sharpe and drawdown '''
+    n = len(Close)
+    number_of_trades = len(trades['entry_index'])
+    side = np.where(trades['direction'] == 1, 1.0, -1.0) if number_of_trades else np.zeros(0)
+    filled = trades['avg_down_index'] >= 0 if number_of_trades else np.zeros(0, dtype=bool)
+    entry_price = trades['entry_price'].astype(np.float64) if number_of_trades else np.zeros(0)
+    avg_down_price = trades['avg_down_price'].astype(np.float64) if number_of_trades else np.zeros(0)
+    exit_price = trades['exit_price'].astype(np.float64) if number_of_trades else np.zeros(0)
+
+    returns = side * (ENTRY_FRACTION * (exit_price / entry_price - 1) + filled * AVG_DOWN_FRACTION * (exit_price / avg_down_price - 1))
+    returns -= fee * (ENTRY_FRACTION * (1 + exit_price / entry_price) + filled * AVG_DOWN_FRACTION * (1 + exit_price / avg_down_price))
+    realized = starting_balance * np.concatenate(([1.0], np.cumprod(1 + returns)))
+
+    ## Realized equity steps at every exit, open trades are marked to market at each close in between
+    equity = realized[np.searchsorted(trades['exit_index'], np.arange(n), side='right')] if number_of_trades else np.full(n, float(starting_balance))
+    if number_of_trades:
+        lengths = trades['exit_index'] - trades['entry_index'] - 1
+        trade_of_candle = np.repeat(np.arange(number_of_trades), lengths)
+        candles = np.repeat(trades['entry_index'] + 1, lengths) + np.arange(lengths.sum()) - np.repeat(np.cumsum(lengths) - lengths, lengths)
+        price = Close[candles]
+        open_pnl = side[trade_of_candle] * (ENTRY_FRACTION * (price / entry_price[trade_of_candle] - 1) +
+                                            (filled[trade_of_candle] & (candles >= trades['avg_down_index'][trade_of_candle])) *
+                                            AVG_DOWN_FRACTION * (price / avg_down_price[trade_of_candle] - 1))
+        equity[candles] = realized[trade_of_candle] * (1 + open_pnl)
+
+    candle_returns = equity[1:] / equity[:-1] - 1 if n > 1 else np.zeros(0)
+    deviation = candle_returns.std() if len(candle_returns) else 0.0
+    sharpe = candle_returns.mean() / deviation * np.sqrt(periods_per_year) if deviation > 0 else 0.0
+    drawdown = 1 - equity / np.maximum.accumulate(equity) if n else np.zeros(0)
+    return {'PnL': realized[-1] - starting_balance,
+            'Return': realized[-1] / starting_balance - 1,
+            'Sharpe': sharpe,
+            'Max drawdown': drawdown.max() if n else 0.0,
+            'Trades': number_of_trades,
+            'Wins': int((returns > 0).sum()),
+            'Losses': int((returns <= 0).sum()),
+            'Stopped out': int(trades['stopped'].sum()) if number_of_trades else 0,
+            'Averaged down': int(filled.sum()),
+            'equity': equity,
+            'trades': trades}
+
+
+def backtest_bot(bot: tradingbot.Bot, RSI_lower_bound=RSI_lower_bound, RSI_upper_bound=RSI_upper_bound, avg_down_mult=None, fee=0.0, starting_balance=1000.0):
+    ''' Runs the backtest on a Bot created with backtesting=1, using its candles, indicators and SL_mult '''
+    ATR = bot.indicators["ATR"]["values"]
+    return backtest_arrays(bot.Open, bot.High, bot.Low, bot.Close, bot.indicators["SMA"]["values"], bot.indicators["RSI"]["values"], ATR,
+                           RSI_lower_bound, RSI_upper_bound, bot.SL_mult, avg_down_mult, fee, starting_balance)
+
+
+def make_backtest_bot(symbol: str, Date, Open, Close, High, Low, Volume):
+    ''' Creates a Bot in backtesting mode, its indicators are computed over the whole history at once '''
+    return tradingbot.Bot(symbol=symbol, Open=Open, Close=Close, High=High, Low=Low, Volume=Volume, Date=Date,
+                          OP=0, CP=0, index=-1, tick=0, strategy='RSI', TP_SL_choice='x (ATR)',
+                          SL_mult=SL_mult, TP_mult=1, backtesting=1)
+
+
+def download_history(symbol: str, buffer_str: str = backtest_buffer):
+    ''' Downloads the candles used for backtesting, returns Date, Open, Close, High, Low, Volume '''
+    from binance.client import Client
+    from helper import CustomClient
+    log.info(f'download_history() - Downloading {buffer_str} of {interval} candles for {symbol}...')
+    return CustomClient(Client(api_key=API_KEY, api_secret=API_SECRET)).get_historical(symbol, buffer_str)
+
+
+if __name__ == '__main__':
+    for symbol in symbols_to_trade:
+        Date, Open, Close, High, Low, Volume = download_history(symbol)
+        start = time.perf_counter()
+        bot = make_backtest_bot(symbol, Date, Open, Close, High, Low, Volume)
+        results = backtest_bot(bot)
+        log.info(f'backtester - {symbol}: {len(bot.Close)} candles in {round(time.perf_counter() - start, 3)}s, PnL: {round(results["PnL"], 3)}, '
+                 f'Return: {round(100 * results["Return"], 3)}%, Sharpe: {round(results["Sharpe"], 3)}, Max drawdown: {round(100 * results["Max drawdown"], 3)}%, '
+                 f'Trades: {results["Trades"]}, Wins: {results["Wins"]}, Losses: {results["Losses"]}')
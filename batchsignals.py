@@ -0,0 +1,142 @@
+import time
+from threading import Lock, Timer
+import numpy as np
+import strategy as TS
+from indicators import BatchIndicatorEngine, IndicatorEngine
+from latency import tracer
+from metrics import metrics
+from configuration import *
+from logger import *
+
+
+class BatchSignalEvaluator:
+    '''
+    Evaluates every Bot at once per closed interval. Bots submit their closed kline, once all active symbols
+    (or whatever arrived batch_signal_wait seconds after the first one) are in, SMA / RSI / ATR are advanced for all of them
+    with one BatchIndicatorEngine update and the RSI rules are applied as array masks. Only symbols with a signal
+    go back through Bot.apply_decision
+    '''
+    def __init__(self, bots: list, wait: float = batch_signal_wait):
+        self.bots = {bot.index: bot for bot in bots}
+        size = max(self.bots, default=-1) + 1  ## rows are Bot.index
+        self.engine = BatchIndicatorEngine(size, SMA_window, RSI_window, RSI_window)
+        self.wait = wait
+        self.close, self.high, self.low = np.full(size, np.nan), np.full(size, np.nan), np.full(size, np.nan)
+        self.close_time = np.zeros(size, dtype=np.int64)  ## close time of the submitted kline
+        self.submitted = np.zeros(size, dtype=bool)
+        self.active = np.zeros(size, dtype=bool)
+        self.active[list(self.bots)] = True
+        self.engine_until = np.full(size, -1, dtype=np.int64)  ## close time of the newest candle in the engine, -1 until loaded
+        self.submitted_count = 0
+        self.pending_close_time = None
+        self.timer = None
+        self.lock = Lock()
+
+    def remove(self, bot):
+        ''' Stops waiting for a Bot that was dropped '''
+        with self.lock:
+            self.active[bot.index] = False
+            self.bots.pop(bot.index, None)
+
+    def evaluates(self, bot):
+        ''' True once the Bot's indicators are computed here, until then the Bot keeps its own engine up to date '''
+        return self.engine_until[bot.index] >= 0
+
+    def engine_state(self, bot):
+        ''' (IndicatorEngine with the Bot's row of the batch engine, close time of its newest candle), None before the hand over '''
+        with self.lock:
+            i = bot.index
+            if self.engine_until[i] < 0:
+                return None
+            engine = IndicatorEngine(SMA_window, RSI_window, RSI_window)
+            self.engine.export(i, engine)
+            return engine, int(self.engine_until[i])
+
+    def reload(self, bot):
+        ''' The Bot's engine was reseeded (after a gap backfill), its state is loaded again at the next evaluation '''
+        with self.lock:
+            self.engine_until[bot.index] = -1
+
+    def submit(self, bot, payload: dict):
+        ''' Called from Bot.handle_socket_message once the closed kline is in the Bot's buffer '''
+        results = []
+        close_time = int(payload['T'])
+        with self.lock:
+            if self.pending_close_time is not None and close_time > self.pending_close_time:
+                results += self.evaluate()  ## the next interval started before every symbol of the last one arrived
+            i = bot.index
+            if not self.submitted[i]:
+                self.submitted_count += 1
+            self.submitted[i] = True
+            self.close[i], self.high[i], self.low[i] = float(payload['c']), float(payload['h']), float(payload['l'])
+            self.close_time[i] = close_time
+            if self.pending_close_time is None:
+                self.pending_close_time = close_time
+                self.timer = Timer(self.wait, self.flush, args=(close_time,))
+                self.timer.daemon = True
+                self.timer.start()
+            if self.submitted_count >= np.count_nonzero(self.active):
+                results += self.evaluate()
+        if results:
+            self.apply(results)
+
+    def flush(self, close_time: int):
+        ''' Timer callback, evaluates an interval some symbols never sent a kline for '''
+        with self.lock:
+            if self.pending_close_time != close_time:
+                return
+            results = self.evaluate()
+        self.apply(results)
+
+    def evaluate(self):
+        ''' Advances the engine for the submitted symbols and returns [(index, close time, SMA, RSI, ATR, signal)], called under the lock '''
+        start = time.perf_counter()
+        if self.timer is not None:
+            self.timer.cancel()
+        submitted = np.nonzero(self.submitted)[0]
+        ## Bots whose history was joined since the last interval hand over the state of their own engine, which is current
+        ## up to the newest candle in their buffer
+        for i in submitted[self.engine_until[submitted] < 0]:
+            bot = self.bots.get(int(i))
+            if bot is not None and bot.add_hist_complete:
+                with bot.candles_lock:
+                    self.engine.load(i, bot.engine)
+                    self.engine_until[i] = bot.Date[-1]
+        ## Candles the Bot engine consumed before the hand over are already in the engine, their indicators are the
+        ## values it handed over and only the decision is left to make
+        handed_over = self.submitted & (self.engine_until >= 0) & (self.close_time == self.engine_until)
+        mask = self.submitted & (self.engine_until >= 0) & (self.close_time > self.engine_until)
+        SMA, RSI, ATR = self.engine.update(self.close, self.high, self.low, mask)
+        signals = TS.RSI_signals(self.close, SMA, RSI)
+        self.engine_until[mask] = self.close_time[mask]
+        evaluated = np.nonzero(mask | handed_over)[0]
+        results = [(int(i), int(self.close_time[i]), SMA[i], RSI[i], ATR[i], int(signals[i])) for i in evaluated]
+        self.submitted[:] = False
+        self.submitted_count = 0
+        self.pending_close_time = None
+        self.timer = None
+        tracer.since('batch_evaluate', start)
+        metrics.inc('batch_evaluations_total')
+        log.info(f'evaluate() - {len(evaluated)} of {len(submitted)} submitted symbols evaluated in {round(1000 * (time.perf_counter() - start), 3)} ms, '
+                 f'{sum(1 for result in results if result[5] != -99)} signals')
+        return results
+
+    def apply(self, results: list):
+        ''' Writes the indicators back into each Bot's buffer and acts on the signals, outside the lock '''
+        for i, close_time, SMA, RSI, ATR, signal in results:
+            bot = self.bots.get(i)
+            if bot is None:
+                continue
+            try:
+                with bot.candles_lock:
+                    if bot.Date[-1] != close_time:
+                        continue  ## a newer candle is already in the buffer, its own evaluation will follow
+                    bot.candles.set_last(SMA=SMA, RSI=RSI, ATR=ATR)
+                if signal != -99:
+                    bot.apply_decision(signal, -99, close_time)
+                with bot.candles_lock:
+                    bot.remove_first_candle()
+            except Exception as e:
+                exc_type, exc_obj, exc_tb = sys.exc_info()
+                fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+                log.warning(f'apply() - error applying the batch evaluation to {bot.symbol}, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
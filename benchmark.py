@@ -0,0 +1,273 @@
+import argparse
+import json
+import logging
+import platform
+import queue
+import subprocess
+import time
+import numpy as np
+from binance.enums import SIDE_SELL
+from tabulate import tabulate
+import tradingbot
+from accountstate import AccountState
+from candles import CandleBuffer, interval_to_minutes
+from helper import Trade, TradeRegistry
+from latency import LatencyHistogram
+from recording import merge_recordings, KLINE_STREAM
+from replay import ReplayClient, DiscardQueue, recording_paths
+from trademanager import TradeManager
+from configuration import *
+from logger import *
+
+CANDLE_COLUMNS = ['Date', 'Open', 'Close', 'High', 'Low', 'Volume']  ## add_hist argument order
+QUICK = {'sizes': [200, 1_000], 'symbols': [1, 10], 'trades': [10, 1_000], 'rounds': 20, 'events': 20_000}
+
+
+def synthetic_candles(count: int, seed: int = 0, start_price: float = 100.0):
+    ''' Seeded random walk, the same seed always gives the same candles '''
+    rng = np.random.default_rng(seed)
+    returns = rng.normal(0, 0.002, count)
+    ratios = np.column_stack((rng.normal(0, 0.001, count), np.abs(rng.normal(0, 0.001, (count, 2)))))
+    return candles_from_returns(returns, ratios, rng.uniform(1, 1000, count), start_price)
+
+
+def candles_from_returns(returns, ratios, Volume, start_price: float):
+    ''' Builds candles from close to close log returns and (open, high, low) offsets relative to the close '''
+    interval_ms = interval_to_minutes() * 60_000
+    Close = start_price * np.exp(np.cumsum(returns))
+    Open = Close * (1 + ratios[:, 0])
+    High = np.maximum(Open, Close) * (1 + ratios[:, 1])
+    Low = np.minimum(Open, Close) * (1 - ratios[:, 2])
+    Date = (int(time.time() * 1000) // interval_ms - len(Close)) * interval_ms + np.arange(1, len(Close) + 1) * interval_ms - 1
+    return {'Date': Date, 'Open': Open, 'Close': Close, 'High': High, 'Low': Low, 'Volume': np.asarray(Volume, dtype=np.float64)}
+
+
+def recorded_candles(prefix: str):
+    ''' Close to close returns and candle shapes of the closed klines in a recording, per symbol so returns never span two symbols '''
+    rows = {}
+    for received, stream, msg in merge_recordings(recording_paths(prefix)):
+        payload = msg.get('data', msg).get('k') if stream == KLINE_STREAM else None
+        if payload and payload['x']:
+            rows.setdefault(payload['s'], []).append([float(payload[key]) for key in ('o', 'h', 'l', 'c', 'q')])
+    returns, ratios, Volume = [], [], []
+    for symbol_rows in rows.values():
+        Open, High, Low, Close, quote_volume = np.array(symbol_rows).T
+        returns.append(np.diff(np.log(Close), prepend=np.log(Close[0])))
+        ratios.append(np.column_stack((Open / Close - 1, High / np.maximum(Open, Close) - 1, 1 - Low / np.minimum(Open, Close))))
+        Volume.append(quote_volume)
+    if not returns:
+        raise ValueError(f'no closed klines in the {prefix} recording')
+    return np.concatenate(returns), np.concatenate(ratios), np.concatenate(Volume)
+
+
+class CandleSource:
+    ''' Synthetic candles, or the recorded candle shapes repeated as often as needed when a recording is given '''
+    def __init__(self, recording: str = ''):
+        self.recorded = recorded_candles(recording) if recording else None
+
+    def candles(self, count: int, seed: int):
+        if self.recorded is None:
+            return synthetic_candles(count, seed)
+        returns, ratios, Volume = self.recorded
+        rng = np.random.default_rng(seed)
+        picks = (rng.integers(len(returns)) + np.arange(count)) % len(returns)
+        return candles_from_returns(returns[picks], ratios[picks], Volume[picks], 100.0)
+
+
+def kline_message(symbol: str, candles: dict, i: int):
+    ''' Closed futures kline event for candle i, in the single stream format Bot.handle_socket_message takes '''
+    interval_ms = interval_to_minutes() * 60_000
+    close_time = int(candles['Date'][i])
+    return {'e': 'kline', 'E': close_time + 1, 's': symbol,
+            'k': {'t': close_time + 1 - interval_ms, 'T': close_time, 's': symbol, 'i': interval, 'o': str(candles['Open'][i]),
+                  'c': str(candles['Close'][i]), 'h': str(candles['High'][i]), 'l': str(candles['Low'][i]),
+                  'v': str(candles['Volume'][i]), 'q': str(candles['Volume'][i]), 'x': True}}
+
+
+def make_bot(symbol: str, index: int, buffer_size: int, account_state: AccountState, client):
+    ''' Live Bot with room for buffer_size historical candles, decisions are served from a local account state '''
+    bot = tradingbot.Bot(symbol=symbol, Open=[], Close=[], High=[], Low=[], Volume=[], Date=[], OP=3, CP=2, index=index, tick=0.01,
+                         strategy='RSI', TP_SL_choice='x (ATR)', SL_mult=SL_mult, TP_mult=1, signal_queue=DiscardQueue(),
+                         print_trades_q=DiscardQueue(), account_state=account_state, client=client)
+    bot.candles = CandleBuffer(buffer_size + buffer_margin)
+    return bot
+
+
+def bench_per_candle(source: CandleSource, buffer_size: int, symbols: int, rounds: int):
+    '''
+    Per candle cost with symbols Bots of buffer_size candles each. update_indicators and make_decision are timed on their own,
+    then handle_socket_message is timed on fresh closed klines. round_ms is the time to handle one candle of every symbol
+    '''
+    account_state, client = AccountState(), ReplayClient()
+    bots, streams = [], []
+    for index in range(symbols):
+        candles = source.candles(buffer_size + 2 * rounds, seed=index)
+        bot = make_bot(f'BENCH{index}USDT', index, buffer_size, account_state, client)
+        bot.add_hist(*[candles[name][:buffer_size] for name in CANDLE_COLUMNS])
+        bots.append(bot)
+        streams.append(candles)
+    stages = {stage: LatencyHistogram() for stage in ('update_indicators', 'make_decision', 'handle_socket_message')}
+    for i in range(buffer_size, buffer_size + rounds):
+        for bot, candles in zip(bots, streams):
+            bot.consume_new_candle(kline_message(bot.symbol, candles, i)['k'])
+            start = time.perf_counter()
+            bot.update_indicators()
+            stages['update_indicators'].record(time.perf_counter() - start)
+            start = time.perf_counter()
+            bot.make_decision()
+            stages['make_decision'].record(time.perf_counter() - start)
+            bot.remove_first_candle()
+    messages = [[kline_message(bot.symbol, candles, i) for bot, candles in zip(bots, streams)] for i in range(buffer_size + rounds, buffer_size + 2 * rounds)]
+    started = time.perf_counter()
+    for round_messages in messages:
+        for bot, msg in zip(bots, round_messages):
+            start = time.perf_counter()
+            bot.handle_socket_message(msg)
+            stages['handle_socket_message'].record(time.perf_counter() - start)
+    round_ms = 1000 * (time.perf_counter() - started) / rounds
+    return {'buffer_size': buffer_size, 'symbols': symbols, 'rounds': rounds, 'round_ms': round_ms,
+            **{stage: histogram.summary() for stage, histogram in stages.items()}}
+
+
+def bench_add_hist(source: CandleSource, buffer_size: int, repeats: int = 3):
+    ''' add_hist joining buffer_size historical candles with websocket candles that partly overlap them, as on startup '''
+    overlap = min(buffer_margin // 2, buffer_size)
+    timings = []
+    for repeat in range(repeats):
+        candles = source.candles(buffer_size + overlap, seed=repeat)
+        bot = make_bot('BENCHUSDT', 1, buffer_size, AccountState(), ReplayClient())
+        for i in range(buffer_size - overlap, buffer_size + overlap):
+            bot.consume_new_candle(kline_message(bot.symbol, candles, i)['k'])
+        start = time.perf_counter()
+        bot.add_hist(*[candles[name][:buffer_size] for name in CANDLE_COLUMNS])
+        timings.append(1000 * (time.perf_counter() - start))
+    return {'buffer_size': buffer_size, 'repeats': repeats, 'min_ms': min(timings), 'median_ms': float(np.median(timings))}
+
+
+def user_events(trades: [Trade], events: int, seed: int = 0):
+    '''
+    Mix of user data events that go through every lookup in monitor_trades without changing a trade:
+    NEW order updates, fills of unknown orders, take profit fills with no realized profit and non zero position updates
+    '''
+    rng = np.random.default_rng(seed)
+    now = int(time.time() * 1000)
+    messages = []
+    for kind, i in zip(rng.integers(4, size=events), rng.integers(len(trades), size=events)):
+        trade = trades[i]
+        if kind == 3:
+            messages.append({'e': 'ACCOUNT_UPDATE', 'E': now, 'a': {'m': 'ORDER', 'B': [], 'P': [{'s': trade.symbol, 'pa': '1', 'ep': '1', 'ps': 'BOTH'}]}})
+            continue
+        order_id = [trade.order_id, -int(i) - 1, trade.TP_id][kind]
+        messages.append({'e': 'ORDER_TRADE_UPDATE', 'E': now, 'o': {'s': trade.symbol, 'i': order_id, 'X': 'NEW' if kind == 0 else 'FILLED',
+                                                                  'S': SIDE_SELL, 'o': 'TAKE_PROFIT', 'ot': 'TAKE_PROFIT', 'p': '1', 'sp': '1',
+                                                                  'q': '1', 'R': True, 'cp': False, 'rp': '0'}})
+    return messages
+
+
+def bench_monitor_trades(trade_manager: TradeManager, active_trades: int, events: int):
+    ''' User data events per second handled by monitor_trades with active_trades trades open '''
+    trade_manager.active_trades = TradeRegistry()
+    trades = []
+    for i in range(active_trades):
+        trade = Trade(i, 100.0, 1.0, 1.0, 1.0, 1, 3 * i + 1, f'BENCH{i}USDT', 2, 0.01)
+        trade_manager.active_trades.add(trade)
+        trade_manager.active_trades.set_order_ids(trade, 3 * i + 2, 3 * i + 3)
+        trades.append(trade)
+    messages = user_events(trades, events)
+    histogram = LatencyHistogram()
+    started = time.perf_counter()
+    for msg in messages:
+        start = time.perf_counter()
+        trade_manager.monitor_trades(msg)
+        histogram.record(time.perf_counter() - start)
+    seconds = time.perf_counter() - started
+    return {'active_trades': active_trades, 'events': events, 'events_per_second': events / seconds, 'latency': histogram.summary()}
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'describe', '--always', '--dirty'], capture_output=True, text=True, check=True).stdout.strip()
+    except Exception:
+        return 'unknown'
+
+
+def run_benchmarks(sizes: [int], symbol_counts: [int], trade_counts: [int], rounds: int, events: int, recording: str = '',
+                   max_candles: int = benchmark_max_candles):
+    source = CandleSource(recording)
+    results = {'revision': git_revision(), 'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'), 'python': platform.python_version(),
+               'numpy': np.__version__, 'machine': platform.platform(), 'data': recording or 'synthetic',
+               'parameters': {'sizes': sizes, 'symbols': symbol_counts, 'trades': trade_counts, 'rounds': rounds, 'events': events, 'max_candles': max_candles},
+               'per_candle': [], 'add_hist': [], 'monitor_trades': []}
+    for buffer_size in sizes:
+        for symbols in symbol_counts:
+            if buffer_size * symbols > max_candles:
+                log.info(f'run_benchmarks() - skipping {symbols} symbols x {buffer_size} candles, more than {max_candles} candles')
+                continue
+            result = bench_per_candle(source, buffer_size, symbols, rounds)
+            log.info(f'run_benchmarks() - per candle, {symbols} symbols x {buffer_size} candles: round {round(result["round_ms"], 3)} ms, '
+                     f'handle_socket_message p50 {round(result["handle_socket_message"]["p50"], 4)} ms')
+            results['per_candle'].append(result)
+        results['add_hist'].append(bench_add_hist(source, buffer_size))
+    trade_manager = TradeManager(ReplayClient(), queue.Queue(), queue.Queue(), offline=True)
+    for active_trades in trade_counts:
+        results['monitor_trades'].append(bench_monitor_trades(trade_manager, active_trades, events))
+    return results
+
+
+def flatten(results: dict):
+    ''' {benchmark: (value, higher is better)} used to compare two result files '''
+    values = {}
+    for result in results['per_candle']:
+        for stage in ('update_indicators', 'make_decision', 'handle_socket_message'):
+            values[f'{stage} mean ms, {result["symbols"]} x {result["buffer_size"]}'] = (result[stage]['mean'], False)
+        values[f'round ms, {result["symbols"]} x {result["buffer_size"]}'] = (result['round_ms'], False)
+    for result in results['add_hist']:
+        values[f'add_hist median ms, {result["buffer_size"]}'] = (result['median_ms'], False)
+    for result in results['monitor_trades']:
+        values[f'monitor_trades events/s, {result["active_trades"]} trades'] = (result['events_per_second'], True)
+    return values
+
+
+def compare(old: dict, new: dict, threshold: float = 0.1):
+    ''' Table of every benchmark in both files, changes worse than threshold are flagged as regressions '''
+    old_values, new_values = flatten(old), flatten(new)
+    table = {'Benchmark': [], f'Before ({old["revision"]})': [], f'After ({new["revision"]})': [], 'Change %': [], '': []}
+    for name, (new_value, higher_is_better) in new_values.items():
+        if name not in old_values or not old_values[name][0]:
+            continue
+        change = new_value / old_values[name][0] - 1
+        regression = -change > threshold if higher_is_better else change > threshold
+        for column, value in zip(table, [name, round(old_values[name][0], 4), round(new_value, 4), round(100 * change, 1), 'REGRESSION' if regression else '']):
+            table[column].append(value)
+    return tabulate(table, headers='keys', tablefmt='github')
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Benchmarks the per candle hot path and the user data event handling offline')
+    parser.add_argument('--sizes', type=int, nargs='+', default=benchmark_buffer_sizes, help='candles in each Bot buffer')
+    parser.add_argument('--symbols', type=int, nargs='+', default=benchmark_symbol_counts, help='number of Bots')
+    parser.add_argument('--trades', type=int, nargs='+', default=benchmark_active_trades, help='active trades for monitor_trades')
+    parser.add_argument('--rounds', type=int, default=50, help='candles timed per symbol')
+    parser.add_argument('--events', type=int, default=100_000, help='user data events timed per active trade count')
+    parser.add_argument('--max-candles', type=int, default=benchmark_max_candles, help='skip symbol x buffer combinations above this')
+    parser.add_argument('--recording', default='', help='use the candles of a stream_record_file recording instead of synthetic ones')
+    parser.add_argument('--quick', action='store_true', help='small grid for a fast check')
+    parser.add_argument('--output', default='', help=f'results file, {benchmark_results_dir}/<git revision>.json by default')
+    parser.add_argument('--compare', default='', help='earlier results file to compare against')
+    args = parser.parse_args()
+    if args.quick:
+        args.sizes, args.symbols, args.trades, args.rounds, args.events = QUICK['sizes'], QUICK['symbols'], QUICK['trades'], QUICK['rounds'], QUICK['events']
+
+    ## The per candle price update log line would time console output, only warnings are kept while benchmarking
+    log.setLevel(logging.WARNING)
+    results = run_benchmarks(args.sizes, args.symbols, args.trades, args.rounds, args.events, args.recording, args.max_candles)
+    log.setLevel(LOG_LEVEL)
+    output = args.output or os.path.join(benchmark_results_dir, f'{results["revision"]}.json')
+    if os.path.dirname(output):
+        os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    log.info(f'benchmark - results written to {output}')
+    if args.compare:
+        with open(args.compare) as f:
+            log.info(f'benchmark - {args.compare} vs {output}\n' + compare(json.load(f), results))
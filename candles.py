@@ -0,0 +1,118 @@
+import re
+import numpy as np
+import pandas as pd
+from configuration import *
+from logger import *
+
+CANDLE_FIELDS = {'Date': np.int64, 'Open': np.float64, 'High': np.float64, 'Low': np.float64, 'Close': np.float64, 'Volume': np.float64,
+                 'Open_H': np.float64, 'Close_H': np.float64, 'High_H': np.float64, 'Low_H': np.float64,
+                 'SMA': np.float64, 'RSI': np.float64, 'ATR': np.float64}
+
+
+class CandleBuffer:
+    '''
+    Fixed-capacity columnar ring buffer, one preallocated array per field.
+    Every row is written twice (at slot and slot + capacity) so the live window is always one contiguous slice
+    and view() can hand out numpy views without copying
+    '''
+    def __init__(self, capacity: int, fields: {str: type} = CANDLE_FIELDS):
+        self.capacity = max(int(capacity), 1)
+        self.fields = fields
+        self.columns = {name: np.zeros(2 * self.capacity, dtype=dtype) for name, dtype in fields.items()}
+        self.defaults = {name: (0 if np.dtype(dtype).kind in 'iu' else np.nan) for name, dtype in fields.items()}
+        self.start = 0
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def view(self, name: str):
+        ''' Returns a read-only contiguous view of a column, oldest row first '''
+        column = self.columns[name][self.start:self.start + self.length]
+        column.flags.writeable = False
+        return column
+
+    def append(self, **values):
+        ''' Appends one row, fields not given are filled with 0 / NaN. When full the oldest row is overwritten '''
+        if self.length == self.capacity:
+            self.start = (self.start + 1) % self.capacity
+            self.length -= 1
+        slot = (self.start + self.length) % self.capacity
+        for name, column in self.columns.items():
+            value = values.get(name, self.defaults[name])
+            column[slot] = value
+            column[slot + self.capacity] = value
+        self.length += 1
+
+    def set_last(self, **values):
+        ''' Overwrites fields of the newest row '''
+        slot = (self.start + self.length - 1) % self.capacity
+        for name, value in values.items():
+            self.columns[name][slot] = value
+            self.columns[name][slot + self.capacity] = value
+
+    def set_column(self, name: str, values):
+        ''' Overwrites a whole column of the live window '''
+        values = np.asarray(values, dtype=self.columns[name].dtype)[-self.length:]
+        slots = (self.start + np.arange(self.length)) % self.capacity
+        self.columns[name][slots] = values
+        self.columns[name][slots + self.capacity] = values
+
+    def pop_last(self):
+        if self.length > 0:
+            self.length -= 1
+
+    def pop_first(self):
+        if self.length > 0:
+            self.start = (self.start + 1) % self.capacity
+            self.length -= 1
+
+    def load(self, arrays: {str: np.ndarray}):
+        ''' Replaces the buffer contents, only the newest capacity rows are kept '''
+        length = min(min(len(values) for values in arrays.values()) if arrays else 0, self.capacity)
+        self.start = 0
+        self.length = length
+        for name, column in self.columns.items():
+            if name in arrays and length:
+                values = np.asarray(arrays[name], dtype=column.dtype)[-length:]
+            else:
+                values = self.defaults[name]
+            column[:length] = values
+            column[self.capacity:self.capacity + length] = values
+
+
+def heikin_ashi(Open, High, Low, Close):
+    ''' Vectorized Heikin-Ashi candles, returns Open_H, Close_H, High_H, Low_H '''
+    Open, High, Low, Close = (np.asarray(values, dtype=np.float64) for values in (Open, High, Low, Close))
+    Close_H = (Open + Close + Low + High) / 4
+    if len(Close_H) == 0:
+        return Close_H, Close_H, Close_H, Close_H
+    ## Open_H[i] = (Open_H[i-1] + Close_H[i-1]) / 2 is an ewm with alpha 0.5 over the previous Close_H
+    previous_close_H = np.empty_like(Close_H)
+    previous_close_H[0] = (Open[0] + Close[0]) / 2
+    previous_close_H[1:] = Close_H[:-1]
+    Open_H = pd.Series(previous_close_H).ewm(alpha=0.5, adjust=False).mean().to_numpy()
+    High_H = np.maximum(High, np.maximum(Open_H, Close_H))
+    Low_H = np.minimum(Low, np.minimum(Open_H, Close_H))
+    return Open_H, Close_H, High_H, Low_H
+
+
+MINUTES_PER_UNIT = {'m': 1, 'h': 60, 'd': 1440, 'w': 10080}
+
+
+def interval_to_minutes(interval_str: str = interval):
+    ''' Converts a binance interval such as '15m' or '4h' to minutes '''
+    return int(interval_str[:-1]) * MINUTES_PER_UNIT.get(interval_str[-1], 1)
+
+
+def candles_in_buffer(buffer_str: str, interval_str: str = interval):
+    ''' Converts a binance start string such as '3 hours ago' to the number of candles it covers '''
+    try:
+        match = re.match(r'\s*(\d+)\s*(minute|hour|day|week)', buffer_str)
+        buffer_minutes = int(match.group(1)) * MINUTES_PER_UNIT[match.group(2)[0]]
+        return int(np.ceil(buffer_minutes / interval_to_minutes(interval_str)))
+    except Exception as e:
+        exc_type, exc_obj, exc_tb = sys.exc_info()
+        fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+        log.warning(f'candles_in_buffer() - could not parse buffer: {buffer_str}, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
+        return 1000
@@ -0,0 +1,60 @@
+import queue
+import time
+from threading import Thread
+from latency import tracer
+from metrics import metrics
+from configuration import *
+from logger import *
+
+
+class CandleWorkerPool:
+    '''
+    Moves Bot.handle_socket_message off the websocket threads. The socket callback only enqueues closed klines,
+    each symbol always goes to the same worker so its candles are handled in order. Queues are bounded: a full queue drops
+    the candle and counts it instead of blocking the socket, depths and drops are exported as metrics
+    '''
+    def __init__(self, workers: int = candle_workers, queue_size: int = candle_queue_size):
+        self.queues = [queue.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.queue_size = queue_size
+        self.dropped = 0
+        self.last_warning = [0.0] * workers
+        for worker, candles in enumerate(self.queues):
+            thread = Thread(target=self.worker_loop, args=(candles,), name=f'candle_worker_{worker}')
+            thread.daemon = True
+            thread.start()
+        metrics.add_collector(self.metric_gauges)
+
+    def metric_gauges(self):
+        return [('candle_queue_depth', (('worker', str(worker)),), candles.qsize()) for worker, candles in enumerate(self.queues)] + \
+               [('candle_queue_capacity', (), self.queue_size), ('candle_queue_dropped', (), self.dropped)]
+
+    def submit(self, bot, msg):
+        ''' Socket callback side, open klines are dropped here since the Bot ignores them anyway '''
+        if isinstance(msg, dict) and 'k' in msg and not msg['k'].get('x'):
+            return
+        worker = bot.index % len(self.queues)
+        candles = self.queues[worker]
+        try:
+            candles.put_nowait((bot, msg, time.perf_counter()))
+        except queue.Full:
+            self.dropped += 1
+            metrics.inc('candle_queue_dropped_total')
+            log.warning(f'submit() - candle worker {worker} queue is full, dropped the {bot.symbol} candle')
+            return
+        if candles.qsize() > 0.8 * self.queue_size and time.monotonic() - self.last_warning[worker] > 60:
+            self.last_warning[worker] = time.monotonic()
+            log.warning(f'submit() - candle worker {worker} queue at {candles.qsize()}/{self.queue_size}, Bots are falling behind the sockets')
+
+    def worker_loop(self, candles: queue.Queue):
+        while True:
+            bot, msg, enqueued = candles.get()
+            tracer.since('candle_queue_wait', enqueued)
+            try:
+                bot.handle_socket_message(msg)
+            except Exception as e:
+                exc_type, exc_obj, exc_tb = sys.exc_info()
+                fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+                log.warning(f'worker_loop() - error handling a {bot.symbol} candle, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
+
+    def pending(self):
+        return sum(candles.qsize() for candles in self.queues)
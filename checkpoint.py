@@ -0,0 +1,140 @@
+import glob
+import io
+import time
+import numpy as np
+from candles import interval_to_minutes
+from configuration import *
+from logger import *
+
+## Checkpoints of other settings are ignored, the candles and indicator state they hold would not fit
+CHECKPOINT_PARAMS = np.array([SMA_window, RSI_window, interval_to_minutes()], dtype=np.float64)
+TRADE_ID_FIELDS = ('order_id', 'TP_id', 'SL_id')  ## '' (not placed yet) is stored as 0, binance never uses that id
+
+
+def write_npz(path: str, arrays: {str: np.ndarray}):
+    ''' Writes the arrays to a temporary file that replaces path, a crash never leaves half a checkpoint behind '''
+    data = io.BytesIO()
+    np.savez(data, **arrays)
+    with open(path + '.tmp', 'wb') as f:
+        f.write(data.getbuffer())
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def read_npz(path: str):
+    ''' {name: array} of a checkpoint written with the current settings, None if it's missing, unreadable or stale '''
+    try:
+        if not os.path.exists(path):
+            return None
+        with np.load(path) as data:
+            arrays = {name: data[name] for name in data.files}
+        if not np.array_equal(arrays.get('meta.params'), CHECKPOINT_PARAMS):
+            log.info(f'read_npz() - ignoring {path}, it was written with other indicator or interval settings')
+            return None
+        if time.time() - float(arrays['meta.saved']) > checkpoint_max_age:
+            log.info(f'read_npz() - ignoring {path}, it is older than {checkpoint_max_age}s')
+            return None
+        return arrays
+    except Exception as e:
+        exc_type, exc_obj, exc_tb = sys.exc_info()
+        fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+        log.warning(f'read_npz() - ignoring unreadable {path}, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
+        return None
+
+
+def meta_arrays():
+    return {'meta.params': CHECKPOINT_PARAMS, 'meta.saved': np.array(time.time())}
+
+
+def bots_checkpoint_path(name: str, directory: str = checkpoint_dir):
+    ''' One file per Bot process, shards write their own '''
+    return os.path.join(directory, f'bots_{name}.npz')
+
+
+def save_bots(bots: list, path: str):
+    ''' Snapshots the candles and indicator engine of every Bot whose history is joined, returns the number saved '''
+    arrays = meta_arrays()
+    saved = 0
+    for bot in list(bots):
+        if not bot.add_hist_complete:
+            continue
+        state = bot.checkpoint_state()
+        if not len(state['Date']):
+            continue
+        arrays.update({f'{bot.symbol}.{name}': values for name, values in state.items()})
+        saved += 1
+    write_npz(path, arrays)
+    return saved
+
+
+def load_bot_checkpoints(directory: str = checkpoint_dir):
+    ''' {symbol: Bot state} from every Bot checkpoint in directory, the newest wins when symbols moved between shards '''
+    states = {}
+    for path in glob.glob(os.path.join(directory, 'bots_*.npz')):
+        arrays = read_npz(path)
+        if arrays is None:
+            continue
+        for key, values in arrays.items():
+            symbol, name = key.rsplit('.', 1)
+            if symbol != 'meta':
+                states.setdefault(path, {}).setdefault(symbol, {})[name] = values
+    newest = {}
+    for path_states in states.values():
+        for symbol, state in path_states.items():
+            if len(state.get('Date', [])) and (symbol not in newest or state['Date'][-1] > newest[symbol]['Date'][-1]):
+                newest[symbol] = state
+    log.info(f'load_bot_checkpoints() - found checkpoints for {len(newest)} symbols')
+    return newest
+
+
+def trades_checkpoint_path(directory: str = checkpoint_dir):
+    return os.path.join(directory, 'trades.npz')
+
+
+def save_trades(trade_manager, path: str):
+    ''' Snapshots the active trades (one array per Trade slot) and the profit & win / loss counters '''
+    trades = list(trade_manager.active_trades)
+    arrays = meta_arrays()
+    arrays['counters'] = np.array([trade_manager.total_profit, trade_manager.number_of_wins, trade_manager.number_of_losses], dtype=np.float64)
+    for slot in trades[0].__slots__ if trades else ():
+        values = [getattr(trade, slot) for trade in trades]
+        if slot in TRADE_ID_FIELDS:
+            values = [0 if value in ('', None) else int(value) for value in values]
+        arrays[f'trade.{slot}'] = np.array(values)
+    write_npz(path, arrays)
+    return len(trades)
+
+
+def load_trades(path: str, trade_class):
+    ''' (trades, (total profit, wins, losses)) from a trades checkpoint, None if there's no usable one '''
+    arrays = read_npz(path)
+    if arrays is None:
+        return None
+    columns = {key.split('.', 1)[1]: values for key, values in arrays.items() if key.startswith('trade.')}
+    trades = []
+    for i in range(len(next(iter(columns.values()))) if columns else 0):
+        trade = trade_class.__new__(trade_class)
+        for slot in trade_class.__slots__:
+            value = columns[slot][i].item()
+            if slot in TRADE_ID_FIELDS and value == 0:
+                value = ''
+            setattr(trade, slot, value)
+        trades.append(trade)
+    total_profit, wins, losses = arrays['counters']
+    return trades, (float(total_profit), int(wins), int(losses))
+
+
+def checkpoint_loop(save, path: str, period: float = checkpoint_period):
+    ''' Loop that runs constantly and calls save(path) every period seconds '''
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    while True:
+        time.sleep(period)
+        try:
+            start = time.perf_counter()
+            saved = save(path)
+            log.debug(f'checkpoint_loop() - {saved} entries written to {path} in {round(1000 * (time.perf_counter() - start), 1)} ms')
+        except Exception as e:
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+            log.warning(f'checkpoint_loop() - error writing {path}, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
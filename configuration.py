@@ -13,5 +13,56 @@ interval = '1m'
 SL_mult = 3 ## SL_mult x TP_SL_choice = SL value
 symbols_to_trade = ['BTCUSDT']
 buffer = '3 hours ago'
+buffer_margin = 60 ## extra candle slots per symbol for websocket candles received before the history is joined
+kline_cache_dir = 'kline_cache' ## closed klines are cached here between runs, '' disables the cache
+multiplex_sockets = True ## subscribe all symbols over combined stream connections instead of one socket per symbol
+streams_per_socket = 200 ## binance allows up to 200 streams per combined connection
+account_state_cache = True ## Bots read positions & open orders from the user data stream instead of REST
+account_reconcile_period = 60 ## seconds between REST reconciliations of that cache
+async_order_execution = True ## TradeManager places orders on the async client, symbols are handled concurrently
+batch_orders = True ## orders of a trade that don't depend on each other go out in one batchOrders request
+symbol_info_file = 'symbol_info.json' ## local copy of the exchange info symbol metadata and the leverage set per symbol
+symbol_info_ttl = 3600 ## seconds before that copy is refreshed in the background
+bootstrap_workers = 8 ## symbols whose history is downloaded at the same time on startup
+request_weight_limit = 2400 ## binance futures request weight allowed per minute
+trade_manager_weight_share = 0.5 ## part of that weight reserved for the TradeManager process, the rest is used by the Bots
+stream_record_file = '' ## records raw kline and user data messages to <prefix>.klines / <prefix>.user for replay.py, empty disables
+metrics_port = 9108 ## local prometheus endpoint at http://127.0.0.1:<port>/metrics, 0 disables it
+metrics_push_period = 5 ## seconds between TradeManager metrics snapshots sent to that endpoint
+latency_tracing = True ## per stage latency histograms, kill -USR1 <pid> logs the percentiles of that process
+coalesce_signals = True ## Bots hand signals to the TradeManager through shared memory keeping only the newest one per symbol
+signal_max_age = 30 ## seconds after which an unread signal is dropped
+rest_pool_size = 20 ## keep-alive connections kept open by the shared REST client
+bot_shards = 0 ## > 0 hashes the symbols across that many Bot processes, each with its own sockets, 0 runs every Bot in main.py
+shard_heartbeat_period = 5 ## seconds between heartbeats of a shard
+shard_heartbeat_timeout = 60 ## a shard without a heartbeat for this long is restarted
+shard_stall_candles = 3 ## a shard stops beating when none of its Bots received a candle for this many intervals
+shard_check_period = 10 ## seconds between supervisor health checks
+shard_max_restarts = 3 ## restarts within shard_restart_window seconds before a shard is retired and its symbols moved
+shard_restart_window = 600
+batch_signal_evaluation = False ## Bots only buffer candles, indicators & decisions of all symbols are computed together once per interval
+batch_signal_wait = 5 ## seconds after the first kline of an interval before symbols still missing are left out of that evaluation
+candle_workers = 4 ## threads handling closed klines off the websocket callbacks, 0 handles them on the socket thread
+candle_queue_size = 1000 ## closed klines waiting per worker, further ones are dropped and counted
+checkpoint_dir = 'checkpoints' ## Bot candles, indicator state and TradeManager trades are snapshotted here for warm restarts, '' disables
+checkpoint_period = 60 ## seconds between snapshots
+checkpoint_max_age = 6 * 3600 ## older snapshots are ignored and the full history is downloaded instead
+simulate_exchange = False ## run main.py against the in-process simulated exchange in simexchange.py instead of binance
+simulated_symbols = 0 ## trade this many generated symbols on the simulated exchange, 0 keeps symbols_to_trade
+simulated_kline_period = 1.0 ## seconds between simulated candle closes
+simulated_latency = 0.0 ## seconds added to every simulated REST call and user data event
+## Grid used by benchmark.py, results are written to benchmark_results_dir/<git revision>.json
+benchmark_buffer_sizes = [200, 1_000, 10_000, 100_000]
+benchmark_symbol_counts = [1, 10, 100, 1_000]
+benchmark_active_trades = [1, 100, 1_000, 10_000]
+benchmark_max_candles = 5_000_000 ## symbol x buffer combinations holding more candles than this are skipped
+benchmark_results_dir = 'benchmark_results'
+indicator_tolerance = 1e-6 ## max allowed difference between the streaming indicators and the ta library
+backtest_buffer = '365 days ago' ## history used by backtester.py
+## Parameter sweep used by optimizer.py, optimizer_samples = 0 runs the full grid, optimizer_processes = 0 uses every core
+optimizer_grid = {'RSI_window': [14, 21, 28, 35, 42], 'SMA_window': [50, 100, 200],
+                  'RSI_lower_bound': [20, 25, 30, 35], 'RSI_upper_bound': [70, 75, 80, 85], 'SL_mult': [1, 2, 3, 4]}
+optimizer_samples = 0
+optimizer_processes = 0
 
 LOG_LEVEL = 20
\ No newline at end of file
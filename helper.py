@@ -1,9 +1,22 @@
 from binance.client import Client
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock, Event
 import tradingbot
 from configuration import *
 from binance import ThreadedWebsocketManager
 import time
 from logger import *
+from accountstate import AccountState
+from klinecache import KlineCache, buffer_start_ms, parse_klines
+from candles import interval_to_minutes
+from ratelimit import WeightBudget
+from restclient import SharedClient, WeightScheduler, HOUSEKEEPING_PRIORITY
+from symbolinfo import SymbolInfoCache
+from batchsignals import BatchSignalEvaluator
+from candleworkers import CandleWorkerPool
+from checkpoint import load_bot_checkpoints, save_bots, bots_checkpoint_path, checkpoint_loop
+from metrics import metrics
+from recording import StreamRecorder, KLINE_STREAM
 import numpy as np
 
 
@@ -37,35 +50,66 @@ def convert_buffer_to_string(buffer_int):
         log.warning(f"convert_buffer_to_string() - Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}")
 
 class CustomClient:
-    def __init__(self, client: Client):
-        self.client = client
+    def __init__(self, client: Client, twm=None, offline=False, weight_share: float = 1 - trade_manager_weight_share):
+        ## One pooled, rate limited client for this process, the Bots share it too. weight_share is the part of the
+        ## account's request weight this process may use, shards split the Bots' part between them
+        self.client = SharedClient(client, WeightScheduler(WeightBudget(request_weight_limit * weight_share)))
         self.leverage = leverage
-        self.twm = ThreadedWebsocketManager(api_key=API_KEY, api_secret=API_SECRET, testnet= True)
+        self.twm = twm if twm is not None else ThreadedWebsocketManager(api_key=API_KEY, api_secret=API_SECRET, testnet= True)
         self.number_of_bots = 0
+        ## Offline (simulated exchange) nothing is read from or written to the on-disk caches
+        self.kline_cache = KlineCache() if kline_cache_dir and not offline else None
+        self.bots_by_symbol = {}
+        self.multiplex_groups = {}  ## combined stream name: Bots subscribed on it
+        self.reconnect_event = Event()  ## set when a Bot flags its socket, wakes ping_server_reconnect_sockets
+        self.account_state = AccountState() if account_state_cache else None
+        self.user_stream = None
+        self.recorder = StreamRecorder(stream_record_file + '.klines') if stream_record_file else None
+        self.batch_evaluator = None
+        self.candle_workers = CandleWorkerPool() if candle_workers else None
+        self.symbol_info = SymbolInfoCache(self.client, path=None if offline else symbol_info_file)
+        ## {symbol: Bot state} of the last run, restored in place of the full history download
+        self.checkpoints = load_bot_checkpoints() if checkpoint_dir and not offline else {}
+        metrics.add_collector(self.client.scheduler.gauges)
 
     def set_leverage(self, symbols_to_trade: [str]):
         ''' Function that sets the leverage for each coin as specified in live_trading_config.py '''
         log.info("set_leverage() - Setting Leverage...")
-        i = 0
-        while i < len(symbols_to_trade):
-            log.info(f"set_leverage() - ({i + 1}/{len(symbols_to_trade)}) Setting leverage on {symbols_to_trade[i]}")
-            try:
-                self.client.futures_change_leverage(symbol=symbols_to_trade[i], leverage=self.leverage)
-                i += 1
-            except Exception as e:
-                exc_type, exc_obj, exc_tb = sys.exc_info()
-                fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-                log.warning(f"set_leverage() - Symbol: {symbols_to_trade[i]} removing symbol due to error, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}")
-                symbols_to_trade.pop(i)
+        ## Symbols already at the configured leverage are skipped, the rest are set in parallel
+        symbols_to_set = [symbol for symbol in symbols_to_trade if not self.symbol_info.leverage_matches(symbol, self.leverage)]
+        log.info(f"set_leverage() - {len(symbols_to_trade) - len(symbols_to_set)} symbols already at leverage {self.leverage}, setting {len(symbols_to_set)}")
+        with ThreadPoolExecutor(max_workers=bootstrap_workers) as executor:
+            results = list(executor.map(self.set_symbol_leverage, symbols_to_set))
+        for symbol, leverage_set in zip(symbols_to_set, results):
+            if not leverage_set:
+                symbols_to_trade.remove(symbol)
+        self.symbol_info.save()
+
+    def set_symbol_leverage(self, symbol: str):
+        try:
+            self.client.futures_change_leverage(symbol=symbol, leverage=self.leverage)
+            self.symbol_info.set_leverage(symbol, self.leverage)
+            return True
+        except Exception as e:
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+            log.warning(f"set_leverage() - Symbol: {symbol} removing symbol due to error, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}")
+            return False
 
     def start_websockets(self, bots: [tradingbot.Bot]):
         ''' Function that starts the websockets for price data in the bots '''
         self.twm.start()  ##start ws manager
         log.info("start_websockets() - Starting Websockets...")
+        if self.account_state is not None:
+            self.user_stream = self.twm.start_futures_user_socket(callback=self.account_state.handle_user_message)
+            self.account_state.reconcile(self.client)
+        if multiplex_sockets:
+            self.start_multiplex_websockets(bots)
+            return
         i = 0
         while i < len(bots):
             try:
-                bots[i].stream = self.twm.start_kline_futures_socket(callback=bots[i].handle_socket_message,
+                bots[i].stream = self.twm.start_kline_futures_socket(callback=self.kline_callback(self.kline_handler(bots[i])),
                                                                      symbol=bots[i].symbol, interval=interval)
                 i += 1
             except Exception as e:
@@ -75,49 +119,130 @@ class CustomClient:
                 bots.pop(i)
         self.number_of_bots = len(bots)
 
+    def start_multiplex_websockets(self, bots: [tradingbot.Bot]):
+        ''' Subscribes the bots in groups of streams_per_socket over combined stream connections '''
+        self.bots_by_symbol = {bot.symbol: bot for bot in bots}
+        groups = [bots[i:i + streams_per_socket] for i in range(0, len(bots), streams_per_socket)]
+        for group in groups:
+            try:
+                self.start_multiplex_socket(group)
+            except Exception as e:
+                exc_type, exc_obj, exc_tb = sys.exc_info()
+                fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+                log.warning(f"start_multiplex_websockets() - Symbols: {[bot.symbol for bot in group]}, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}")
+                for bot in group:
+                    bots.remove(bot)
+                    self.bots_by_symbol.pop(bot.symbol, None)
+        log.info(f"start_multiplex_websockets() - {len(bots)} symbols subscribed over {len(self.multiplex_groups)} connections")
+        self.number_of_bots = len(bots)
+
+    def start_multiplex_socket(self, group: [tradingbot.Bot]):
+        stream = self.twm.start_futures_multiplex_socket(callback=self.kline_callback(lambda msg: self.route_kline_message(msg, group)),
+                                                         streams=[f'{bot.symbol.lower()}@kline_{interval}' for bot in group])
+        self.multiplex_groups[stream] = group
+        for bot in group:
+            bot.stream = stream
+            bot.socket_failed = False
+
+    def kline_callback(self, callback):
+        ''' Records the raw messages of a kline socket when stream_record_file is set '''
+        return self.recorder.wrap(KLINE_STREAM, callback) if self.recorder is not None else callback
+
+    def kline_handler(self, bot: tradingbot.Bot):
+        ''' Socket callback of a Bot, only queues the kline for a candle worker when those are enabled '''
+        if self.candle_workers is None:
+            return bot.handle_socket_message
+        return lambda msg: self.candle_workers.submit(bot, msg)
+
+    def route_kline_message(self, msg, group: [tradingbot.Bot]):
+        ''' Callback of a combined stream, hands each kline to its Bot with one dict lookup '''
+        data = msg.get('data', msg) if isinstance(msg, dict) else msg
+        try:
+            bot = self.bots_by_symbol.get(data['s'])
+        except Exception as e:
+            log.warning(f"route_kline_message() - Error in combined stream, flagging {len(group)} symbols for reconnection, msg: {msg}, Error: {e}")
+            for bot in group:
+                bot.flag_socket_failed()
+            return
+        if bot is None:
+            return
+        if self.candle_workers is not None:
+            self.candle_workers.submit(bot, data)
+        else:
+            bot.handle_socket_message(data)
+
+    def reconnect_failed_sockets(self, bots: [tradingbot.Bot]):
+        ''' Restarts every socket with a failed Bot, a combined stream is restarted once for all of its symbols '''
+        if multiplex_sockets:
+            failed_streams = {bot.stream for bot in bots if bot.socket_failed}
+            for stream in failed_streams:
+                group = self.multiplex_groups.pop(stream, [])
+                try:
+                    log.info(f"retry_websockets_job() - Attempting to reset combined socket for {len(group)} symbols")
+                    self.twm.stop_socket(stream)
+                    self.start_multiplex_socket(group)
+                    metrics.inc('websocket_reconnects_total', (('result', 'ok'),))
+                    log.info(f"retry_websockets_job() - Reset successful")
+                except Exception as e:
+                    metrics.inc('websocket_reconnects_total', (('result', 'error'),))
+                    self.multiplex_groups[stream] = group
+                    exc_type, exc_obj, exc_tb = sys.exc_info()
+                    fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+                    log.error(f"retry_websockets_job() - Error in resetting combined websocket, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}")
+            return
+        for bot in bots:
+            if bot.socket_failed:
+                try:
+                    log.info(f"retry_websockets_job() - Attempting to reset socket for {bot.symbol}")
+                    self.twm.stop_socket(bot.stream)
+                    bot.stream = self.twm.start_kline_futures_socket(self.kline_callback(self.kline_handler(bot)), symbol=bot.symbol, interval=interval)
+                    bot.socket_failed = False
+                    metrics.inc('websocket_reconnects_total', (('result', 'ok'),))
+                    log.info(f"retry_websockets_job() - Reset successful")
+                except Exception as e:
+                    metrics.inc('websocket_reconnects_total', (('result', 'error'),))
+                    exc_type, exc_obj, exc_tb = sys.exc_info()
+                    fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+                    log.error(f"retry_websockets_job() - Error in resetting websocket for {bot.symbol}, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}")
+
     def ping_server_reconnect_sockets(self, bots: [tradingbot.Bot]):
-        ''' Loop that runs constantly, it pings the server every 15 seconds, so we don't lose connection '''
-        while True:
-            time.sleep(15)
-            self.client.futures_ping()
-            for bot in bots:
-                if bot.socket_failed:
-                    try:
-                        log.info(f"retry_websockets_job() - Attempting to reset socket for {bot.symbol}")
-                        self.twm.stop_socket(bot.stream)
-                        bot.stream = self.twm.start_kline_futures_socket(bot.handle_socket_message, symbol=bot.symbol)
-                        bot.socket_failed = False
-                        log.info(f"retry_websockets_job() - Reset successful")
-                    except Exception as e:
-                        exc_type, exc_obj, exc_tb = sys.exc_info()
-                        fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-                        log.error(f"retry_websockets_job() - Error in resetting websocket for {bot.symbol}, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}")
-
-    def setup_bots(self, bots: [tradingbot.Bot], symbols_to_trade: [str], signal_queue, print_trades_q):
-        ''' Function that initializes a Bot class for each symbol in our symbols_to_trade list / All symbols if trade_all_coins is True '''
+        '''
+        Loop that runs constantly, it pings the server every 15 seconds, so we don't lose connection.
+        Sockets are reset as soon as a Bot flags them, the missed candles are backfilled by the Bot when the next one closes
+        '''
+        with self.client.priority(HOUSEKEEPING_PRIORITY):
+            last_ping = time.time()
+            while True:
+                if self.reconnect_event.wait(max(0.0, last_ping + 15 - time.time())):
+                    self.reconnect_event.clear()
+                    self.reconnect_failed_sockets(bots)
+                if time.time() - last_ping >= 15:
+                    last_ping = time.time()
+                    self.client.futures_ping()
+                    self.reconnect_failed_sockets(bots)  ## retries resets that failed
+
+    def reconcile_account_state_loop(self):
+        ''' AccountState.reconcile_loop on the shared client, its snapshots wait behind other requests '''
+        with self.client.priority(HOUSEKEEPING_PRIORITY):
+            self.account_state.reconcile_loop(self.client)
+
+    def setup_bots(self, bots: [tradingbot.Bot], symbols_to_trade: [str], signal_queue, print_trades_q, indexes: {str: int} = None):
+        '''
+        Function that initializes a Bot class for each symbol in our symbols_to_trade list / All symbols if trade_all_coins is True.
+        indexes gives the Bot.index of each symbol when the Bots are split across processes
+        '''
         log.info(f"setup_bots() - Beginning Bots setup...")
-        y = self.client.futures_exchange_info()['symbols']
-        symbol_info = [[x['pair'], x['pricePrecision'], x['quantityPrecision'], x['filters'][0]['tickSize']] for x in y]
 
         i = 0
         while i < len(symbols_to_trade):
-            symbol_precision = -99
-            order_precision = -99
-            tick = -99
-            flag = 0
-            for x in symbol_info:
-                if x[0] == symbols_to_trade[i]:
-                    symbol_precision = int(x[1])
-                    order_precision = int(x[2])
-                    tick = float(x[3])
-                    flag = 1
-                    break
-            if flag == 1:
+            info = self.symbol_info.get(symbols_to_trade[i])
+            if info is not None:
                 bots.append(
                     tradingbot.Bot(symbol=symbols_to_trade[i], Open=[], Close=[], High=[], Low=[], Volume=[], Date=[],
-                                  OP=order_precision, CP=symbol_precision,
-                                  index=i, tick=tick, strategy='RSI', TP_SL_choice='x (ATR)',
-                                  SL_mult=SL_mult, TP_mult=1, signal_queue=signal_queue, print_trades_q=print_trades_q))
+                                  OP=info['quantityPrecision'], CP=info['pricePrecision'],
+                                  index=indexes[symbols_to_trade[i]] if indexes else i, tick=info['tickSize'], strategy='RSI', TP_SL_choice='x (ATR)',
+                                  SL_mult=SL_mult, TP_mult=1, signal_queue=signal_queue, print_trades_q=print_trades_q,
+                                  account_state=self.account_state, client=self.client))
                 i += 1
             else:
                 log.info(f"setup_bots() - {symbols_to_trade[i]} no symbol info found, removing symbol")
@@ -127,63 +252,96 @@ class CustomClient:
                     exc_type, exc_obj, exc_tb = sys.exc_info()
                     fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
                     log.warning(f"setup_bots() - Error occurred removing symbol, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}")
+        for bot in bots:
+            bot.reconnect_event = self.reconnect_event
+        if batch_signal_evaluation:
+            self.batch_evaluator = BatchSignalEvaluator(bots)
+            for bot in bots:
+                bot.batch = self.batch_evaluator
         log.info(f"setup_bots() - Bots have completed setup")
 
     def combine_data(self, bots: [tradingbot.Bot], symbols_to_trade: [str], buffer):
         ''' Function that pulls in historical data so we have candles for the Bot to start trading immediately '''
-        log.info("combine_data() - Combining Historical and web socket data...")
-        i = 0
-        while i < len(bots):
-            log.info(f"combine_data() - ({i + 1}/{len(bots)}) Gathering and combining data for {bots[i].symbol}...")
-            date_temp, open_temp, close_temp, high_temp, low_temp, volume_temp = self.get_historical(
-                symbol=bots[i].symbol, buffer=buffer)
-            try:
-                date_temp.pop(-1)
-                open_temp.pop(-1)
-                close_temp.pop(-1)
-                high_temp.pop(-1)
-                low_temp.pop(-1)
-                volume_temp.pop(-1)
-                bots[i].add_hist(Date_temp=date_temp, Open_temp=open_temp, Close_temp=close_temp, High_temp=high_temp,
-                                 Low_temp=low_temp, Volume_temp=volume_temp)
-                i += 1
-            except Exception as e:
-                exc_type, exc_obj, exc_tb = sys.exc_info()
-                fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+        log.info(f"combine_data() - Combining Historical and web socket data with {bootstrap_workers} workers...")
+        ## Every Bot starts trading as soon as its own history is joined, failed Bots are removed once all are done
+        with ThreadPoolExecutor(max_workers=bootstrap_workers) as executor:
+            results = list(executor.map(lambda bot: self.add_historical(bot, buffer), list(bots)))
+        for bot, added in zip(list(bots), results):
+            if not added:
                 try:
-                    log.warning(f"combine_data() - Error occurred adding data, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}")
-                    self.twm.stop_socket(bots[i].stream)
-                    symbols_to_trade.pop(i)
-                    bots.pop(i)
+                    symbols_to_trade.remove(bot.symbol)
+                    bots.remove(bot)
                     self.number_of_bots -= 1
+                    if self.batch_evaluator is not None:
+                        self.batch_evaluator.remove(bot)
+                    if multiplex_sockets:
+                        ## The combined stream is shared, just stop routing to this Bot
+                        self.bots_by_symbol.pop(bot.symbol, None)
+                        if bot in self.multiplex_groups.get(bot.stream, []):
+                            self.multiplex_groups[bot.stream].remove(bot)
+                    else:
+                        self.twm.stop_socket(bot.stream)
                 except Exception as e:
                     exc_type, exc_obj, exc_tb = sys.exc_info()
                     fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
                     log.warning(f"combine_data() - Error occurred removing symbol, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}")
         log.info("combine_data() - Finished Combining data for all symbols, Searching for trades now...")
 
+    def add_historical(self, bot: tradingbot.Bot, buffer):
+        ''' Pulls the history for one Bot within the request weight budget and joins it with its websocket data '''
+        try:
+            state = self.checkpoints.pop(bot.symbol, None)
+            if state is not None and self.restore_checkpoint(bot, state):
+                return True
+            log.info(f"combine_data() - Gathering and combining data for {bot.symbol}...")
+            date_temp, open_temp, close_temp, high_temp, low_temp, volume_temp = self.get_historical(symbol=bot.symbol, buffer=buffer)
+            if len(date_temp) == 0:
+                raise ValueError(f'no historical candles returned for {bot.symbol}')
+            bot.add_hist(Date_temp=date_temp, Open_temp=open_temp, Close_temp=close_temp, High_temp=high_temp,
+                         Low_temp=low_temp, Volume_temp=volume_temp)
+            return True
+        except Exception as e:
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+            log.warning(f"combine_data() - Error occurred adding data, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}")
+            return False
+
+    def restore_checkpoint(self, bot: tradingbot.Bot, state: {str: np.ndarray}):
+        ''' Restores a Bot from its checkpoint and backfills only the candles that closed since, False if the gap is too long to bridge '''
+        try:
+            last_close = int(state['Date'][-1])
+            missed = (time.time() * 1000 - last_close) / (interval_to_minutes() * 60_000)
+            if missed > bot.candles.capacity - len(state['Date']):
+                log.info(f"restore_checkpoint() - {bot.symbol} checkpoint is {int(missed)} candles old, downloading the full history instead")
+                return False
+            klines = parse_klines(self.client.futures_historical_klines(bot.symbol, interval, start_str=last_close + 1), int(time.time() * 1000))
+            bot.restore_checkpoint(state, klines['Date'], klines['Open'], klines['Close'], klines['High'], klines['Low'], klines['Volume'])
+            log.info(f"restore_checkpoint() - {bot.symbol} restored from its checkpoint, {len(klines)} missed candles backfilled")
+            return True
+        except Exception as e:
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+            log.warning(f"restore_checkpoint() - {bot.symbol} checkpoint could not be restored, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}")
+            return False
+
+    def checkpoint_bots_loop(self, bots: [tradingbot.Bot], name: str = 'main'):
+        ''' Loop that runs constantly and snapshots the Bots for a warm restart '''
+        checkpoint_loop(lambda path: save_bots(bots, path), bots_checkpoint_path(name))
+
     def get_historical(self, symbol: str, buffer):
-        ''' Function that pulls the historical data for a symbol '''
-        Open = []
-        High = []
-        Low = []
-        Close = []
-        Volume = []
-        Date = []
+        ''' Function that pulls the closed historical candles for a symbol, from the kline cache when it's enabled '''
+        klines = parse_klines([])
         try:
-            for kline in self.client.futures_historical_klines(symbol, interval, start_str=buffer):
-                Date.append(int(kline[6]))
-                Open.append(float(kline[1]))
-                Close.append(float(kline[4]))
-                High.append(float(kline[2]))
-                Low.append(float(kline[3]))
-                Volume.append(float(kline[7]))
+            if self.kline_cache is not None:
+                klines = self.kline_cache.get_klines(self.client, symbol, buffer_start_ms(buffer))
+            else:
+                klines = parse_klines(self.client.futures_historical_klines(symbol, interval, start_str=buffer), int(time.time() * 1000))
         except Exception as e:
             exc_type, exc_obj, exc_tb = sys.exc_info()
             fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
             log.error(
                 f'get_historical() - Error occurred for symbol: {symbol}, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
-        return Date, Open, Close, High, Low, Volume
+        return klines['Date'], klines['Open'], klines['Close'], klines['High'], klines['Low'], klines['Volume']
 
     def get_account_balance(self):
         ''' Function that returns the USDT balance of the account '''
@@ -199,8 +357,12 @@ class CustomClient:
 
 
 class Trade:
+    __slots__ = ('index', 'symbol', 'entry_price', 'position_size', 'TP_val', 'SL_val', 'CP', 'tick_size', 'trade_direction',
+                 'order_id', 'TP_id', 'SL_id', 'trade_status', 'trade_start', 'Highest_val', 'Lowest_val', 'trail_activated',
+                 'same_candle', 'current_price', 'close_time')
+
     def __init__(self, index: int, entry_price: float, position_size: float, take_profit_val: float,
-                 stop_loss_val: float, trade_direction: int, order_id: int, symbol: str, CP: int, tick_size: float):
+                 stop_loss_val: float, trade_direction: int, order_id: int, symbol: str, CP: int, tick_size: float, close_time: int = 0):
         self.index = index
         self.symbol = symbol
         self.entry_price = entry_price
@@ -224,3 +386,57 @@ class Trade:
         self.trail_activated = False
         self.same_candle = True
         self.current_price = 0
+        self.close_time = close_time  ## close time (ms) of the kline that signalled the trade
+
+
+class TradeRegistry:
+    ''' Active trades indexed by symbol and by entry, take profit and stop loss order id '''
+    def __init__(self):
+        self.by_symbol = {}  ## symbol: Trade, the TradeManager holds at most one trade per symbol
+        self.by_order_id = {}  ## entry / TP / SL orderId: Trade
+        self.lock = Lock()
+
+    def add(self, trade: Trade):
+        with self.lock:
+            self.by_symbol[trade.symbol] = trade
+            self.index_order_ids(trade)
+
+    def index_order_ids(self, trade: Trade):
+        for order_id in (trade.order_id, trade.TP_id, trade.SL_id):
+            if order_id not in ('', -1, None):
+                self.by_order_id[order_id] = trade
+
+    def set_order_ids(self, trade: Trade, TP_id, SL_id):
+        ''' Records the take profit and stop loss of a trade once they are placed, the ones they replace are no longer indexed '''
+        with self.lock:
+            for order_id in (trade.TP_id, trade.SL_id):
+                if order_id != trade.order_id and self.by_order_id.get(order_id) is trade:
+                    del self.by_order_id[order_id]
+            trade.TP_id, trade.SL_id = TP_id, SL_id
+            self.index_order_ids(trade)
+
+    def remove(self, trade: Trade):
+        with self.lock:
+            if self.by_symbol.get(trade.symbol) is trade:
+                del self.by_symbol[trade.symbol]
+            for order_id in (trade.order_id, trade.TP_id, trade.SL_id):
+                if self.by_order_id.get(order_id) is trade:
+                    del self.by_order_id[order_id]
+
+    def get(self, symbol: str):
+        return self.by_symbol.get(symbol)
+
+    def get_by_order_id(self, order_id):
+        return self.by_order_id.get(order_id)
+
+    def symbols(self):
+        with self.lock:
+            return list(self.by_symbol)
+
+    def __iter__(self):
+        ''' Iterates over a snapshot so trades can be removed while looping '''
+        with self.lock:
+            return iter(list(self.by_symbol.values()))
+
+    def __len__(self):
+        return len(self.by_symbol)
@@ -0,0 +1,237 @@
+from collections import deque
+import math
+import numpy as np
+import pandas as pd
+from ta.momentum import rsi
+from ta.trend import sma_indicator
+from ta.volatility import average_true_range
+from logger import *
+
+
+class IndicatorEngine:
+    '''
+    Streaming SMA, Wilder RSI and Wilder ATR that update in constant time per candle.
+    Values match the ta library run over every candle consumed since the last reset()
+    '''
+    def __init__(self, SMA_window: int, RSI_window: int, ATR_window: int):
+        self.SMA_window = SMA_window
+        self.RSI_window = RSI_window
+        self.ATR_window = ATR_window
+        self.reset()
+
+    def reset(self):
+        self.count = 0
+        self.prev_close = math.nan
+        self.sma_closes = deque()
+        self.sma_sum = 0.0
+        self.avg_gain = 0.0
+        self.avg_loss = 0.0
+        self.tr_sum = 0.0
+        self.atr = 0.0
+        self.last_values = (math.nan, math.nan, 0.0)
+        self.previous_state = None  ## state before the last update, used by rollback()
+
+    def update(self, close: float, high: float, low: float):
+        ''' Consumes one closed candle and returns the latest (SMA, RSI, ATR) '''
+        state = (self.count, self.prev_close, self.sma_sum, self.avg_gain, self.avg_loss, self.tr_sum, self.atr, self.last_values)
+        evicted = None
+        self.sma_closes.append(close)
+        self.sma_sum += close
+        if len(self.sma_closes) > self.SMA_window:
+            evicted = self.sma_closes.popleft()
+            self.sma_sum -= evicted
+        self.previous_state = state + (evicted,)
+        if self.count % self.SMA_window == 0:
+            self.sma_sum = math.fsum(self.sma_closes)  ## re-sum periodically so float drift can't build up
+
+        ## RSI, ta seeds both averages with 0 on the first candle
+        if self.count == 0:
+            gain, loss = 0.0, 0.0
+            true_range = high - low
+        else:
+            diff = close - self.prev_close
+            gain = diff if diff > 0 else 0.0
+            loss = -diff if diff < 0 else 0.0
+            true_range = max(high - low, abs(high - self.prev_close), abs(low - self.prev_close))
+        alpha = 1 / self.RSI_window
+        self.avg_gain += alpha * (gain - self.avg_gain)
+        self.avg_loss += alpha * (loss - self.avg_loss)
+
+        ## ATR, seeded with the mean true range of the first ATR_window candles
+        if self.count < self.ATR_window:
+            self.tr_sum += true_range
+            if self.count == self.ATR_window - 1:
+                self.atr = self.tr_sum / self.ATR_window
+        else:
+            self.atr = (self.atr * (self.ATR_window - 1) + true_range) / self.ATR_window
+
+        self.count += 1
+        self.prev_close = close
+
+        SMA = self.sma_sum / self.SMA_window if self.count >= self.SMA_window else math.nan
+        if self.count < self.RSI_window:
+            RSI = math.nan
+        elif self.avg_loss == 0:
+            RSI = 100.0
+        else:
+            RSI = 100 - (100 / (1 + self.avg_gain / self.avg_loss))
+        ATR = self.atr if self.count >= self.ATR_window else 0.0
+        self.last_values = (SMA, RSI, ATR)
+        return self.last_values
+
+    def state(self):
+        ''' (scalars, SMA window closes) arrays, enough to continue exactly where this engine is '''
+        scalars = np.array((self.count, self.prev_close, self.sma_sum, self.avg_gain, self.avg_loss, self.tr_sum, self.atr) + tuple(self.last_values), dtype=np.float64)
+        return scalars, np.array(self.sma_closes, dtype=np.float64)
+
+    def load_state(self, scalars, sma_closes):
+        ''' Restores what state() returned '''
+        self.count = int(scalars[0])
+        self.prev_close, self.sma_sum, self.avg_gain, self.avg_loss, self.tr_sum, self.atr = (float(value) for value in scalars[1:7])
+        self.last_values = tuple(float(value) for value in scalars[7:10])
+        self.sma_closes = deque(float(close) for close in sma_closes)
+        self.previous_state = None
+
+    def rollback(self):
+        ''' Undoes the last update(), used when a provisional candle is replaced '''
+        if self.previous_state is None:
+            return
+        (self.count, self.prev_close, self.sma_sum, self.avg_gain, self.avg_loss,
+         self.tr_sum, self.atr, self.last_values, evicted) = self.previous_state
+        self.sma_closes.pop()
+        if evicted is not None:
+            self.sma_closes.appendleft(evicted)
+        self.previous_state = None
+
+
+class BatchIndicatorEngine:
+    '''
+    IndicatorEngine for many symbols at once, the state of symbol i is element i of each array. update() advances
+    the symbols in a mask by one candle with array operations, the values match one IndicatorEngine per symbol
+    '''
+    def __init__(self, symbols: int, SMA_window: int, RSI_window: int, ATR_window: int):
+        self.symbols = symbols
+        self.SMA_window = SMA_window
+        self.RSI_window = RSI_window
+        self.ATR_window = ATR_window
+        self.reset()
+
+    def reset(self):
+        n = self.symbols
+        self.count = np.zeros(n, dtype=np.int64)
+        self.prev_close = np.full(n, np.nan)
+        self.sma_closes = np.zeros((n, self.SMA_window))  ## ring per symbol, candle k of a symbol is kept at column k % SMA_window
+        self.sma_sum = np.zeros(n)
+        self.avg_gain = np.zeros(n)
+        self.avg_loss = np.zeros(n)
+        self.tr_sum = np.zeros(n)
+        self.atr = np.zeros(n)
+        self.SMA = np.full(n, np.nan)
+        self.RSI = np.full(n, np.nan)
+        self.ATR = np.zeros(n)
+
+    def load(self, i: int, engine: IndicatorEngine):
+        ''' Copies the state of a seeded IndicatorEngine into symbol i '''
+        self.count[i], self.prev_close[i] = engine.count, engine.prev_close
+        self.sma_sum[i], self.avg_gain[i], self.avg_loss[i] = engine.sma_sum, engine.avg_gain, engine.avg_loss
+        self.tr_sum[i], self.atr[i] = engine.tr_sum, engine.atr
+        self.sma_closes[i] = 0.0
+        for back, close in enumerate(reversed(engine.sma_closes)):
+            self.sma_closes[i, (engine.count - 1 - back) % self.SMA_window] = close
+        self.SMA[i], self.RSI[i], self.ATR[i] = engine.last_values
+
+    def export(self, i: int, engine: IndicatorEngine):
+        ''' Copies the state of symbol i into an IndicatorEngine, the reverse of load() '''
+        engine.count, engine.prev_close = int(self.count[i]), float(self.prev_close[i])
+        engine.sma_sum, engine.avg_gain, engine.avg_loss = float(self.sma_sum[i]), float(self.avg_gain[i]), float(self.avg_loss[i])
+        engine.tr_sum, engine.atr = float(self.tr_sum[i]), float(self.atr[i])
+        engine.sma_closes = deque(float(self.sma_closes[i, k % self.SMA_window]) for k in range(max(0, engine.count - self.SMA_window), engine.count))
+        engine.last_values = (float(self.SMA[i]), float(self.RSI[i]), float(self.ATR[i]))
+        engine.previous_state = None
+
+    def update(self, close, high, low, mask=None):
+        ''' Consumes one closed candle for every symbol in mask (all by default) and returns the latest (SMA, RSI, ATR) arrays '''
+        index = np.arange(self.symbols) if mask is None else np.nonzero(mask)[0]
+        if len(index) == 0:
+            return self.SMA, self.RSI, self.ATR
+        close, high, low = (np.asarray(values, dtype=np.float64)[index] for values in (close, high, low))
+        count, prev_close = self.count[index], self.prev_close[index]
+
+        slot = count % self.SMA_window
+        evicted = np.where(count >= self.SMA_window, self.sma_closes[index, slot], 0.0)
+        self.sma_closes[index, slot] = close
+        sma_sum = self.sma_sum[index] + close - evicted
+        resum = slot == 0  ## re-sum periodically so float drift can't build up
+        sma_sum[resum] = self.sma_closes[index[resum]].sum(axis=1)
+        self.sma_sum[index] = sma_sum
+
+        ## RSI, ta seeds both averages with 0 on the first candle
+        first = count == 0
+        diff = np.where(first, 0.0, close - prev_close)
+        gain, loss = np.maximum(diff, 0.0), np.maximum(-diff, 0.0)
+        true_range = np.where(first, high - low, np.maximum.reduce([high - low, np.abs(high - prev_close), np.abs(low - prev_close)]))
+        alpha = 1 / self.RSI_window
+        avg_gain = self.avg_gain[index] + alpha * (gain - self.avg_gain[index])
+        avg_loss = self.avg_loss[index] + alpha * (loss - self.avg_loss[index])
+        self.avg_gain[index], self.avg_loss[index] = avg_gain, avg_loss
+
+        ## ATR, seeded with the mean true range of the first ATR_window candles
+        seeding = count < self.ATR_window
+        tr_sum = self.tr_sum[index] + np.where(seeding, true_range, 0.0)
+        atr = np.where(seeding, self.atr[index], (self.atr[index] * (self.ATR_window - 1) + true_range) / self.ATR_window)
+        atr = np.where(count == self.ATR_window - 1, tr_sum / self.ATR_window, atr)
+        self.tr_sum[index], self.atr[index] = tr_sum, atr
+
+        count = count + 1
+        self.count[index], self.prev_close[index] = count, close
+        self.SMA[index] = np.where(count >= self.SMA_window, sma_sum / self.SMA_window, np.nan)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            RSI = np.where(avg_loss == 0, 100.0, 100 - (100 / (1 + avg_gain / avg_loss)))
+        self.RSI[index] = np.where(count < self.RSI_window, np.nan, RSI)
+        self.ATR[index] = np.where(count >= self.ATR_window, atr, 0.0)
+        return self.SMA, self.RSI, self.ATR
+
+    def seed(self, Close, High, Low):
+        ''' Consumes a symbols x time matrix of candles, NaN closes (missing or not yet listed) are skipped '''
+        Close, High, Low = (np.asarray(values, dtype=np.float64) for values in (Close, High, Low))
+        for t in range(Close.shape[1]):
+            self.update(Close[:, t], High[:, t], Low[:, t], ~np.isnan(Close[:, t]))
+        return self.SMA, self.RSI, self.ATR
+
+
+def wilder_atr(High, Low, Close, window: int):
+    ''' Vectorized equivalent of ta's average_true_range, which loops over every candle in Python '''
+    HighS = pd.Series(High, dtype=float)
+    LowS = pd.Series(Low, dtype=float)
+    prev_close = pd.Series(Close, dtype=float).shift(1)
+    true_range = pd.concat([HighS - LowS, (HighS - prev_close).abs(), (LowS - prev_close).abs()], axis=1).max(axis=1).to_numpy()
+    ATR = np.zeros(len(true_range))
+    if len(true_range) < window:
+        return ATR
+    ## Wilder smoothing is an ewm with alpha 1 / window, seeded with the mean of the first window true ranges
+    seeded = true_range.copy()
+    seeded[:window - 1] = np.nan
+    seeded[window - 1] = true_range[:window].mean()
+    ATR[window - 1:] = pd.Series(seeded).ewm(alpha=1 / window, adjust=False).mean().to_numpy()[window - 1:]
+    return ATR
+
+
+def check_against_ta(values: {str: [float]}, Close, High, Low, SMA_window: int, RSI_window: int, ATR_window: int, tolerance: float):
+    ''' Recomputes the indicators with ta and returns True if every value is within tolerance of the streamed values '''
+    try:
+        CloseS = pd.Series(Close, dtype=float)
+        HighS = pd.Series(High, dtype=float)
+        LowS = pd.Series(Low, dtype=float)
+        expected = {"SMA": sma_indicator(CloseS, window=SMA_window),
+                    "RSI": rsi(CloseS, window=RSI_window),
+                    "ATR": average_true_range(high=HighS, low=LowS, close=CloseS, window=ATR_window)}
+        for name, series in expected.items():
+            if not np.allclose(np.asarray(values[name], dtype=float), series.to_numpy(dtype=float), rtol=0, atol=tolerance, equal_nan=True):
+                log.warning(f'check_against_ta() - {name} differs from ta by more than {tolerance}')
+                return False
+        return True
+    except Exception as e:
+        exc_type, exc_obj, exc_tb = sys.exc_info()
+        fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+        log.warning(f'check_against_ta() - Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
+        return False
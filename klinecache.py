@@ -0,0 +1,121 @@
+import time
+from threading import Lock
+import numpy as np
+from candles import candles_in_buffer, interval_to_minutes
+from configuration import *
+from logger import *
+
+## One fixed-size record per closed kline, Volume is the quote asset volume (kline[7]) like CustomClient.get_historical uses
+KLINE_DTYPE = np.dtype([('Open_time', '<i8'), ('Date', '<i8'), ('Open', '<f8'), ('High', '<f8'), ('Low', '<f8'), ('Close', '<f8'), ('Volume', '<f8')])
+
+
+def parse_klines(klines: list, closed_before: int = None):
+    ''' Converts binance klines to KLINE_DTYPE records in one numpy conversion, klines still open at closed_before are dropped '''
+    records = np.zeros(len(klines), dtype=KLINE_DTYPE)
+    if len(klines) == 0:
+        return records
+    values = np.array([kline[:8] for kline in klines], dtype=np.float64)
+    records['Open_time'] = values[:, 0]
+    records['Date'] = values[:, 6]
+    records['Open'] = values[:, 1]
+    records['High'] = values[:, 2]
+    records['Low'] = values[:, 3]
+    records['Close'] = values[:, 4]
+    records['Volume'] = values[:, 7]
+    if closed_before is not None:
+        records = records[records['Date'] < closed_before]
+    return records
+
+
+class KlineCache:
+    ''' Append-only on-disk kline store, one record file per symbol and interval that is read back with np.memmap '''
+    def __init__(self, directory: str = kline_cache_dir):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+        self.locks = {}
+        self.locks_lock = Lock()
+
+    def path(self, symbol: str, interval_str: str):
+        return os.path.join(self.directory, f'{symbol}_{interval_str}.klines')
+
+    def lock(self, symbol: str, interval_str: str):
+        with self.locks_lock:
+            return self.locks.setdefault((symbol, interval_str), Lock())
+
+    def load(self, symbol: str, interval_str: str = interval):
+        ''' Memory maps every cached kline of a symbol, oldest first '''
+        path = self.path(symbol, interval_str)
+        if not os.path.exists(path) or os.path.getsize(path) < KLINE_DTYPE.itemsize:
+            return np.zeros(0, dtype=KLINE_DTYPE)
+        return np.memmap(path, dtype=KLINE_DTYPE, mode='r', shape=(os.path.getsize(path) // KLINE_DTYPE.itemsize,))
+
+    def append(self, symbol: str, records: np.ndarray, interval_str: str = interval):
+        with open(self.path(symbol, interval_str), 'ab') as f:
+            f.write(np.ascontiguousarray(records, dtype=KLINE_DTYPE).tobytes())
+
+    def rewrite(self, symbol: str, records: np.ndarray, interval_str: str = interval):
+        temp_path = self.path(symbol, interval_str) + '.tmp'
+        with open(temp_path, 'wb') as f:
+            f.write(np.ascontiguousarray(records, dtype=KLINE_DTYPE).tobytes())
+        os.replace(temp_path, self.path(symbol, interval_str))
+
+    def get_klines(self, client, symbol: str, start_ms: int, interval_str: str = interval):
+        '''
+        Returns the closed klines opened at or after start_ms, only the part that isn't cached yet is downloaded.
+        Klines older than start_ms are dropped once they make up more than half the file
+        '''
+        with self.lock(symbol, interval_str):
+            now_ms = int(time.time() * 1000)
+            cached = self.load(symbol, interval_str)
+            if len(cached) == 0:
+                log.info(f'get_klines() - {symbol} nothing cached yet, downloading the full range')
+                self.rewrite(symbol, parse_klines(client.futures_historical_klines(symbol, interval_str, start_str=start_ms), now_ms), interval_str)
+            elif start_ms > int(cached['Open_time'][-1]):
+                ## Cached klines are all older than the range asked for, the gap since the last run is never needed
+                log.info(f'get_klines() - {symbol} cache is older than the range, downloading the full range')
+                self.rewrite(symbol, parse_klines(client.futures_historical_klines(symbol, interval_str, start_str=start_ms), now_ms), interval_str)
+            else:
+                first_open_time, last_open_time = int(cached['Open_time'][0]), int(cached['Open_time'][-1])
+                downloaded = 0
+                if start_ms < first_open_time:
+                    head = parse_klines(client.futures_historical_klines(symbol, interval_str, start_str=start_ms, end_str=first_open_time - 1), now_ms)
+                    head = head[head['Open_time'] < first_open_time]
+                    if len(head):
+                        self.rewrite(symbol, np.concatenate((head, cached)), interval_str)
+                        downloaded += len(head)
+                tail = parse_klines(client.futures_historical_klines(symbol, interval_str, start_str=last_open_time + 1), now_ms)
+                tail = tail[tail['Open_time'] > last_open_time]
+                if len(tail):
+                    self.append(symbol, tail, interval_str)
+                    downloaded += len(tail)
+                log.info(f'get_klines() - {symbol} {len(cached)} klines from cache, {downloaded} downloaded')
+            cached = self.load(symbol, interval_str)
+            start = np.searchsorted(cached['Open_time'], start_ms)
+            if start > len(cached) - start:
+                self.rewrite(symbol, np.array(cached[start:]), interval_str)
+                cached, start = self.load(symbol, interval_str), 0
+            return cached[start:]
+
+
+class CachedClient:
+    ''' Stand-in for binance.client.Client that serves historical klines from the KlineCache, no network required '''
+    def __init__(self, kline_cache: KlineCache):
+        self.kline_cache = kline_cache
+
+    def futures_historical_klines(self, symbol: str, interval: str, start_str=None, end_str=None, limit=None):
+        records = self.kline_cache.load(symbol, interval)
+        start_ms = start_str if isinstance(start_str, int) else buffer_start_ms(start_str, interval) if start_str else 0
+        end_ms = end_str if isinstance(end_str, int) else np.iinfo(np.int64).max
+        records = records[(records['Open_time'] >= start_ms) & (records['Open_time'] <= end_ms)]
+        return [[int(record['Open_time']), str(record['Open']), str(record['High']), str(record['Low']), str(record['Close']), str(record['Volume']),
+                 int(record['Date']), str(record['Volume']), 0, '0', '0', '0'] for record in records]
+
+    def futures_ping(self):
+        return {}
+
+
+def buffer_start_ms(buffer_str: str, interval_str: str = interval):
+    ''' Open time of the first candle covered by a binance start string such as '3 hours ago' '''
+    interval_ms = interval_to_minutes(interval_str) * 60_000
+    now_ms = int(time.time() * 1000)
+    return (now_ms // interval_ms - candles_in_buffer(buffer_str, interval_str)) * interval_ms
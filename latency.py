@@ -0,0 +1,102 @@
+import math
+import signal
+import time
+from threading import Lock
+from tabulate import tabulate
+from configuration import *
+from logger import *
+
+BUCKETS_PER_OCTAVE = 8  ## ~9% wide buckets
+MIN_SECONDS = 1e-6  ## everything under a microsecond lands in the first bucket
+NUMBER_OF_BUCKETS = BUCKETS_PER_OCTAVE * 40  ## up to ~12 days
+
+
+class LatencyHistogram:
+    ''' Log-bucketed histogram, recording is one log2 and a counter increment '''
+    def __init__(self):
+        self.counts = [0] * NUMBER_OF_BUCKETS
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.lock = Lock()
+
+    def record(self, seconds: float):
+        bucket = 0 if seconds <= MIN_SECONDS else min(NUMBER_OF_BUCKETS - 1, int(math.log2(seconds / MIN_SECONDS) * BUCKETS_PER_OCTAVE))
+        with self.lock:
+            self.counts[bucket] += 1
+            self.count += 1
+            self.total += seconds
+            if seconds > self.max:
+                self.max = seconds
+
+    def percentile(self, percent: float):
+        ''' Upper edge of the bucket holding the percentile, within a bucket width of the exact value '''
+        with self.lock:
+            target = math.ceil(self.count * percent / 100)
+            seen = 0
+            for bucket, count in enumerate(self.counts):
+                seen += count
+                if count and seen >= target:
+                    return min(self.max, MIN_SECONDS * 2 ** ((bucket + 1) / BUCKETS_PER_OCTAVE))
+        return 0.0
+
+    def summary(self):
+        ''' count and milliseconds for the mean, p50, p90, p99 and max '''
+        if self.count == 0:
+            return {'count': 0}
+        return {'count': self.count, 'mean': 1000 * self.total / self.count, 'p50': 1000 * self.percentile(50),
+                'p90': 1000 * self.percentile(90), 'p99': 1000 * self.percentile(99), 'max': 1000 * self.max}
+
+
+class LatencyTracer:
+    ''' One histogram per pipeline stage, each process has its own tracer '''
+    def __init__(self, enabled: bool = latency_tracing):
+        self.enabled = enabled
+        self.histograms = {}
+        self.lock = Lock()
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+
+    def record(self, stage: str, seconds: float):
+        if not self.enabled:
+            return
+        histogram = self.histograms.get(stage)
+        if histogram is None:
+            with self.lock:
+                histogram = self.histograms.setdefault(stage, LatencyHistogram())
+        histogram.record(seconds)
+
+    def since(self, stage: str, start: float):
+        ''' Records the time elapsed since a time.perf_counter() start '''
+        self.record(stage, time.perf_counter() - start)
+
+    def since_epoch(self, stage: str, epoch_seconds: float):
+        ''' Records the time elapsed since a wall clock timestamp, used for stages that cross processes '''
+        self.record(stage, max(0.0, time.time() - epoch_seconds))
+
+    def summary(self):
+        with self.lock:
+            stages = sorted(self.histograms)
+        return {stage: self.histograms[stage].summary() for stage in stages}
+
+    def dump(self, *args):
+        ''' Logs the percentile table, also used as the SIGUSR1 handler '''
+        summary = self.summary()
+        table = {'Stage': [], 'Count': [], 'Mean ms': [], 'p50 ms': [], 'p90 ms': [], 'p99 ms': [], 'Max ms': []}
+        for stage, values in summary.items():
+            if values['count'] == 0:
+                continue
+            for column, key in [('Stage', None), ('Count', 'count'), ('Mean ms', 'mean'), ('p50 ms', 'p50'), ('p90 ms', 'p90'), ('p99 ms', 'p99'), ('Max ms', 'max')]:
+                table[column].append(stage if key is None else round(values[key], 3))
+        log.info(f'Latency summary (pid {os.getpid()}):\n' + tabulate(table, headers='keys', tablefmt='github'))
+        return summary
+
+    def install_dump_signal(self):
+        ''' kill -USR1 <pid> dumps the summary, must be called from the main thread '''
+        if hasattr(signal, 'SIGUSR1'):
+            signal.signal(signal.SIGUSR1, self.dump)
+
+
+tracer = LatencyTracer()
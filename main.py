@@ -6,6 +6,11 @@ from configuration import buffer  # explicitly importing to remove a warning
 
 from helper import *
 from trademanager import *
+from signalchannel import SignalChannel
+from latency import tracer
+from metrics import metrics, MetricsServer
+from simexchange import SimulatedExchange, SimulatedSocketManager
+from shards import ShardSupervisor
 from threading import Thread
 import multiprocessing
 from queue import Queue
@@ -13,7 +18,20 @@ import os
 
 os.environ['TYPE_CHECKING'] = 'False'
 
+
+def log_exchange_stats(exchange: SimulatedExchange, period: float = 60):
+    ''' Logs the simulated exchange order throughput every period seconds '''
+    while True:
+        time.sleep(period)
+        stats = exchange.stats()
+        log.info(f"log_exchange_stats() - {stats['orders']} orders ({round(stats['orders_per_second'], 2)}/s), "
+                 f"{stats['fills']} fills, {stats['cancels']} cancels, {stats['rejects']} rejects, "
+                 f"{stats['open_positions']} open positions, balance {round(stats['balance'], 2)}")
+
+
 if __name__ == '__main__':
+    if simulate_exchange and simulated_symbols:
+        symbols_to_trade = [f'SIM{i}USDT' for i in range(simulated_symbols)]
     log.info(f'Configuration:\nleverage: {leverage}\n'
              f'interval: {interval}\nSL mult of ATR: {SL_mult}\n'
              f'symbols to trade: {symbols_to_trade}\n'
@@ -23,31 +41,79 @@ if __name__ == '__main__':
     if os.name == 'nt':
         asyncio.set_event_loop_policy(asyncio.WindowsSelectorEventLoopPolicy())
     pp = PrettyPrinter()
+    tracer.install_dump_signal()
     Bots: [tradingbot.Bot] = []
-    signal_queue = multiprocessing.Queue()
+    exchange = None
+    if simulate_exchange:
+        ## Offline load test, the whole pipeline runs in this process against the simulated exchange
+        exchange = SimulatedExchange(symbols_to_trade, latency=simulated_latency, event_latency=simulated_latency)
+        socket_manager = SimulatedSocketManager(exchange, simulated_kline_period)
+        python_binance_client = exchange
+        client = CustomClient(python_binance_client, twm=socket_manager, offline=True)
+    else:
+        python_binance_client = Client(api_key=API_KEY, api_secret=API_SECRET, testnet=True)
+        ## Sharded, the Bots run in their own processes with a client each
+        client = CustomClient(python_binance_client) if not bot_shards else None
+    signal_queue = SignalChannel(len(symbols_to_trade)) if coalesce_signals else multiprocessing.Queue()
     print_trades_q = multiprocessing.Queue()
 
-    python_binance_client = Client(api_key=API_KEY, api_secret=API_SECRET, testnet=True)
-    client = CustomClient(python_binance_client)
+    metrics_q = None
+    if metrics_port:
+        ## The TradeManager and shard processes push their metrics here, all are served on one local endpoint
+        metrics_q = multiprocessing.Queue()
+        if coalesce_signals:
+            metrics.add_collector(lambda: [('signal_queue_depth', (), signal_queue.pending())])
+        MetricsServer(metrics, metrics_q).start()
 
-    client.set_leverage(symbols_to_trade)
+    supervisor = None
+    if client is None:
+        ## Each shard sets the leverage, starts the sockets and joins the history of its own symbols
+        supervisor = ShardSupervisor(symbols_to_trade, bot_shards, signal_queue, print_trades_q, metrics_q)
+        supervisor.start()
+    else:
+        client.set_leverage(symbols_to_trade)
 
-    ## Initialize a bot for each coin we're trading
-    client.setup_bots(Bots, symbols_to_trade, signal_queue, print_trades_q)
-    client.start_websockets(Bots)
+        ## Initialize a bot for each coin we're trading
+        client.setup_bots(Bots, symbols_to_trade, signal_queue, print_trades_q)
+        client.start_websockets(Bots)
 
     ## Initialize Trade manager for order related tasks
     TM = None
-    new_trade_loop = multiprocessing.Process(target=start_new_trades_loop_multiprocess, args=(python_binance_client, signal_queue, print_trades_q))
+    if exchange is not None:
+        TM = TradeManager(python_binance_client, signal_queue, print_trades_q, offline=True, twm=socket_manager)
+        new_trade_loop = Thread(target=TM.new_trades_loop)
+        exchange_stats_thread = Thread(target=log_exchange_stats, args=(exchange,))
+        exchange_stats_thread.daemon = True
+        exchange_stats_thread.start()
+    else:
+        new_trade_loop = multiprocessing.Process(target=start_new_trades_loop_multiprocess, args=(python_binance_client, signal_queue, print_trades_q, metrics_q))
     new_trade_loop.start()
 
-    ## Thread to ping the server & reconnect websockets
-    ping_server_reconnect_sockets_thread = Thread(target=client.ping_server_reconnect_sockets, args=(Bots,))
-    ping_server_reconnect_sockets_thread.daemon = True
-    ping_server_reconnect_sockets_thread.start()
+    if supervisor is not None:
+        ## Thread that restarts and rebalances failed shards
+        supervise_thread = Thread(target=supervisor.supervise)
+        supervise_thread.daemon = True
+        supervise_thread.start()
+    else:
+        ## Thread to ping the server & reconnect websockets
+        ping_server_reconnect_sockets_thread = Thread(target=client.ping_server_reconnect_sockets, args=(Bots,))
+        ping_server_reconnect_sockets_thread.daemon = True
+        ping_server_reconnect_sockets_thread.start()
+
+        ## Thread to reconcile the local position & open order cache with the exchange
+        if client.account_state is not None:
+            reconcile_account_state_thread = Thread(target=client.reconcile_account_state_loop)
+            reconcile_account_state_thread.daemon = True
+            reconcile_account_state_thread.start()
+
+        ## Thread that snapshots the Bots for a warm restart
+        if checkpoint_dir and exchange is None:
+            checkpoint_bots_thread = Thread(target=client.checkpoint_bots_loop, args=(Bots,))
+            checkpoint_bots_thread.daemon = True
+            checkpoint_bots_thread.start()
 
-    ## Combine data collected from websockets with historical data, so we have a buffer of data to calculate signals
-    combine_data_thread = Thread(target=client.combine_data, args=(Bots, symbols_to_trade, buffer))
-    combine_data_thread.daemon = True
-    combine_data_thread.start()
-    new_trade_loop.join()
\ No newline at end of file
+        ## Combine data collected from websockets with historical data, so we have a buffer of data to calculate signals
+        combine_data_thread = Thread(target=client.combine_data, args=(Bots, symbols_to_trade, buffer))
+        combine_data_thread.daemon = True
+        combine_data_thread.start()
+    new_trade_loop.join()
@@ -0,0 +1,148 @@
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from threading import Thread, Lock
+from configuration import *
+from logger import *
+from latency import tracer
+
+## Latency stages exported as prometheus summaries, every other stage stays in the latency dump only
+SUMMARY_STAGES = {'indicator_update': 'bot_indicator_seconds', 'decision': 'bot_decision_seconds',
+                  'kline_close_to_entry_ack': 'trade_kline_close_to_entry_ack_seconds', 'rest.': 'rest_request_seconds'}
+
+
+class MetricsRegistry:
+    '''
+    Counters and gauges of one process. inc / set are a dict update under a lock, everything else happens
+    when the registry is scraped: collectors add gauges computed on demand and the latency tracer adds summaries
+    '''
+    def __init__(self, process: str = 'bot'):
+        self.process = process
+        self.counters = {}  ## (name, labels): value, labels is a tuple of (label, value) pairs
+        self.gauges = {}
+        self.collectors = []  ## callables returning [(name, labels, value)] gauges
+        self.lock = Lock()
+
+    def reset(self, process: str):
+        ''' Starts a child process with an empty registry, a forked process inherits the parent's '''
+        with self.lock:
+            self.process = process
+            self.counters, self.gauges = {}, {}
+            self.collectors = []
+
+    def inc(self, name: str, labels: tuple = (), value: float = 1):
+        with self.lock:
+            self.counters[(name, labels)] = self.counters.get((name, labels), 0) + value
+
+    def set(self, name: str, value: float, labels: tuple = ()):
+        with self.lock:
+            self.gauges[(name, labels)] = value
+
+    def add_collector(self, collector):
+        self.collectors.append(collector)
+
+    def samples(self):
+        ''' [(name, type, labels, value)] for everything in the registry, picklable so it can cross processes '''
+        process_label = (('process', self.process),)
+        with self.lock:
+            samples = [(name, 'counter', process_label + labels, value) for (name, labels), value in self.counters.items()]
+            samples += [(name, 'gauge', process_label + labels, value) for (name, labels), value in self.gauges.items()]
+        for collector in self.collectors:
+            try:
+                samples += [(name, 'gauge', process_label + labels, value) for name, labels, value in collector()]
+            except Exception as e:
+                log.warning(f'samples() - metrics collector failed, Error: {e}')
+        for stage, histogram in list(tracer.histograms.items()):
+            name = next((metric for prefix, metric in SUMMARY_STAGES.items() if stage.startswith(prefix)), None)
+            if name is None or histogram.count == 0:
+                continue
+            labels = process_label + ((('method', stage[len('rest.'):]),) if stage.startswith('rest.') else ())
+            for quantile in (50, 90, 99):
+                samples.append((name, 'summary', labels + (('quantile', str(quantile / 100)),), histogram.percentile(quantile)))
+            samples.append((name + '_sum', 'summary', labels, histogram.total))
+            samples.append((name + '_count', 'summary', labels, histogram.count))
+        return samples
+
+
+def metric_family(name: str, metric_type: str):
+    if metric_type == 'summary':
+        for suffix in ('_sum', '_count'):
+            if name.endswith(suffix):
+                return name[:-len(suffix)]
+    return name
+
+
+def render(samples: list):
+    ''' Prometheus text exposition format, samples of one metric family are written together '''
+    families = {}
+    for sample in samples:
+        families.setdefault(metric_family(sample[0], sample[1]), []).append(sample)
+    lines = []
+    for family in sorted(families):
+        lines.append(f'# TYPE {family} {families[family][0][1]}')
+        for name, metric_type, labels, value in families[family]:
+            label_text = ','.join(f'{label}="{label_value}"' for label, label_value in labels)
+            lines.append(f'{name}{{{label_text}}} {float(value)}')
+    return '\n'.join(lines) + '\n'
+
+
+class MetricsServer:
+    '''
+    Serves /metrics for the main process registry plus the latest snapshot every other process pushed on metrics_q
+    '''
+    def __init__(self, registry: MetricsRegistry, metrics_q=None, port: int = metrics_port):
+        self.registry = registry
+        self.metrics_q = metrics_q
+        self.remote = {}  ## process: latest samples
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path.split('?')[0] != '/metrics':
+                    self.send_error(404)
+                    return
+                body = server.render().encode()
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, *args):
+                pass
+
+        self.http_server = ThreadingHTTPServer(('127.0.0.1', port), Handler)
+        self.port = self.http_server.server_address[1]
+
+    def render(self):
+        samples = self.registry.samples()
+        for process_samples in list(self.remote.values()):
+            samples += process_samples
+        return render(samples)
+
+    def receive_loop(self):
+        ''' Keeps the newest snapshot pushed by each other process '''
+        while True:
+            process, samples = self.metrics_q.get()
+            self.remote[process] = samples
+
+    def start(self):
+        for target in [self.http_server.serve_forever] + ([self.receive_loop] if self.metrics_q is not None else []):
+            thread = Thread(target=target)
+            thread.daemon = True
+            thread.start()
+        log.info(f'MetricsServer.start() - serving metrics on http://127.0.0.1:{self.port}/metrics')
+
+
+def push_metrics_loop(registry: MetricsRegistry, metrics_q, period: float = metrics_push_period):
+    ''' Runs in processes without the server, sends a snapshot of their registry every period seconds '''
+    while True:
+        time.sleep(period)
+        try:
+            metrics_q.put((registry.process, registry.samples()))
+        except Exception as e:
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+            log.warning(f'push_metrics_loop() - error pushing metrics, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
+
+
+metrics = MetricsRegistry()
@@ -0,0 +1,105 @@
+import itertools
+import multiprocessing
+import random
+import time
+from functools import lru_cache
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+import pandas as pd
+from ta.momentum import rsi
+from ta.trend import sma_indicator
+from tabulate import tabulate
+import backtester
+from indicators import wilder_atr
+from configuration import *
+from logger import *
+
+PARAMETERS = ['RSI_window', 'SMA_window', 'RSI_lower_bound', 'RSI_upper_bound', 'SL_mult']
+worker_candles = {}  ## per worker process: shared memory block and the Open/High/Low/Close views into it
+
+
+def init_worker(shared_memory_name: str, shape: (int, int)):
+    ''' Attaches a pool worker to the shared candle arrays, nothing is pickled per task '''
+    worker_candles['shared_memory'] = SharedMemory(name=shared_memory_name)
+    candles = np.ndarray(shape, dtype=np.float64, buffer=worker_candles['shared_memory'].buf)
+    worker_candles['Open'], worker_candles['High'], worker_candles['Low'], worker_candles['Close'] = candles
+    SMA_series.cache_clear()
+    RSI_series.cache_clear()
+    ATR_series.cache_clear()
+
+
+## Indicator series only depend on their window, so each worker computes them once and reuses them for every combination
+@lru_cache(maxsize=None)
+def SMA_series(window: int):
+    return sma_indicator(pd.Series(worker_candles['Close']), window=window).to_numpy()
+
+
+@lru_cache(maxsize=None)
+def RSI_series(window: int):
+    return rsi(pd.Series(worker_candles['Close']), window=window).to_numpy()
+
+
+@lru_cache(maxsize=None)
+def ATR_series(window: int):
+    return wilder_atr(worker_candles['High'], worker_candles['Low'], worker_candles['Close'], window)
+
+
+def run_group(RSI_window: int, SMA_window: int, combinations: [(float, float, float)]):
+    ''' Backtests every (RSI_lower_bound, RSI_upper_bound, SL_mult) combination that shares the same indicator windows '''
+    rows = []
+    SMA, RSI, ATR = SMA_series(SMA_window), RSI_series(RSI_window), ATR_series(RSI_window)
+    for RSI_lower_bound, RSI_upper_bound, SL_mult in combinations:
+        try:
+            results = backtester.backtest_arrays(worker_candles['Open'], worker_candles['High'], worker_candles['Low'], worker_candles['Close'],
+                                                 SMA, RSI, ATR, RSI_lower_bound, RSI_upper_bound, SL_mult)
+            rows.append({'RSI_window': RSI_window, 'SMA_window': SMA_window, 'RSI_lower_bound': RSI_lower_bound,
+                         'RSI_upper_bound': RSI_upper_bound, 'SL_mult': SL_mult, 'Sharpe': results['Sharpe'],
+                         'Max drawdown': results['Max drawdown'], 'Return': results['Return'], 'Trades': results['Trades']})
+        except Exception as e:
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+            log.warning(f'run_group() - Error with RSI_window: {RSI_window}, SMA_window: {SMA_window}, bounds: {RSI_lower_bound}/{RSI_upper_bound}, '
+                        f'SL_mult: {SL_mult}, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
+    return rows
+
+
+def parameter_combinations(grid: {str: list}, samples: int = 0, seed: int = 0):
+    ''' Full grid when samples is 0, otherwise a random sample of it, combinations with lower bound >= upper bound are skipped '''
+    combinations = [dict(zip(PARAMETERS, values)) for values in itertools.product(*(grid[name] for name in PARAMETERS))]
+    combinations = [combination for combination in combinations if combination['RSI_lower_bound'] < combination['RSI_upper_bound']]
+    if 0 < samples < len(combinations):
+        combinations = random.Random(seed).sample(combinations, samples)
+    return combinations
+
+
+def optimize(Open, High, Low, Close, grid: {str: list} = optimizer_grid, samples: int = optimizer_samples, processes: int = optimizer_processes):
+    ''' Runs the sweep on a process pool and returns the results ranked by Sharpe, then by drawdown '''
+    combinations = parameter_combinations(grid, samples)
+    groups = {}
+    for combination in combinations:
+        groups.setdefault((combination['RSI_window'], combination['SMA_window']), []).append(
+            (combination['RSI_lower_bound'], combination['RSI_upper_bound'], combination['SL_mult']))
+    log.info(f'optimize() - Backtesting {len(combinations)} combinations in {len(groups)} indicator groups...')
+
+    candles = np.vstack([np.asarray(values, dtype=np.float64) for values in (Open, High, Low, Close)])
+    shared_memory = SharedMemory(create=True, size=candles.nbytes)
+    rows = []
+    try:
+        np.ndarray(candles.shape, dtype=np.float64, buffer=shared_memory.buf)[:] = candles
+        with multiprocessing.Pool(processes=processes or None, initializer=init_worker, initargs=(shared_memory.name, candles.shape)) as pool:
+            for group_rows in pool.starmap(run_group, [(RSI_window, SMA_window, group) for (RSI_window, SMA_window), group in groups.items()]):
+                rows.extend(group_rows)
+    finally:
+        shared_memory.close()
+        shared_memory.unlink()
+    results = pd.DataFrame(rows, columns=PARAMETERS + ['Sharpe', 'Max drawdown', 'Return', 'Trades'])
+    return results.sort_values(['Sharpe', 'Max drawdown'], ascending=[False, True]).reset_index(drop=True)
+
+
+if __name__ == '__main__':
+    for symbol in symbols_to_trade:
+        Date, Open, Close, High, Low, Volume = backtester.download_history(symbol)
+        start = time.perf_counter()
+        results = optimize(Open, High, Low, Close)
+        log.info(f'optimizer - {symbol}: {len(results)} combinations over {len(Close)} candles in {round(time.perf_counter() - start, 3)}s\n' +
+                 tabulate(results.head(20), headers='keys', tablefmt='github', showindex=False))
@@ -0,0 +1,67 @@
+import asyncio
+from metrics import metrics
+from configuration import *
+from logger import *
+
+BATCH_ORDER_LIMIT = 5  ## orders binance accepts in one batchOrders request
+
+
+class BatchOrderError(Exception):
+    ''' One order of a batch was rejected, the other orders of the request may still have been placed '''
+    def __init__(self, code: int, message: str):
+        super().__init__(f'APIError(code={code}): {message}')
+        self.code = code
+        self.message = message
+
+
+def batch_order_params(order: dict):
+    ''' batchOrders is sent as JSON with every parameter as a string, booleans in lower case '''
+    return {name: str(value).lower() if isinstance(value, bool) else str(value) for name, value in order.items()}
+
+
+def order_batches(orders: [dict]):
+    return [orders[i:i + BATCH_ORDER_LIMIT] for i in range(0, len(orders), BATCH_ORDER_LIMIT)]
+
+
+def batch_results(responses: list):
+    ''' The sub-responses of a batch in order, each either the placed order or a BatchOrderError '''
+    results = []
+    for response in responses:
+        if isinstance(response, dict) and 'orderId' in response:
+            results.append(response)
+        else:
+            results.append(BatchOrderError(response.get('code'), response.get('msg')) if isinstance(response, dict) else BatchOrderError(None, str(response)))
+    metrics.inc('batch_orders_total', (('result', 'ok'),), sum(1 for result in results if isinstance(result, dict)))
+    metrics.inc('batch_orders_total', (('result', 'rejected'),), sum(1 for result in results if isinstance(result, Exception)))
+    return results
+
+
+def place_orders(client, orders: [dict], batch: bool = batch_orders):
+    '''
+    Places orders in as few batchOrders requests as binance allows (one at a time when batch is False or there's only one).
+    Returns one result per order, in order: the placed order, or the exception it failed with. A request that fails
+    as a whole fails every order in it, a rejected sub-order doesn't affect the others
+    '''
+    results = []
+    for orders_batch in order_batches(orders) if batch else [[order] for order in orders]:
+        try:
+            if len(orders_batch) == 1:
+                results.append(client.futures_create_order(**orders_batch[0]))
+            else:
+                results += batch_results(client.futures_place_batch_order(batchOrders=[batch_order_params(order) for order in orders_batch]))
+        except Exception as e:
+            results += [e] * len(orders_batch)
+    return results
+
+
+async def place_orders_async(executor, orders: [dict], batch: bool = batch_orders):
+    ''' place_orders on an AsyncOrderExecutor, without batching the orders are sent concurrently '''
+    async def place(orders_batch: [dict]):
+        try:
+            if len(orders_batch) == 1:
+                return [await executor.request('futures_create_order', **orders_batch[0])]
+            return batch_results(await executor.request('futures_place_batch_order', batchOrders=[batch_order_params(order) for order in orders_batch]))
+        except Exception as e:
+            return [e] * len(orders_batch)
+    results = await asyncio.gather(*[place(orders_batch) for orders_batch in (order_batches(orders) if batch else [[order] for order in orders])])
+    return [result for batch_result in results for result in batch_result]
@@ -0,0 +1,42 @@
+import time
+from threading import Lock
+from configuration import *
+from logger import *
+
+
+class WeightBudget:
+    ''' Thread-safe token bucket for binance request weight, refilled continuously up to weight_limit per minute '''
+    def __init__(self, weight_limit: int = request_weight_limit, period: float = 60.0):
+        self.weight_limit = weight_limit
+        self.refill_rate = weight_limit / period
+        self.tokens = float(weight_limit)
+        self.last_refill = time.monotonic()
+        self.lock = Lock()
+
+    def refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.weight_limit, self.tokens + (now - self.last_refill) * self.refill_rate)
+        self.last_refill = now
+
+    def try_acquire(self, weight: float):
+        ''' Takes weight from the bucket if it's available, returns 0 on success or the seconds to wait otherwise '''
+        with self.lock:
+            self.refill()
+            weight = min(weight, self.weight_limit)
+            if self.tokens >= weight:
+                self.tokens -= weight
+                return 0
+            return (weight - self.tokens) / self.refill_rate
+
+    def acquire(self, weight: float):
+        ''' Blocks until weight can be spent '''
+        while True:
+            wait = self.try_acquire(weight)
+            if wait == 0:
+                return
+            time.sleep(wait)
+
+
+def historical_klines_weight(number_of_candles: int):
+    ''' Request weight of futures_historical_klines, it pages 1000 klines per request at weight 5 each '''
+    return 5 * max(1, -(-number_of_candles // 1000))
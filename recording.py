@@ -0,0 +1,67 @@
+import atexit
+import heapq
+import json
+import struct
+import time
+from threading import Lock
+from configuration import *
+from logger import *
+
+KLINE_STREAM = 0
+USER_STREAM = 1
+STREAM_NAMES = {KLINE_STREAM: 'kline', USER_STREAM: 'user'}
+## Every record is <receive time, stream, payload length> followed by the compact JSON of the raw message
+RECORD_HEADER = struct.Struct('<dBI')
+
+
+class StreamRecorder:
+    ''' Appends raw websocket messages to a recording file, safe to share between socket threads '''
+    def __init__(self, path: str, flush_period: float = 1.0):
+        self.path = path
+        self.file = open(path, 'ab')
+        self.lock = Lock()
+        self.flush_period = flush_period
+        self.last_flush = time.monotonic()
+        atexit.register(self.close)
+
+    def record(self, stream: int, msg):
+        body = json.dumps(msg, separators=(',', ':')).encode()
+        with self.lock:
+            self.file.write(RECORD_HEADER.pack(time.time(), stream, len(body)) + body)
+            if time.monotonic() - self.last_flush > self.flush_period:
+                self.file.flush()
+                self.last_flush = time.monotonic()
+
+    def wrap(self, stream: int, callback):
+        ''' Socket callback that records the message before handing it to callback '''
+        def recording_callback(msg):
+            try:
+                self.record(stream, msg)
+            except Exception as e:
+                log.warning(f'StreamRecorder.record() - error recording message, Error: {e}')
+            return callback(msg)
+        return recording_callback
+
+    def close(self):
+        with self.lock:
+            if not self.file.closed:
+                self.file.close()
+
+
+def read_records(path: str):
+    ''' Yields (receive time, stream, msg) from a recording, a truncated last record is ignored '''
+    with open(path, 'rb') as f:
+        data = f.read()
+    position = 0
+    while position + RECORD_HEADER.size <= len(data):
+        received, stream, length = RECORD_HEADER.unpack_from(data, position)
+        position += RECORD_HEADER.size
+        if position + length > len(data):
+            break
+        yield received, stream, json.loads(data[position:position + length])
+        position += length
+
+
+def merge_recordings(paths: [str]):
+    ''' Recordings of both processes merged back into receive order '''
+    return heapq.merge(*[read_records(path) for path in paths if os.path.exists(path)], key=lambda record: record[0])
@@ -0,0 +1,161 @@
+import argparse
+import queue
+import time
+from threading import Thread
+from tabulate import tabulate
+from configuration import *
+from logger import *
+from latency import LatencyHistogram
+from recording import merge_recordings, KLINE_STREAM, USER_STREAM, STREAM_NAMES
+from trademanager import TradeManager
+import tradingbot
+
+class ReplayClient:
+    ''' Minimal offline stand-in for binance.client.Client, accepts every order and holds no positions '''
+    def __init__(self, balance: float = 1000.0):
+        self.balance = balance
+        self.next_order_id = 1
+        self.entry_prices = {}  ## symbol: price of its last order, reported as the entry price of its (flat) position
+
+    def futures_create_order(self, **params):
+        order = {'orderId': self.next_order_id, 'status': 'NEW', **params}
+        self.next_order_id += 1
+        if 'symbol' in params:
+            self.entry_prices[params['symbol']] = params.get('price', params.get('stopPrice', self.futures_symbol_ticker(params['symbol'])['price']))
+        return order
+
+    def futures_place_batch_order(self, batchOrders: [dict], **params):
+        return [self.futures_create_order(**order) for order in batchOrders]
+
+    def futures_cancel_order(self, **params):
+        return {'orderId': params.get('orderId'), 'status': 'CANCELED'}
+
+    def futures_cancel_all_open_orders(self, **params):
+        return {'code': 200}
+
+    def futures_position_information(self, symbol: str = None, **params):
+        ''' One flat position per symbol ordered (or the one asked for), the entry price is that of its last order '''
+        symbols = [symbol] if symbol is not None else list(self.entry_prices)
+        return [{'symbol': symbol, 'positionAmt': '0', 'entryPrice': str(self.entry_prices.get(symbol, 0)), 'notional': '0'} for symbol in symbols]
+
+    def futures_get_open_orders(self, **params):
+        return []
+
+    def futures_account_balance(self, **params):
+        return [{'asset': 'USDT', 'balance': str(self.balance)}]
+
+    def futures_symbol_ticker(self, symbol: str = None):
+        return {'symbol': symbol, 'price': '1'}
+
+    def futures_historical_klines(self, symbol: str, interval_str: str, start_str=None, end_str=None, **params):
+        ''' Nothing to backfill offline, gaps in a recording are replayed as they were '''
+        return []
+
+    def futures_ping(self):
+        return {}
+
+
+class DiscardQueue:
+    ''' Stands in for a queue nobody reads during replay '''
+    def put(self, item):
+        pass
+
+
+class StreamReplayer:
+    '''
+    Feeds a recording back into Bot.handle_socket_message and TradeManager.monitor_trades.
+    speed 1 replays in real time, N replays N times faster and 0 as fast as the callbacks allow
+    '''
+    def __init__(self, paths: [str], speed: float = 0):
+        self.paths = paths
+        self.speed = speed
+        self.latency = {stream: LatencyHistogram() for stream in STREAM_NAMES}
+
+    def replay(self, kline_callback=None, user_callback=None):
+        callbacks = {KLINE_STREAM: kline_callback, USER_STREAM: user_callback}
+        first_received = None
+        start = time.perf_counter()
+        for received, stream, msg in merge_recordings(self.paths):
+            if first_received is None:
+                first_received = received
+            if self.speed > 0:
+                wait = (received - first_received) / self.speed - (time.perf_counter() - start)
+                if wait > 0:
+                    time.sleep(wait)
+            callback = callbacks[stream]
+            if callback is None:
+                continue
+            message_start = time.perf_counter()
+            callback(msg)
+            self.latency[stream].record(time.perf_counter() - message_start)
+        return self.report(time.perf_counter() - start)
+
+    def report(self, seconds: float):
+        messages = sum(histogram.count for histogram in self.latency.values())
+        return {'messages': messages, 'seconds': seconds, 'messages_per_second': messages / seconds if seconds else 0.0,
+                'latency_ms': {STREAM_NAMES[stream]: histogram.summary() for stream, histogram in self.latency.items()}}
+
+
+class ReplayHarness:
+    '''
+    Offline Bots (and optionally a TradeManager) wired to a stand-in client. A Bot starts deciding once
+    warmup_candles closed klines of its symbol have been replayed, which stands in for the historical bootstrap
+    '''
+    def __init__(self, client=None, warmup_candles: int = SMA_window + 1, trade_manager: bool = False):
+        self.client = client if client is not None else ReplayClient()
+        self.warmup_candles = warmup_candles
+        self.bots_by_symbol = {}
+        self.signal_queue = queue.Queue() if trade_manager else DiscardQueue()
+        self.print_trades_q = queue.Queue() if trade_manager else DiscardQueue()
+        self.trade_manager = None
+        if trade_manager:
+            self.trade_manager = TradeManager(self.client, self.signal_queue, self.print_trades_q, offline=True)
+            new_trades_thread = Thread(target=self.trade_manager.new_trades_loop)
+            new_trades_thread.daemon = True
+            new_trades_thread.start()
+
+    def bot(self, symbol: str):
+        bot = self.bots_by_symbol.get(symbol)
+        if bot is None:
+            bot = tradingbot.Bot(symbol=symbol, Open=[], Close=[], High=[], Low=[], Volume=[], Date=[], OP=3, CP=2,
+                                 index=len(self.bots_by_symbol), tick=0.01, strategy='RSI', TP_SL_choice='x (ATR)',
+                                 SL_mult=SL_mult, TP_mult=1, signal_queue=self.signal_queue, print_trades_q=self.print_trades_q,
+                                 client=self.client)
+            self.bots_by_symbol[symbol] = bot
+        return bot
+
+    def handle_kline_message(self, msg):
+        ''' Same routing as CustomClient.route_kline_message, works for combined and single stream recordings '''
+        data = msg.get('data', msg)
+        bot = self.bot(data['s'])
+        bot.handle_socket_message(data)
+        if not bot.add_hist_complete and len(bot.candles) >= self.warmup_candles:
+            with bot.candles_lock:
+                bot.seed_indicators()
+                bot.add_hist_complete = 1
+
+    def handle_user_message(self, msg):
+        if self.trade_manager is not None:
+            self.trade_manager.monitor_trades(msg)
+
+
+def recording_paths(prefix: str):
+    return [prefix + '.klines', prefix + '.user']
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a recorded kline / user data session offline')
+    parser.add_argument('recording', nargs='?', default=stream_record_file, help='recording prefix, as set in stream_record_file')
+    parser.add_argument('--speed', type=float, default=0, help='1 for real time, N for N times faster, 0 for as fast as possible')
+    parser.add_argument('--trade-manager', action='store_true', help='also run a TradeManager on the stand-in client')
+    args = parser.parse_args()
+
+    harness = ReplayHarness(trade_manager=args.trade_manager)
+    results = StreamReplayer(recording_paths(args.recording), args.speed).replay(harness.handle_kline_message, harness.handle_user_message)
+    table = {'Stream': [], 'Messages': [], 'Mean ms': [], 'p50 ms': [], 'p99 ms': [], 'Max ms': []}
+    for stream, summary in results['latency_ms'].items():
+        if summary['count']:
+            for column, value in zip(table, [stream, summary['count'], summary['mean'], summary['p50'], summary['p99'], summary['max']]):
+                table[column].append(round(value, 4) if isinstance(value, float) else value)
+    log.info(f'replay - {results["messages"]} messages for {len(harness.bots_by_symbol)} symbols in {round(results["seconds"], 3)}s, '
+             f'{round(results["messages_per_second"], 1)} messages/s\n' + tabulate(table, headers='keys', tablefmt='github'))
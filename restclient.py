@@ -0,0 +1,167 @@
+import heapq
+import itertools
+import time
+from contextlib import contextmanager
+from threading import Condition, local
+from requests.adapters import HTTPAdapter
+from configuration import *
+from logger import *
+from candles import candles_in_buffer, interval_to_minutes
+from ratelimit import WeightBudget, historical_klines_weight
+from latency import tracer
+from metrics import metrics
+
+ORDER_PRIORITY = 0
+DEFAULT_PRIORITY = 1
+HOUSEKEEPING_PRIORITY = 2
+PRIORITY_NAMES = {ORDER_PRIORITY: 'order', DEFAULT_PRIORITY: 'default', HOUSEKEEPING_PRIORITY: 'housekeeping'}
+
+## Requests that place or remove orders always go first, whichever thread sends them
+ORDER_METHODS = {'futures_create_order', 'futures_place_batch_order', 'futures_cancel_order', 'futures_cancel_orders',
+                 'futures_cancel_all_open_orders', 'futures_coin_cancel_all_open_orders'}
+
+
+def historical_klines_request_weight(kwargs: dict):
+    ''' Weight of a futures_historical_klines call from its start/end, start_str is either ms or a '3 hours ago' string '''
+    start, end = kwargs.get('start_str'), kwargs.get('end_str')
+    if isinstance(start, str):
+        return historical_klines_weight(candles_in_buffer(start))
+    if isinstance(start, (int, float)):
+        end = end if isinstance(end, (int, float)) else time.time() * 1000
+        return historical_klines_weight(int((end - start) / (interval_to_minutes() * 60000)) + 1)
+    return historical_klines_weight(1000)
+
+
+## Request weight of the endpoints the bot uses, some are cheaper when scoped to one symbol
+REQUEST_WEIGHTS = {
+    'futures_position_information': lambda kwargs: 5,
+    'futures_account_balance': lambda kwargs: 5,
+    'futures_get_open_orders': lambda kwargs: 1 if 'symbol' in kwargs else 40,
+    'futures_symbol_ticker': lambda kwargs: 1 if 'symbol' in kwargs else 2,
+    'futures_exchange_info': lambda kwargs: 1,
+    'futures_place_batch_order': lambda kwargs: 5,
+    'futures_historical_klines': historical_klines_request_weight,
+}
+
+
+def request_weight(name: str, kwargs: dict):
+    return REQUEST_WEIGHTS[name](kwargs) if name in REQUEST_WEIGHTS else 1
+
+
+class WeightScheduler:
+    '''
+    Hands out request weight from a WeightBudget to waiting threads in priority order,
+    requests of the same priority are served first come first served
+    '''
+    def __init__(self, weight_budget: WeightBudget = None):
+        self.weight_budget = weight_budget if weight_budget is not None else WeightBudget()
+        self.condition = Condition()
+        self.waiting = []  ## heap of (priority, ticket)
+        self.tickets = itertools.count()
+        self.max_queue_depth = 0
+        self.requests = {priority: 0 for priority in PRIORITY_NAMES}
+        self.weight_spent = {priority: 0 for priority in PRIORITY_NAMES}
+        self.seconds_waited = {priority: 0.0 for priority in PRIORITY_NAMES}
+
+    def acquire(self, weight: float, priority: int = DEFAULT_PRIORITY):
+        ''' Blocks until every higher priority request has gone out and the weight is available '''
+        entry = (priority, next(self.tickets))
+        start = time.monotonic()
+        with self.condition:
+            heapq.heappush(self.waiting, entry)
+            self.max_queue_depth = max(self.max_queue_depth, len(self.waiting))
+            ## A new head may have arrived, let the waiting threads re-check
+            self.condition.notify_all()
+            try:
+                while True:
+                    if self.waiting[0] == entry:
+                        wait = self.weight_budget.try_acquire(weight)
+                        if wait == 0:
+                            break
+                        self.condition.wait(wait)
+                    else:
+                        self.condition.wait()
+            finally:
+                self.waiting.remove(entry)
+                heapq.heapify(self.waiting)
+                self.condition.notify_all()
+            self.requests[priority] += 1
+            self.weight_spent[priority] += weight
+            self.seconds_waited[priority] += time.monotonic() - start
+
+    def gauges(self):
+        ''' Metrics collector for the queue depth and the weight left '''
+        return [('rest_queue_depth', (('priority', name),), depth) for name, depth in self.queue_depths().items()] + \
+               [('rest_weight_available', (), self.weight_budget.tokens)]
+
+    def queue_depths(self):
+        ''' Number of requests waiting for weight, by priority name '''
+        with self.condition:
+            depths = {name: 0 for name in PRIORITY_NAMES.values()}
+            for priority, ticket in self.waiting:
+                depths[PRIORITY_NAMES[priority]] += 1
+            return depths
+
+    def metrics(self):
+        depths = self.queue_depths()
+        with self.condition:
+            return {'queue_depth': depths, 'max_queue_depth': self.max_queue_depth,
+                    'requests': {PRIORITY_NAMES[p]: n for p, n in self.requests.items()},
+                    'weight_spent': {PRIORITY_NAMES[p]: n for p, n in self.weight_spent.items()},
+                    'seconds_waited': {PRIORITY_NAMES[p]: round(n, 6) for p, n in self.seconds_waited.items()},
+                    'weight_available': self.weight_budget.tokens}
+
+
+class SharedClient:
+    '''
+    Thread-safe wrapper shared by everything in a process that talks to the REST API. Every call waits
+    on the WeightScheduler first and all calls reuse the keep-alive connections of one pooled session.
+    Works with anything exposing the python-binance method names, such as a stand-in pointed at a local server
+    '''
+    def __init__(self, client, scheduler: WeightScheduler = None, pool_size: int = rest_pool_size):
+        self.client = client
+        self.scheduler = scheduler if scheduler is not None else WeightScheduler()
+        self.thread_priority = local()
+        session = getattr(client, 'session', None)
+        if session is not None:
+            adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+
+    @contextmanager
+    def priority(self, priority: int):
+        ''' Sets the priority of every request this thread sends inside the with block '''
+        previous = getattr(self.thread_priority, 'value', DEFAULT_PRIORITY)
+        self.thread_priority.value = priority
+        try:
+            yield self
+        finally:
+            self.thread_priority.value = previous
+
+    def request_priority(self, name: str):
+        if name in ORDER_METHODS:
+            return ORDER_PRIORITY
+        return getattr(self.thread_priority, 'value', DEFAULT_PRIORITY)
+
+    def __getattr__(self, name):
+        if name == 'client':
+            raise AttributeError(name)
+        attribute = getattr(self.client, name)
+        if not callable(attribute) or not name.startswith('futures_'):
+            return attribute
+
+        def scheduled_request(*args, **kwargs):
+            start = time.perf_counter()
+            self.scheduler.acquire(request_weight(name, kwargs), self.request_priority(name))
+            sent = time.perf_counter()
+            tracer.record('rest_weight_wait', sent - start)
+            labels = (('method', name),)
+            metrics.inc('rest_requests_total', labels)
+            try:
+                return attribute(*args, **kwargs)
+            except Exception:
+                metrics.inc('rest_errors_total', labels)
+                raise
+            finally:
+                tracer.since(f'rest.{name}', sent)
+        return scheduled_request
@@ -0,0 +1,158 @@
+import multiprocessing
+import time
+import zlib
+from threading import Thread
+from binance.client import Client
+import tradingbot
+from candles import interval_to_minutes
+from helper import CustomClient
+from latency import tracer
+from metrics import metrics, push_metrics_loop
+from configuration import *
+from logger import *
+
+
+def shard_of(symbol: str, shard_ids: [int]):
+    ''' Stable across processes and runs, unlike hash() '''
+    return shard_ids[zlib.crc32(symbol.encode()) % len(shard_ids)]
+
+
+def assign_shards(symbols: [str], shard_ids: [int]):
+    ''' {shard id: symbols}, every shard id gets an entry even if no symbol hashes to it '''
+    assignment = {shard_id: [] for shard_id in shard_ids}
+    for symbol in symbols:
+        assignment[shard_of(symbol, shard_ids)].append(symbol)
+    return assignment
+
+
+def newest_candle_age(bots: [tradingbot.Bot], started: float):
+    ''' Seconds since the newest candle any Bot of the shard received closed, since the shard started if there's none yet '''
+    newest = max((bot.Date[-1] / 1000 for bot in list(bots) if len(bot.candles)), default=0)
+    return time.time() - max(newest, started)
+
+
+def run_shard(shard_id: int, symbols: [str], indexes: {str: int}, signal_queue, print_trades_q, metrics_q, heartbeats):
+    '''
+    Entry point of a Bot process: its own client, websocket manager, Bots and housekeeping threads, the same startup main.py
+    runs for an unsharded bot. The shard beats its heartbeat slot while its Bots keep receiving candles
+    '''
+    metrics.reset(f'shard_{shard_id}')
+    tracer.reset()
+    tracer.install_dump_signal()
+    started = time.time()
+    heartbeats[shard_id] = started
+    bots: [tradingbot.Bot] = []
+    ## The request weight limit is per account, every shard gets an equal part of what the TradeManager leaves
+    client = CustomClient(Client(api_key=API_KEY, api_secret=API_SECRET, testnet=True), weight_share=(1 - trade_manager_weight_share) / bot_shards)
+    client.set_leverage(symbols)
+    client.setup_bots(bots, symbols, signal_queue, print_trades_q, indexes)
+    client.start_websockets(bots)
+    log.info(f'run_shard() - shard {shard_id} (pid {os.getpid()}) running {len(bots)} symbols')
+    threads = [Thread(target=client.ping_server_reconnect_sockets, args=(bots,)), Thread(target=client.combine_data, args=(bots, symbols, buffer))]
+    if client.account_state is not None:
+        threads.append(Thread(target=client.reconcile_account_state_loop))
+    if checkpoint_dir:
+        threads.append(Thread(target=client.checkpoint_bots_loop, args=(bots, f'shard_{shard_id}')))
+    if metrics_q is not None:
+        threads.append(Thread(target=push_metrics_loop, args=(metrics, metrics_q)))
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    stall_timeout = shard_stall_candles * interval_to_minutes() * 60
+    while True:
+        if newest_candle_age(bots, started) < stall_timeout:
+            heartbeats[shard_id] = time.time()
+        time.sleep(shard_heartbeat_period)
+
+
+class ShardSupervisor:
+    '''
+    Runs the Bots in shards processes, symbols are hashed to a shard and keep their Bot.index (their signal slot) wherever they run.
+    A shard that exits or stops beating its heartbeat is restarted, one restarted more than shard_max_restarts times within
+    shard_restart_window seconds is retired and its symbols are rehashed across the remaining shards
+    '''
+    def __init__(self, symbols: [str], shards: int, signal_queue, print_trades_q, metrics_q=None, target=run_shard):
+        self.indexes = {symbol: i for i, symbol in enumerate(symbols)}
+        self.signal_queue = signal_queue
+        self.print_trades_q = print_trades_q
+        self.metrics_q = metrics_q
+        self.target = target
+        self.heartbeats = multiprocessing.Array('d', shards)
+        self.assignment = assign_shards(symbols, list(range(shards)))
+        self.processes = {}
+        self.restarts = {shard_id: [] for shard_id in self.assignment}
+        metrics.add_collector(self.metric_gauges)
+
+    def metric_gauges(self):
+        return [('shard_symbols', (('shard', str(shard_id)),), len(symbols)) for shard_id, symbols in self.assignment.items()]
+
+    def start_shard(self, shard_id: int):
+        self.heartbeats[shard_id] = time.time()
+        process = multiprocessing.Process(target=self.target, name=f'shard_{shard_id}',
+                                          args=(shard_id, list(self.assignment[shard_id]), self.indexes, self.signal_queue,
+                                                self.print_trades_q, self.metrics_q, self.heartbeats))
+        process.daemon = True
+        process.start()
+        self.processes[shard_id] = process
+        log.info(f'start_shard() - shard {shard_id} started (pid {process.pid}) with {len(self.assignment[shard_id])} symbols')
+
+    def stop_shard(self, shard_id: int):
+        process = self.processes.pop(shard_id, None)
+        if process is not None and process.is_alive():
+            process.terminate()
+            process.join(10)
+            if process.is_alive():
+                process.kill()
+
+    def start(self):
+        for shard_id, symbols in self.assignment.items():
+            if symbols:
+                self.start_shard(shard_id)
+
+    def unhealthy(self, shard_id: int):
+        process = self.processes.get(shard_id)
+        if process is None or not process.is_alive():
+            return f'exited with code {None if process is None else process.exitcode}'
+        if time.time() - self.heartbeats[shard_id] > shard_heartbeat_timeout:
+            return f'no heartbeat for {round(time.time() - self.heartbeats[shard_id])}s'
+        return None
+
+    def check(self):
+        ''' Restarts unhealthy shards, rebalances away from the ones that keep failing '''
+        for shard_id in [shard_id for shard_id, symbols in self.assignment.items() if symbols]:
+            reason = self.unhealthy(shard_id)
+            if reason is None:
+                continue
+            log.warning(f'check() - shard {shard_id} {reason}, restarting it')
+            metrics.inc('shard_restarts_total', (('shard', str(shard_id)),))
+            self.stop_shard(shard_id)
+            now = time.time()
+            self.restarts[shard_id] = [restart for restart in self.restarts[shard_id] if now - restart < shard_restart_window] + [now]
+            if len(self.restarts[shard_id]) > shard_max_restarts and len(self.assignment) > 1:
+                self.rebalance(shard_id)
+            else:
+                self.start_shard(shard_id)
+
+    def rebalance(self, failed_shard: int):
+        ''' Retires a shard and rehashes its symbols over the remaining shards, the shards that gain symbols are restarted with them '''
+        moved = self.assignment.pop(failed_shard)
+        self.restarts.pop(failed_shard, None)
+        gained = assign_shards(moved, sorted(self.assignment))
+        log.warning(f'rebalance() - shard {failed_shard} retired, moving {len(moved)} symbols to shards {[shard_id for shard_id, symbols in gained.items() if symbols]}')
+        metrics.inc('shard_rebalances_total')
+        for shard_id, symbols in gained.items():
+            if symbols:
+                self.assignment[shard_id] += symbols
+                self.stop_shard(shard_id)
+                self.start_shard(shard_id)
+
+    def supervise(self):
+        ''' Loop that runs constantly in the main process '''
+        while True:
+            time.sleep(shard_check_period)
+            try:
+                self.check()
+            except Exception as e:
+                exc_type, exc_obj, exc_tb = sys.exc_info()
+                fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+                log.warning(f'supervise() - error checking shards, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
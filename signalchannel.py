@@ -0,0 +1,104 @@
+import atexit
+import time
+from collections import deque
+from multiprocessing import Event
+from multiprocessing.shared_memory import SharedMemory
+import numpy as np
+from configuration import *
+from logger import *
+
+## One record per Bot, slot = Bot.index. seq is a seqlock: odd while the producer is writing, +2 for every new signal
+## The records are followed by the seq the consumer last read of every slot, so any process can tell what is pending
+SIGNAL_DTYPE = np.dtype([('seq', np.uint64), ('time', np.float64), ('symbol', 'S24'), ('OP', np.int32), ('CP', np.int32),
+                         ('tick_size', np.float64), ('trade_direction', np.int8), ('index', np.int32),
+                         ('stop_loss_val', np.float64), ('take_profit_val', np.float64), ('close_time', np.int64)])
+
+
+class SignalChannel:
+    '''
+    Latest-value-per-symbol replacement for the signal multiprocessing.Queue. Bots overwrite their own slot in
+    shared memory, so a symbol that keeps signalling every candle only ever has its newest signal waiting.
+    put / get take and return the same [symbol, OP, CP, tick_size, trade_direction, index, stop_loss_val, take_profit_val,
+    close_time, signal_time] list the queue carried, get skips signals older than signal_max_age seconds
+    '''
+    def __init__(self, slots: int, max_age: float = signal_max_age):
+        self.slots = slots
+        self.max_age = max_age
+        self.shared_memory = SharedMemory(create=True, size=max(1, slots) * (SIGNAL_DTYPE.itemsize + np.dtype(np.uint64).itemsize))
+        self.attach()
+        self.records[:] = np.zeros(slots, dtype=SIGNAL_DTYPE)
+        self.seen[:] = 0
+        self.new_signal = Event()
+        self.ready = deque()
+        self.dropped = 0
+        atexit.register(self.unlink)
+
+    def __getstate__(self):
+        return {'name': self.shared_memory.name, 'slots': self.slots, 'max_age': self.max_age, 'new_signal': self.new_signal}
+
+    def __setstate__(self, state):
+        ''' Attaches to the shared memory block in the consumer process '''
+        self.slots, self.max_age, self.new_signal = state['slots'], state['max_age'], state['new_signal']
+        self.shared_memory = SharedMemory(name=state['name'])
+        self.attach()
+        self.ready = deque()
+        self.dropped = 0
+
+    def attach(self):
+        self.records = np.ndarray((self.slots,), dtype=SIGNAL_DTYPE, buffer=self.shared_memory.buf)
+        self.seen = np.ndarray((self.slots,), dtype=np.uint64, buffer=self.shared_memory.buf, offset=self.slots * SIGNAL_DTYPE.itemsize)
+
+    def put(self, signal: list):
+        ''' Producer side, only the Bot owning the slot writes to it '''
+        symbol, OP, CP, tick_size, trade_direction, index, stop_loss_val, take_profit_val, close_time, signal_time = signal
+        record = self.records[index:index + 1]
+        seq = int(record['seq'][0])
+        record['seq'] = seq + 1
+        record['time'], record['close_time'] = signal_time, close_time
+        record['symbol'] = symbol.encode()
+        record['OP'], record['CP'], record['tick_size'] = OP, CP, tick_size
+        record['trade_direction'], record['index'] = trade_direction, index
+        record['stop_loss_val'], record['take_profit_val'] = stop_loss_val, take_profit_val
+        record['seq'] = seq + 2
+        self.new_signal.set()
+
+    def read(self, index: int):
+        ''' Consistent copy of a slot, retried if the producer was mid-write '''
+        while True:
+            seq = self.records['seq'][index]
+            record = self.records[index].copy()
+            if seq % 2 == 0 and seq == self.records['seq'][index]:
+                return seq, record
+
+    def get(self, timeout: float = None):
+        ''' Blocks until a fresh signal is available and returns it, None if timeout expires first '''
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while True:
+            while self.ready:
+                slot = self.ready.popleft()
+                seq, record = self.read(slot)
+                self.seen[slot] = seq
+                if time.time() - record['time'] > self.max_age:
+                    self.dropped += 1
+                    continue
+                return [record['symbol'].decode(), int(record['OP']), int(record['CP']), float(record['tick_size']),
+                        int(record['trade_direction']), int(record['index']), float(record['stop_loss_val']), float(record['take_profit_val']),
+                        int(record['close_time']), float(record['time'])]
+            self.new_signal.clear()
+            seqs = self.records['seq']
+            self.ready.extend(np.nonzero((seqs > self.seen) & (seqs % 2 == 0))[0].tolist())
+            if self.ready:
+                continue
+            if not self.new_signal.wait(None if deadline is None else max(0.0, deadline - time.monotonic())):
+                return None
+
+    def pending(self):
+        ''' Symbols holding a signal the consumer hasn't read yet, correct in any process attached to the channel '''
+        return int(np.count_nonzero(self.records['seq'] > self.seen))
+
+    def unlink(self):
+        try:
+            self.shared_memory.close()
+            self.shared_memory.unlink()
+        except Exception:
+            pass
@@ -0,0 +1,476 @@
+import math
+import queue
+import random
+import time
+import zlib
+from threading import Thread, RLock
+from binance.enums import SIDE_SELL, SIDE_BUY, FUTURE_ORDER_TYPE_MARKET, FUTURE_ORDER_TYPE_LIMIT, \
+    FUTURE_ORDER_TYPE_STOP_MARKET, FUTURE_ORDER_TYPE_TAKE_PROFIT
+from configuration import *
+from logger import *
+from candles import interval_to_minutes
+from klinecache import buffer_start_ms
+
+## Price path of every simulated symbol, two sine waves (in candles) plus a little hashed noise per candle
+SLOW_WAVE_CANDLES = 240
+FAST_WAVE_CANDLES = 37
+
+
+class SimulatedExchangeError(Exception):
+    ''' Raised with the binance error code and message the real endpoint would return '''
+    def __init__(self, code: int, message: str):
+        super().__init__(f'APIError(code={code}): {message}')
+        self.code = code
+        self.message = message
+
+
+def format_number(value: float):
+    ''' Numbers are strings on the binance API, a flat position is reported as '0' '''
+    if value == 0:
+        return '0'
+    return ('%.8f' % value).rstrip('0').rstrip('.')
+
+
+def noise(*key):
+    ''' Deterministic uniform [0, 1) from a key, so history and the live feed agree '''
+    return zlib.crc32(repr(key).encode()) / 2 ** 32
+
+
+class SimulatedExchange:
+    '''
+    In-process stand-in for binance.client.Client: the futures order, position, balance and market data endpoints
+    used by the bot, a matching engine for MARKET, LIMIT, STOP_MARKET and TAKE_PROFIT orders run on every simulated
+    candle, and user data events (ORDER_TRADE_UPDATE / ACCOUNT_UPDATE) for every order and position change.
+    latency (+ up to jitter) seconds is added to every REST call and event_latency to every user data event
+    '''
+    def __init__(self, symbols: [str] = (), balance: float = 10_000.0, latency: float = 0.0, jitter: float = 0.0,
+                 event_latency: float = 0.0, fee: float = 0.0004, interval_str: str = interval):
+        self.lock = RLock()
+        self.interval_ms = interval_to_minutes(interval_str) * 60_000
+        self.clock_ms = int(time.time() * 1000) // self.interval_ms * self.interval_ms  ## open time of the forming candle
+        self.latency, self.jitter, self.event_latency, self.fee = latency, jitter, event_latency, fee
+        self.balance = balance
+        self.symbols = {}  ## symbol: exchange info entry
+        self.prices = {}  ## symbol: last price
+        self.leverage = {}
+        self.orders = {}  ## symbol: {orderId: order}
+        self.positions = {}  ## symbol: [signed amount, entry price]
+        self.open_symbols = set()  ## symbols with a position
+        self.order_symbols = set()  ## symbols with resting orders
+        self.next_order_id = 1
+        self.listeners = []
+        self.events = queue.Queue()
+        self.counters = {'requests': 0, 'orders': 0, 'fills': 0, 'cancels': 0, 'rejects': 0, 'events': 0}
+        self.started = time.perf_counter()
+        for symbol in symbols:
+            self.add_symbol(symbol)
+        event_thread = Thread(target=self.deliver_events)
+        event_thread.daemon = True
+        event_thread.start()
+
+    ## ----- market data -----
+    def add_symbol(self, symbol: str):
+        base_price = 10 ** (noise(symbol, 'magnitude') * 5 - 1)  ## 0.1 to 10000
+        price_precision = max(0, min(8, 4 - int(math.floor(math.log10(base_price)))))
+        with self.lock:
+            self.symbols[symbol] = {'symbol': symbol, 'pair': symbol, 'base_price': base_price,
+                                    'pricePrecision': price_precision, 'quantityPrecision': max(0, 3 - price_precision),
+                                    'filters': [{'filterType': 'PRICE_FILTER', 'tickSize': format_number(10 ** -price_precision)},
+                                                {'filterType': 'LOT_SIZE', 'stepSize': format_number(10 ** -max(0, 3 - price_precision))}]}
+            self.orders[symbol] = {}
+            self.positions[symbol] = [0.0, 0.0]
+            self.prices[symbol] = self.price_at(symbol, self.clock_ms)
+
+    def price_at(self, symbol: str, time_ms: int):
+        info = self.symbols[symbol]
+        candle = time_ms / self.interval_ms
+        phase = 2 * math.pi * noise(symbol, 'phase')
+        wave = 0.04 * math.sin(2 * math.pi * candle / SLOW_WAVE_CANDLES + phase) + 0.015 * math.sin(2 * math.pi * candle / FAST_WAVE_CANDLES + 2 * phase)
+        return round(info['base_price'] * (1 + wave + 0.004 * (noise(symbol, time_ms) - 0.5)), info['pricePrecision'])
+
+    def kline(self, symbol: str, open_time: int):
+        ''' [Open, High, Low, Close, Volume] of a simulated candle '''
+        precision = self.symbols[symbol]['pricePrecision']
+        Open, Close = self.price_at(symbol, open_time), self.price_at(symbol, open_time + self.interval_ms)
+        High = round(max(Open, Close) * (1 + 0.003 * noise(symbol, open_time, 'high')), precision)
+        Low = round(min(Open, Close) * (1 - 0.003 * noise(symbol, open_time, 'low')), precision)
+        return Open, High, Low, Close, round(1000 * noise(symbol, open_time, 'volume'), 3)
+
+    def advance(self):
+        ''' Closes the forming candle of every symbol, matching resting orders against it, returns the closed klines '''
+        closed = {}
+        with self.lock:
+            open_time = self.clock_ms
+            for symbol in self.symbols:
+                candle = self.kline(symbol, open_time)
+                closed[symbol] = candle
+                if symbol in self.order_symbols:
+                    self.match_orders(symbol, *candle[:4])
+                self.prices[symbol] = candle[3]
+            self.clock_ms += self.interval_ms
+        return open_time, closed
+
+    ## ----- REST surface -----
+    def delay(self):
+        self.counters['requests'] += 1
+        if self.latency or self.jitter:
+            time.sleep(self.latency + random.uniform(0, self.jitter))
+
+    def check_symbol(self, symbol: str):
+        if symbol not in self.symbols:
+            raise SimulatedExchangeError(-1121, 'Invalid symbol.')
+
+    def futures_ping(self):
+        self.delay()
+        return {}
+
+    def futures_exchange_info(self):
+        self.delay()
+        with self.lock:
+            return {'symbols': [{key: value for key, value in info.items() if key != 'base_price'} for info in self.symbols.values()]}
+
+    def futures_change_leverage(self, symbol: str, leverage: int):
+        self.delay()
+        self.check_symbol(symbol)
+        self.leverage[symbol] = leverage
+        return {'symbol': symbol, 'leverage': leverage}
+
+    def futures_symbol_ticker(self, symbol: str = None):
+        self.delay()
+        with self.lock:
+            if symbol is None:
+                return [{'symbol': s, 'price': format_number(price)} for s, price in self.prices.items()]
+            self.check_symbol(symbol)
+            return {'symbol': symbol, 'price': format_number(self.prices[symbol])}
+
+    def futures_historical_klines(self, symbol: str, interval: str, start_str=None, end_str=None, limit=None):
+        ''' Closed klines in the same row format as binance, start_str / end_str are ms or a '3 hours ago' string '''
+        self.delay()
+        self.check_symbol(symbol)
+        start_ms = start_str if isinstance(start_str, int) else buffer_start_ms(start_str, interval) if start_str else self.clock_ms - 500 * self.interval_ms
+        end_ms = end_str if isinstance(end_str, int) else self.clock_ms - 1
+        start_ms = -(-start_ms // self.interval_ms) * self.interval_ms
+        rows = []
+        for open_time in range(start_ms, min(end_ms + 1, self.clock_ms), self.interval_ms):
+            Open, High, Low, Close, Volume = self.kline(symbol, open_time)
+            rows.append([open_time, format_number(Open), format_number(High), format_number(Low), format_number(Close), format_number(Volume),
+                         open_time + self.interval_ms - 1, format_number(Volume * Close), 0, '0', '0', '0'])
+        return rows
+
+    def futures_account_balance(self, **params):
+        self.delay()
+        with self.lock:
+            return [{'asset': 'USDT', 'balance': format_number(self.balance), 'availableBalance': format_number(self.balance)}]
+
+    def position_entry(self, symbol: str):
+        amount, entry_price = self.positions[symbol]
+        mark_price = self.prices[symbol]
+        return {'symbol': symbol, 'positionAmt': format_number(amount), 'entryPrice': format_number(entry_price),
+                'markPrice': format_number(mark_price), 'unRealizedProfit': format_number(amount * (mark_price - entry_price)),
+                'notional': format_number(amount * mark_price), 'leverage': str(self.leverage.get(symbol, leverage)), 'positionSide': 'BOTH'}
+
+    def futures_position_information(self, symbol: str = None, **params):
+        self.delay()
+        with self.lock:
+            if symbol is not None:
+                self.check_symbol(symbol)
+                return [self.position_entry(symbol)]
+            return [self.position_entry(s) for s in self.symbols]
+
+    def futures_get_open_orders(self, symbol: str = None, **params):
+        self.delay()
+        with self.lock:
+            symbols = [symbol] if symbol is not None else list(self.orders)
+            return [dict(order) for s in symbols for order in self.orders.get(s, {}).values()]
+
+    def futures_create_order(self, **params):
+        self.delay()
+        return self.place_order(params)
+
+    def futures_place_batch_order(self, batchOrders: [dict], **params):
+        ''' Up to 5 orders in one request, each gets its order or its {'code', 'msg'} error at its position in the response '''
+        self.delay()
+        if not 1 <= len(batchOrders) <= 5:
+            raise SimulatedExchangeError(-1102, "Param 'batchOrders' must be a list of 1 to 5 orders.")
+        responses = []
+        for order_params in batchOrders:
+            try:
+                responses.append(self.place_order(order_params))
+            except SimulatedExchangeError as e:
+                responses.append({'code': e.code, 'msg': e.message})
+        return responses
+
+    def place_order(self, params: dict):
+        with self.lock:
+            try:
+                order = self.new_order(params)
+            except SimulatedExchangeError:
+                self.counters['rejects'] += 1
+                raise
+            self.counters['orders'] += 1
+            self.emit_order_update(order, 'NEW')
+            if order['type'] == FUTURE_ORDER_TYPE_MARKET:
+                self.fill(order, self.prices[order['symbol']])
+            else:
+                self.orders[order['symbol']][order['orderId']] = order
+                self.order_symbols.add(order['symbol'])
+            return dict(order)
+
+    def futures_cancel_order(self, symbol: str, orderId: int, **params):
+        self.delay()
+        with self.lock:
+            self.check_symbol(symbol)
+            order = self.remove_order(symbol, orderId)
+            if order is None:
+                raise SimulatedExchangeError(-2011, 'Unknown order sent.')
+            self.counters['cancels'] += 1
+            self.emit_order_update(order, 'CANCELED')
+            return dict(order, status='CANCELED')
+
+    def futures_cancel_all_open_orders(self, symbol: str, **params):
+        self.delay()
+        with self.lock:
+            self.check_symbol(symbol)
+            for order in list(self.orders[symbol].values()):
+                self.counters['cancels'] += 1
+                self.emit_order_update(order, 'CANCELED')
+            self.orders[symbol] = {}
+            self.order_symbols.discard(symbol)
+            return {'code': 200, 'msg': 'The operation of cancel all open order is done.'}
+
+    ## ----- matching engine -----
+    def new_order(self, params: dict):
+        symbol, side, order_type = params.get('symbol'), params.get('side'), params.get('type')
+        self.check_symbol(symbol)
+        if side not in (SIDE_BUY, SIDE_SELL):
+            raise SimulatedExchangeError(-1117, 'Invalid side.')
+        if order_type not in (FUTURE_ORDER_TYPE_MARKET, FUTURE_ORDER_TYPE_LIMIT, FUTURE_ORDER_TYPE_STOP_MARKET, FUTURE_ORDER_TYPE_TAKE_PROFIT):
+            raise SimulatedExchangeError(-1116, 'Invalid orderType.')
+        close_position = str(params.get('closePosition', False)).lower() == 'true'
+        reduce_only = str(params.get('reduceOnly', False)).lower() == 'true'
+        quantity = float(params.get('quantity') or 0)
+        if not close_position and quantity <= 0:
+            raise SimulatedExchangeError(-4003, 'Quantity less than or equal to zero.')
+        if order_type in (FUTURE_ORDER_TYPE_LIMIT, FUTURE_ORDER_TYPE_TAKE_PROFIT) and params.get('price') is None:
+            raise SimulatedExchangeError(-1102, "Mandatory parameter 'price' was not sent, was empty/null, or malformed.")
+        if order_type in (FUTURE_ORDER_TYPE_STOP_MARKET, FUTURE_ORDER_TYPE_TAKE_PROFIT) and params.get('stopPrice') is None:
+            raise SimulatedExchangeError(-1102, "Mandatory parameter 'stopPrice' was not sent, was empty/null, or malformed.")
+        price, stop_price = float(params.get('price') or 0), float(params.get('stopPrice') or 0)
+        if order_type in (FUTURE_ORDER_TYPE_LIMIT, FUTURE_ORDER_TYPE_TAKE_PROFIT) and price <= 0:
+            raise SimulatedExchangeError(-4013, 'Price less than min price.')
+        if order_type in (FUTURE_ORDER_TYPE_STOP_MARKET, FUTURE_ORDER_TYPE_TAKE_PROFIT) and stop_price <= 0:
+            raise SimulatedExchangeError(-4013, 'Stop price less than min price.')
+        if self.triggers_immediately(side, order_type, stop_price, self.prices[symbol]):
+            raise SimulatedExchangeError(-2021, 'Order would immediately trigger.')
+        if not (reduce_only or close_position):
+            ## Initial margin at the symbol leverage has to fit in what positions and other open orders leave free,
+            ## in one-way mode only the part of the order beyond the opposite position needs margin
+            amount = self.positions[symbol][0]
+            opening = max(0.0, quantity - abs(amount)) if amount * (1 if side == SIDE_BUY else -1) < 0 else quantity
+            if opening > 0 and self.margin(symbol, opening, price or self.prices[symbol]) > self.available_balance():
+                raise SimulatedExchangeError(-2019, 'Margin is insufficient.')
+        order = {'symbol': symbol, 'orderId': self.next_order_id, 'side': side, 'type': order_type, 'origType': order_type,
+                 'price': format_number(price), 'stopPrice': format_number(stop_price),
+                 'origQty': format_number(quantity), 'reduceOnly': reduce_only, 'closePosition': close_position,
+                 'timeInForce': params.get('timeInForce', 'GTC'), 'status': 'NEW', 'updateTime': self.clock_ms}
+        self.next_order_id += 1
+        return order
+
+    def triggers_immediately(self, side: str, order_type: str, stop_price: float, market_price: float):
+        ''' A stop triggers once the market reaches it from below (buy) or above (sell), a take profit the other way round '''
+        if order_type == FUTURE_ORDER_TYPE_STOP_MARKET:
+            return market_price >= stop_price if side == SIDE_BUY else market_price <= stop_price
+        if order_type == FUTURE_ORDER_TYPE_TAKE_PROFIT:
+            return market_price <= stop_price if side == SIDE_BUY else market_price >= stop_price
+        return False
+
+    def remove_order(self, symbol: str, order_id: int):
+        order = self.orders[symbol].pop(order_id, None)
+        if not self.orders[symbol]:
+            self.order_symbols.discard(symbol)
+        return order
+
+    def margin(self, symbol: str, quantity: float, price: float):
+        return quantity * price / self.leverage.get(symbol, leverage)
+
+    def available_balance(self):
+        ''' Wallet balance plus unrealized profit, less the margin of open positions and orders that would add to them '''
+        available = self.balance
+        for symbol in self.open_symbols:
+            amount, entry_price = self.positions[symbol]
+            available += amount * (self.prices[symbol] - entry_price) - self.margin(symbol, abs(amount), entry_price)
+        for symbol in self.order_symbols:
+            for order in self.orders[symbol].values():
+                if not (order['reduceOnly'] or order['closePosition']):
+                    available -= self.margin(symbol, float(order['origQty']), float(order['price']) or self.prices[symbol])
+        return available
+
+    def match_orders(self, symbol: str, Open: float, High: float, Low: float, Close: float):
+        ''' Fills every resting order of a symbol the candle traded through, at the trigger price or the open on gaps '''
+        for order in list(self.orders[symbol].values()):
+            buy = order['side'] == SIDE_BUY
+            price, stop_price = float(order['price']), float(order['stopPrice'])
+            fill_price = None
+            if order['type'] == FUTURE_ORDER_TYPE_LIMIT:
+                if buy and Low <= price:
+                    fill_price = min(price, Open)
+                elif not buy and High >= price:
+                    fill_price = max(price, Open)
+            elif order['type'] == FUTURE_ORDER_TYPE_STOP_MARKET:
+                if buy and High >= stop_price:
+                    fill_price = max(stop_price, Open)
+                elif not buy and Low <= stop_price:
+                    fill_price = min(stop_price, Open)
+            elif order['type'] == FUTURE_ORDER_TYPE_TAKE_PROFIT:
+                if buy and Low <= stop_price:
+                    fill_price = min(price, Open)
+                elif not buy and High >= stop_price:
+                    fill_price = max(price, Open)
+            if fill_price is not None:
+                self.remove_order(symbol, order['orderId'])
+                self.fill(order, fill_price)
+
+    def fill(self, order: dict, fill_price: float):
+        symbol = order['symbol']
+        amount, entry_price = self.positions[symbol]
+        direction = 1 if order['side'] == SIDE_BUY else -1
+        quantity = abs(amount) if order['closePosition'] else float(order['origQty'])
+        if order['reduceOnly'] or order['closePosition']:
+            ## Only the part that reduces the position is filled, an order with nothing left to reduce expires
+            quantity = min(quantity, abs(amount)) if amount * direction < 0 else 0
+        if quantity == 0:
+            self.emit_order_update(order, 'EXPIRED')
+            return
+        realized_profit = 0.0
+        new_amount = amount + direction * quantity
+        if amount == 0 or amount * direction > 0:
+            entry_price = (abs(amount) * entry_price + quantity * fill_price) / (abs(amount) + quantity)
+        else:
+            closed = min(quantity, abs(amount))
+            realized_profit = closed * (fill_price - entry_price) * (1 if amount > 0 else -1)
+            if quantity > abs(amount):
+                entry_price = fill_price  ## flipped to the other side
+            elif new_amount == 0:
+                entry_price = 0.0
+        new_amount = round(new_amount, 8)
+        commission = quantity * fill_price * self.fee
+        self.balance += realized_profit - commission
+        self.positions[symbol] = [new_amount, entry_price]
+        if new_amount:
+            self.open_symbols.add(symbol)
+        else:
+            self.open_symbols.discard(symbol)
+        self.counters['fills'] += 1
+        self.emit_order_update(order, 'FILLED', fill_price, quantity, realized_profit, commission)
+        self.emit({'e': 'ACCOUNT_UPDATE', 'E': self.event_time(), 'T': self.event_time(),
+                   'a': {'m': 'ORDER', 'B': [{'a': 'USDT', 'wb': format_number(self.balance), 'cw': format_number(self.balance), 'bc': '0'}],
+                         'P': [{'s': symbol, 'pa': format_number(new_amount), 'ep': format_number(entry_price), 'cr': '0',
+                                'up': format_number(new_amount * (fill_price - entry_price)), 'mt': 'cross', 'iw': '0', 'ps': 'BOTH'}]}})
+
+    ## ----- user data stream -----
+    def event_time(self):
+        return int(time.time() * 1000)
+
+    def emit_order_update(self, order: dict, status: str, fill_price: float = 0.0, quantity: float = 0.0, realized_profit: float = 0.0, commission: float = 0.0):
+        order['status'] = status
+        self.emit({'e': 'ORDER_TRADE_UPDATE', 'E': self.event_time(), 'T': self.event_time(),
+                   'o': {'s': order['symbol'], 'c': '', 'S': order['side'], 'o': order['type'], 'f': order['timeInForce'],
+                         'q': order['origQty'], 'p': order['price'], 'ap': format_number(fill_price), 'sp': order['stopPrice'],
+                         'x': 'TRADE' if status == 'FILLED' else status, 'X': status, 'i': order['orderId'],
+                         'l': format_number(quantity), 'z': format_number(quantity), 'L': format_number(fill_price),
+                         'n': format_number(commission), 'N': 'USDT', 'T': self.event_time(), 't': 0, 'b': '0', 'a': '0', 'm': False,
+                         'R': order['reduceOnly'], 'wt': 'CONTRACT_PRICE', 'ot': order['origType'], 'ps': 'BOTH',
+                         'cp': order['closePosition'], 'rp': format_number(realized_profit)}})
+
+    def emit(self, event: dict):
+        self.events.put((time.monotonic() + self.event_latency, event))
+
+    def subscribe(self, callback):
+        self.listeners.append(callback)
+
+    def deliver_events(self):
+        ''' Calls the user data listeners outside the exchange lock, after event_latency '''
+        while True:
+            due, event = self.events.get()
+            wait = due - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            self.counters['events'] += 1
+            for listener in list(self.listeners):
+                try:
+                    listener(event)
+                except Exception as e:
+                    log.warning(f'deliver_events() - user data listener failed, Error: {e}')
+
+    def stats(self):
+        ''' Counters and per-second rates since the exchange was created '''
+        seconds = time.perf_counter() - self.started
+        return {**self.counters, 'seconds': seconds, 'orders_per_second': self.counters['orders'] / seconds,
+                'fills_per_second': self.counters['fills'] / seconds, 'open_orders': sum(len(orders) for orders in self.orders.values()),
+                'open_positions': len(self.open_symbols), 'balance': self.balance}
+
+
+class SimulatedSocketManager:
+    '''
+    Stand-in for ThreadedWebsocketManager on a SimulatedExchange, closes a simulated candle every kline_period seconds
+    and pushes it to the kline sockets, user sockets receive the exchange's user data events
+    '''
+    def __init__(self, exchange: SimulatedExchange, kline_period: float = 1.0):
+        self.exchange = exchange
+        self.kline_period = kline_period
+        self.sockets = {}  ## name: (callback, symbols, combined)
+        self.lock = RLock()
+        self.feed_thread = None
+        self.next_socket = 0
+
+    def start(self):
+        if self.feed_thread is None:
+            self.feed_thread = Thread(target=self.feed_loop)
+            self.feed_thread.daemon = True
+            self.feed_thread.start()
+
+    def add_socket(self, callback, symbols: [str], combined: bool):
+        with self.lock:
+            self.next_socket += 1
+            name = f'simulated_socket_{self.next_socket}'
+            self.sockets[name] = (callback, symbols, combined)
+            return name
+
+    def start_kline_futures_socket(self, callback, symbol: str, interval: str = interval):
+        return self.add_socket(callback, [symbol], False)
+
+    def start_futures_multiplex_socket(self, callback, streams: [str]):
+        return self.add_socket(callback, [stream.split('@')[0].upper() for stream in streams], True)
+
+    def start_futures_user_socket(self, callback):
+        self.exchange.subscribe(callback)
+        return f'simulated_user_socket_{id(callback)}'
+
+    def stop_socket(self, name: str):
+        with self.lock:
+            self.sockets.pop(name, None)
+
+    def stop(self):
+        with self.lock:
+            self.sockets = {}
+
+    def feed_loop(self):
+        while True:
+            started = time.monotonic()
+            open_time, closed = self.exchange.advance()
+            with self.lock:
+                sockets = list(self.sockets.items())
+            for name, (callback, symbols, combined) in sockets:
+                for symbol in symbols:
+                    if symbol not in closed:
+                        continue
+                    Open, High, Low, Close, Volume = closed[symbol]
+                    data = {'e': 'kline', 'E': self.exchange.event_time(), 's': symbol,
+                            'k': {'t': open_time, 'T': open_time + self.exchange.interval_ms - 1, 's': symbol, 'i': interval,
+                                  'o': format_number(Open), 'c': format_number(Close), 'h': format_number(High), 'l': format_number(Low),
+                                  'v': format_number(Volume), 'q': format_number(Volume * Close), 'x': True}}
+                    try:
+                        callback({'stream': f'{symbol.lower()}@kline_{interval}', 'data': data} if combined else data)
+                    except Exception as e:
+                        log.warning(f'feed_loop() - kline callback failed on {symbol}, Error: {e}')
+            time.sleep(max(0.0, self.kline_period - (time.monotonic() - started)))
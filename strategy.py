@@ -1,13 +1,22 @@
+import numpy as np
 from configuration import *
 from logger import *
 
-def RSI(Trade_Direction, Close, SMA100, RSI, current_index):
+def RSI(Trade_Direction, Close, SMA100, RSI, current_index, RSI_lower_bound=RSI_lower_bound, RSI_upper_bound=RSI_upper_bound):
     if Close[current_index] < SMA100[current_index] and RSI[current_index] < RSI_lower_bound:
         Trade_Direction = 1  ##Buy
     elif Close[current_index] > SMA100[current_index] and RSI[current_index] > RSI_upper_bound:
         Trade_Direction = 0  ##Sell
     return Trade_Direction
 
+def RSI_signals(Close, SMA100, RSI, RSI_lower_bound=RSI_lower_bound, RSI_upper_bound=RSI_upper_bound):
+    ''' Same rules as RSI() applied to whole arrays, returns 1 (Buy), 0 (Sell) or -99 for every candle '''
+    Close, SMA100, RSI = np.asarray(Close), np.asarray(SMA100), np.asarray(RSI)
+    Trade_Direction = np.full(Close.shape, -99, dtype=np.int64)
+    Trade_Direction[(Close > SMA100) & (RSI > RSI_upper_bound)] = 0  ##Sell
+    Trade_Direction[(Close < SMA100) & (RSI < RSI_lower_bound)] = 1  ##Buy
+    return Trade_Direction
+
 def SetSLTP(stop_loss_val_arr, take_profit_val_arr, peaks, troughs, Close, High, Low, Trade_Direction, SL, TP, TP_SL_choice, current_index):
     take_profit_val = take_profit_val_arr[current_index]
     stop_loss_val = stop_loss_val_arr[current_index]
@@ -0,0 +1,104 @@
+import json
+import time
+from threading import Thread, Lock
+from configuration import *
+from logger import *
+
+
+def index_exchange_info(exchange_info: dict):
+    ''' Builds {symbol: metadata} from futures_exchange_info, filters are keyed by filterType '''
+    index = {}
+    for x in exchange_info['symbols']:
+        filters = {f['filterType']: f for f in x['filters']}
+        index[x['symbol']] = {'pricePrecision': int(x['pricePrecision']),
+                              'quantityPrecision': int(x['quantityPrecision']),
+                              'tickSize': float(filters.get('PRICE_FILTER', x['filters'][0]).get('tickSize', 0)),
+                              'filters': filters}
+    return index
+
+
+class SymbolInfoCache:
+    '''
+    Symbol metadata index persisted to symbol_info_file, older than symbol_info_ttl seconds it is still served
+    but refreshed from futures_exchange_info in the background. Also remembers the leverage set on each symbol.
+    With path None the index is kept in memory only
+    '''
+    def __init__(self, client, path: str = symbol_info_file, ttl: float = symbol_info_ttl):
+        self.client = client
+        self.path = path
+        self.ttl = ttl
+        self.symbols = {}
+        self.leverage = {}
+        self.updated = 0
+        self.lock = Lock()
+        self.refreshing = False
+        self.load()
+
+    def load(self):
+        try:
+            if self.path is not None and os.path.exists(self.path):
+                with open(self.path) as f:
+                    data = json.load(f)
+                self.symbols, self.leverage, self.updated = data['symbols'], data['leverage'], data['updated']
+        except Exception as e:
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+            log.warning(f'SymbolInfoCache.load() - ignoring unreadable {self.path}, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
+
+    def save(self):
+        '''
+        Shards and the TradeManager save the same file, each writes its own temporary file and the leverage other
+        processes saved is merged in so they don't drop each other's entries
+        '''
+        if self.path is None:
+            return
+        tmp_path = f'{self.path}.{os.getpid()}.tmp'
+        try:
+            with self.lock:
+                try:
+                    with open(self.path) as f:
+                        self.leverage = {**json.load(f).get('leverage', {}), **self.leverage}
+                except (OSError, ValueError):
+                    pass  ## missing or unreadable, it is replaced with this process' index
+                data = {'updated': self.updated, 'symbols': self.symbols, 'leverage': self.leverage}
+                with open(tmp_path, 'w') as f:
+                    json.dump(data, f)
+                os.replace(tmp_path, self.path)
+        except Exception as e:
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+            log.warning(f'SymbolInfoCache.save() - error writing {self.path}, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
+
+    def refresh(self):
+        try:
+            symbols = index_exchange_info(self.client.futures_exchange_info())
+            with self.lock:
+                self.symbols = symbols
+                self.updated = time.time()
+            self.save()
+            log.info(f'SymbolInfoCache.refresh() - {len(symbols)} symbols indexed')
+        except Exception as e:
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+            log.warning(f'SymbolInfoCache.refresh() - error refreshing exchange info, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
+        finally:
+            self.refreshing = False
+
+    def get(self, symbol: str):
+        ''' Returns the metadata of a symbol or None, the index is only downloaded when nothing is cached yet '''
+        if not self.symbols:
+            self.refresh()
+        elif time.time() - self.updated > self.ttl and not self.refreshing:
+            self.refreshing = True
+            refresh_thread = Thread(target=self.refresh)
+            refresh_thread.daemon = True
+            refresh_thread.start()
+        return self.symbols.get(symbol)
+
+    def leverage_matches(self, symbol: str, leverage: int):
+        with self.lock:
+            return self.leverage.get(symbol) == leverage
+
+    def set_leverage(self, symbol: str, leverage: int):
+        with self.lock:
+            self.leverage[symbol] = leverage
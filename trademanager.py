@@ -1,6 +1,7 @@
-from threading import Thread
+import asyncio
+from threading import Thread, Lock
 
-from binance import ThreadedWebsocketManager
+from binance import ThreadedWebsocketManager, AsyncClient
 from binance.client import Client
 from binance.enums import SIDE_SELL, SIDE_BUY, FUTURE_ORDER_TYPE_MARKET, FUTURE_ORDER_TYPE_LIMIT, TIME_IN_FORCE_GTC, \
     FUTURE_ORDER_TYPE_STOP_MARKET, FUTURE_ORDER_TYPE_TAKE_PROFIT
@@ -10,20 +11,69 @@ from tabulate import tabulate
 import strategy
 from configuration import *
 import time
-from helper import Trade
+from helper import Trade, TradeRegistry
+from orderbatch import place_orders, place_orders_async
+from checkpoint import load_trades, save_trades, trades_checkpoint_path, checkpoint_loop
+from latency import tracer
+from metrics import metrics, push_metrics_loop
+from recording import StreamRecorder, USER_STREAM
+from ratelimit import WeightBudget
+from restclient import SharedClient, WeightScheduler, request_weight, ORDER_PRIORITY, HOUSEKEEPING_PRIORITY
 from logger import *
 
 
+class AsyncOrderExecutor:
+    ''' Event loop thread with an AsyncClient, used by TradeManager to send independent requests concurrently '''
+    def __init__(self, scheduler: WeightScheduler):
+        self.scheduler = scheduler
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = Thread(target=self.loop.run_forever)
+        self.loop_thread.daemon = True
+        self.loop_thread.start()
+        self.client = self.submit(AsyncClient.create(api_key=API_KEY, api_secret=API_SECRET, testnet=True)).result()
+        self.symbol_locks = {}
+
+    def submit(self, coroutine):
+        ''' Schedules a coroutine on the event loop from any thread, returns a concurrent.futures.Future '''
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop)
+
+    async def request(self, name: str, **kwargs):
+        ''' Sends a request once the shared WeightScheduler grants its weight, everything here is order placement '''
+        await self.loop.run_in_executor(None, self.scheduler.acquire, request_weight(name, kwargs), ORDER_PRIORITY)
+        sent = time.perf_counter()
+        labels = (('method', name),)
+        metrics.inc('rest_requests_total', labels)
+        try:
+            return await getattr(self.client, name)(**kwargs)
+        except Exception:
+            metrics.inc('rest_errors_total', labels)
+            raise
+        finally:
+            tracer.since(f'rest.{name}', sent)
+
+    def symbol_lock(self, symbol: str):
+        ''' Orders for the same symbol run one after another, different symbols run concurrently '''
+        if symbol not in self.symbol_locks:
+            self.symbol_locks[symbol] = asyncio.Lock()
+        return self.symbol_locks[symbol]
+
+
 class TradeManager:
-    def __init__(self, client: Client, new_trades_q, print_trades_q):
-        self.client = client
-        self.active_trades: [Trade] = []
+    def __init__(self, client: Client, new_trades_q, print_trades_q, offline=False, twm=None):
+        ## One pooled, rate limited client for the process, housekeeping loops yield to order placement
+        self.client = SharedClient(client, WeightScheduler(WeightBudget(request_weight_limit * trade_manager_weight_share)))
+        self.active_trades = TradeRegistry()
         self.use_trailing_stop = False
         self.use_market_orders = True
         self.new_trades_q = new_trades_q
-        self.twm = ThreadedWebsocketManager(api_key=API_KEY, api_secret=API_SECRET, testnet= True)
-        self.twm.start()
-        self.user_socket = self.twm.start_futures_user_socket(callback=self.monitor_trades)
+        ## Offline (replay) the user data events are fed to monitor_trades by the caller, a simulated exchange passes its socket manager
+        if twm is not None or not offline:
+            user_callback = self.monitor_trades
+            if stream_record_file:
+                user_callback = StreamRecorder(stream_record_file + '.user').wrap(USER_STREAM, user_callback)
+            self.twm = twm if twm is not None else ThreadedWebsocketManager(api_key=API_KEY, api_secret=API_SECRET, testnet= True)
+            self.twm.start()
+            self.user_socket = self.twm.start_futures_user_socket(callback=user_callback)
         self.print_trades_q = print_trades_q
         self.log_trades_loop_thread = Thread(target=self.log_trades_loop)
         self.log_trades_loop_thread.daemon = True
@@ -34,99 +84,181 @@ class TradeManager:
         self.total_profit = 0
         self.number_of_wins = 0
         self.number_of_losses = 0
-
-    def monitor_orders_by_polling_api(self):
+        self.pending_symbols = set()  ## symbols with an entry still being placed by the async executor
+        self.pending_symbols_lock = Lock()
+        self.async_executor = AsyncOrderExecutor(self.client.scheduler) if async_order_execution and not offline else None
+        metrics.add_collector(self.client.scheduler.gauges)
+        metrics.add_collector(self.metric_gauges)
+        if checkpoint_dir and not offline:
+            self.restore_checkpoint()
+            self.checkpoint_loop_thread = Thread(target=checkpoint_loop, args=(lambda path: save_trades(self, path), trades_checkpoint_path()))
+            self.checkpoint_loop_thread.daemon = True
+            self.checkpoint_loop_thread.start()
+
+    def metric_gauges(self):
+        gauges = [('trade_wins', (), self.number_of_wins), ('trade_losses', (), self.number_of_losses),
+                  ('trade_total_profit', (), self.total_profit), ('trade_active', (), len(self.active_trades)),
+                  ('trade_pending', (), len(self.pending_symbols))]
+        if hasattr(self.new_trades_q, 'dropped'):
+            gauges.append(('signals_dropped_stale', (), self.new_trades_q.dropped))
+        return gauges
+
+    def restore_checkpoint(self):
+        ''' Picks up the trades and counters of the last run, then checks each trade against the exchange '''
+        restored = load_trades(trades_checkpoint_path(), Trade)
+        if restored is None:
+            return
+        trades, (self.total_profit, self.number_of_wins, self.number_of_losses) = restored
+        for trade in trades:
+            self.active_trades.add(trade)
+        log.info(f'restore_checkpoint() - restored {len(trades)} trades, Total profit: ${round(self.total_profit, 3)}, Wins: {self.number_of_wins}, Losses: {self.number_of_losses}')
+        self.reconcile_restored_trades()
+
+    def reconcile_restored_trades(self):
         '''
-        Loop that runs constantly to catch trades that opened when packet loss occurs
-        to ensure that SL & TPs are placed on all positions
+        Trades whose position and orders are gone finished while we were down and are dropped. An open position that lost
+        its take profit or stop loss goes back to status 0, monitor_orders_by_polling_api then places both again
         '''
-        while True:
-            time.sleep(15)
-            open_positions = self.get_all_open_positions()
-            if open_positions == []:
-                continue
+        with self.client.priority(ORDER_PRIORITY):
             try:
-                for trade in self.active_trades:
-                    if trade.symbol in open_positions and trade.trade_status == 0:
-                        i = self.active_trades.index(trade)
-                        trade.trade_status = self.place_tp_sl(trade.symbol, trade.trade_direction, trade.CP, trade.tick_size, trade.entry_price, i)
+                positions = {position['symbol']: float(position['positionAmt']) for position in self.client.futures_position_information()}
+                open_orders = self.client.futures_get_open_orders()
             except Exception as e:
                 exc_type, exc_obj, exc_tb = sys.exc_info()
                 fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-                log.warning(f'monitor_orders_by_polling_api() - error occurred, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
+                log.warning(f'reconcile_restored_trades() - error reading the account, keeping the restored trades as they are, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
+                return
+        order_ids = {order['orderId'] for order in open_orders}
+        order_symbols = {order['symbol'] for order in open_orders}
+        for trade in self.active_trades:
+            if positions.get(trade.symbol, 0.0) == 0.0 and trade.symbol not in order_symbols:
+                log.info(f'reconcile_restored_trades() - {trade.symbol} has no position or open orders anymore, removing the trade')
+                self.active_trades.remove(trade)
+            elif positions.get(trade.symbol, 0.0) != 0.0 and trade.trade_status == 1 and (trade.TP_id not in order_ids or trade.SL_id not in order_ids):
+                log.info(f'reconcile_restored_trades() - {trade.symbol} position is missing its Take Profit or Stop loss, placing them again')
+                trade.trade_status = 0
 
-    def new_trades_loop(self):
-        ''' Loop that constantly runs and opens new trades as they come in '''
-        while True:
-            [symbol, OP, CP, tick_size, trade_direction, index, stop_loss_val, take_profit_val] = self.new_trades_q.get()
-            open_trades = self.get_all_open_or_pending_trades()
-            if open_trades != -1 and symbol not in open_trades:
+    def monitor_orders_by_polling_api(self):
+        '''
+        Loop that runs constantly to catch trades that opened when packet loss occurs
+        to ensure that SL & TPs are placed on all positions
+        '''
+        with self.client.priority(HOUSEKEEPING_PRIORITY):
+            while True:
+                time.sleep(15)
+                open_positions = self.get_all_open_positions()
+                if open_positions == []:
+                    continue
                 try:
-                    order_id, order_qty, entry_price, trade_status = self.open_trade(symbol, trade_direction, OP, tick_size, stop_loss_val, CP)
-                    if trade_status != -1:
-                        self.active_trades.append(Trade(index, entry_price, order_qty, take_profit_val, stop_loss_val, trade_direction, order_id, symbol, CP, tick_size))
-                    elif trade_status == 0:
-                        log.info(f'new_trades_loop() - Order placed on {symbol}, Entry price: {entry_price}, order quantity: {order_qty}, Side: {"Long" if trade_direction else "Short"}')
-
+                    for symbol in open_positions:
+                        trade = self.active_trades.get(symbol)
+                        if trade is not None and trade.trade_status == 0:
+                            trade.trade_status = self.place_tp_sl(trade)
                 except Exception as e:
                     exc_type, exc_obj, exc_tb = sys.exc_info()
                     fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-                    log.warning(f'new_trades_loop() - error occurred, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
+                    log.warning(f'monitor_orders_by_polling_api() - error occurred, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
+
+    def new_trades_loop(self):
+        ''' Loop that constantly runs and opens new trades as they come in '''
+        with self.client.priority(ORDER_PRIORITY):
+            while True:
+                [symbol, OP, CP, tick_size, trade_direction, index, stop_loss_val, take_profit_val, close_time, signal_time] = self.new_trades_q.get()
+                tracer.since_epoch('signal_queue_wait', signal_time)
+                ## Drop signals for symbols we already trade before spending a REST call on them
+                with self.pending_symbols_lock:
+                    if self.active_trades.get(symbol) is not None or symbol in self.pending_symbols:
+                        continue
+                open_trades = self.get_all_open_or_pending_trades()
+                if open_trades != -1 and symbol not in open_trades and self.async_executor is not None:
+                    with self.pending_symbols_lock:
+                        self.pending_symbols.add(symbol)
+                    future = self.async_executor.submit(self.open_trade_async(symbol, trade_direction, OP, tick_size, stop_loss_val, CP, close_time))
+                    future.add_done_callback(lambda future, args=(symbol, trade_direction, CP, tick_size, index, stop_loss_val, take_profit_val, close_time): self.async_trade_opened(future, *args))
+                elif open_trades != -1 and symbol not in open_trades:
+                    try:
+                        start = time.perf_counter()
+                        order_id, order_qty, entry_price, SL_id, trade_status = self.open_trade(symbol, trade_direction, OP, tick_size, stop_loss_val, CP, close_time)
+                        tracer.since('open_trade', start)
+                        if trade_status != -1:
+                            self.add_trade(Trade(index, entry_price, order_qty, take_profit_val, stop_loss_val, trade_direction, order_id, symbol, CP, tick_size, close_time), SL_id)
+                        elif trade_status == 0:
+                            log.info(f'new_trades_loop() - Order placed on {symbol}, Entry price: {entry_price}, order quantity: {order_qty}, Side: {"Long" if trade_direction else "Short"}')
+
+                    except Exception as e:
+                        exc_type, exc_obj, exc_tb = sys.exc_info()
+                        fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+                        log.warning(f'new_trades_loop() - error occurred, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
 
     def monitor_trades(self, msg):
+        ''' User socket callback, each event is matched to its trade by order id or symbol '''
         try:
-            trades_to_update = []
-            # for i in range(len(self.active_trades)):
-            for trade in self.active_trades:
-                if msg['e'] == 'ORDER_TRADE_UPDATE' and msg['o']['s'] == trade.symbol and msg['o']['X'] == 'FILLED':
-                    i = self.active_trades.index(trade)
-                    if float(msg['o']['rp']) > 0 and msg['o']['i'] == trade.TP_id:
-                        self.total_profit += float(msg['o']['rp'])
+            if 'E' in msg:
+                tracer.since_epoch('user_event_delay', msg['E'] / 1000)
+            if msg['e'] == 'ORDER_TRADE_UPDATE' and msg['o']['X'] == 'FILLED':
+                order_id = msg['o']['i']
+                trade = self.active_trades.get_by_order_id(order_id)
+                if trade is not None and trade.symbol == msg['o']['s']:
+                    realized_profit = float(msg['o']['rp'])
+                    if realized_profit > 0 and order_id == trade.TP_id:
+                        self.total_profit += realized_profit
                         self.number_of_wins += 1
-                        trades_to_update.append([i, 4])
-                    elif float(msg['o']['rp']) < 0 and msg['o']['i'] == trade.SL_id:
-                        self.total_profit += float(msg['o']['rp'])
+                        trade.trade_status = 4
+                    elif realized_profit < 0 and order_id == trade.SL_id:
+                        self.total_profit += realized_profit
                         self.number_of_losses += 1
-                        trades_to_update.append([i, 5])
-                    elif msg['o']['i'] == trade.order_id:
-                        status = self.place_tp_sl(trade.symbol, trade.trade_direction, trade.CP, trade.tick_size, trade.entry_price, i)
-                        trades_to_update.append([i, status])
-                elif msg['e'] == 'ACCOUNT_UPDATE':
-                    i = self.active_trades.index(trade)
-                    for position in msg['a']['P']:
-                        if position['s'] == trade.symbol and position['pa'] == '0':
-                            trades_to_update.append([i, 6])
-            for [index, status] in trades_to_update:
-                self.active_trades[index].trade_status = status
+                        trade.trade_status = 5
+                    elif order_id == trade.order_id:
+                        if trade.close_time:
+                            tracer.since_epoch('kline_close_to_fill', trade.close_time / 1000)
+                        start = time.perf_counter()
+                        trade.trade_status = self.place_tp_sl(trade)
+                        tracer.since('place_tp_sl', start)
+            elif msg['e'] == 'ACCOUNT_UPDATE':
+                for position in msg['a']['P']:
+                    trade = self.active_trades.get(position['s'])
+                    if trade is not None and position['pa'] == '0':
+                        trade.trade_status = 6
         except Exception as e:
             exc_type, exc_obj, exc_tb = sys.exc_info()
             fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
             log.warning(f'monitor_trades() - error occurred, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
 
-    def place_tp_sl(self, symbol, trade_direction, CP, tick_size, entry_price, index):
+    def place_tp_sl(self, trade: Trade):
         ''' Opens TP and SL positions '''
-        try:
-            ## Cancel any open orders to get around an issue with partially filled orders
-            self.client.futures_coin_cancel_all_open_orders(symbol=symbol)
-        except:
-            pass
-        self.active_trades[index].position_size = abs([float(position['positionAmt']) for position in self.client.futures_position_information() if position['symbol'] == symbol][0])
-        self.active_trades[index].SL_id = self.place_SL(symbol, self.active_trades[index].SL_val, trade_direction, CP, tick_size, self.active_trades[index].position_size)
-        self.active_trades[index].TP_id = self.place_TP(symbol, [self.active_trades[index].TP_val, self.active_trades[index].position_size], trade_direction, CP, tick_size)
-        if self.active_trades[index].SL_id != -1 and self.active_trades[index].TP_id != -1:
-            log.info(f'new_trades_loop() - Position opened on {symbol}, orderId: {self.active_trades[-1].order_id}, Entry price: {entry_price}, order quantity: {self.active_trades[index].position_size}, Side: {"Long" if trade_direction else "Short"}\n'
-                     f' Take Profit & Stop loss have been placed')
-            self.print_trades_q.put(True)
-            return 1
-        else:
-            return 3  ## Signals to close the trade as it doesn't have either a Take Profit or a Stop Loss
+        with self.client.priority(ORDER_PRIORITY):
+            ## Cancel the trade's previous TP & SL, the average down order stays open
+            for order_id in (trade.TP_id, trade.SL_id):
+                if order_id not in ('', -1, None):
+                    try:
+                        self.client.futures_cancel_order(symbol=trade.symbol, orderId=order_id)
+                    except:
+                        pass
+            trade.position_size = abs([float(position['positionAmt']) for position in self.client.futures_position_information() if position['symbol'] == trade.symbol][0])
+            ## Both go out in one batch, each sub-response's order id is recorded on the trade, a rejected one is -1
+            SL_result, TP_result = place_orders(self.client, [self.position_stop_loss_order(trade.symbol, trade.SL_val, trade.trade_direction, trade.CP, trade.tick_size, trade.position_size),
+                                                              self.take_profit_order(trade.symbol, trade.TP_val, trade.position_size, trade.trade_direction, trade.CP, trade.tick_size)])
+            if isinstance(SL_result, Exception):
+                log.warning(f"place_tp_sl() - Error occurred placing SL on {trade.symbol}, price: {trade.SL_val}, Error: {SL_result}")
+            if isinstance(TP_result, Exception):
+                log.warning(f"place_tp_sl() - Error occurred placing TP on {trade.symbol}, price: {trade.TP_val}, amount: {trade.position_size}, Error: {TP_result}")
+            self.active_trades.set_order_ids(trade, self.order_id(TP_result) or -1, self.order_id(SL_result) or -1)
+            if trade.SL_id != -1 and trade.TP_id != -1:
+                log.info(f'new_trades_loop() - Position opened on {trade.symbol}, orderId: {trade.order_id}, Entry price: {trade.entry_price}, order quantity: {trade.position_size}, Side: {"Long" if trade.trade_direction else "Short"}\n'
+                         f' Take Profit & Stop loss have been placed')
+                self.print_trades_q.put(True)
+                return 1
+            else:
+                return 3  ## Signals to close the trade as it doesn't have either a Take Profit or a Stop Loss
 
     def get_all_open_or_pending_trades(self):
         ''' Gets all opened trades, User opened positions + Bot opened trades + Pending Bot trades '''
         try:
             open_trades_symbols = [position['symbol'] for position in self.client.futures_position_information() if float(position['notional']) != 0.0]  ## All open Trades
-            active_trade_symbols = [trade.symbol for trade in self.active_trades]
-            return open_trades_symbols + active_trade_symbols
+            active_trade_symbols = self.active_trades.symbols()
+            with self.pending_symbols_lock:
+                pending_trade_symbols = list(self.pending_symbols)
+            return set(open_trades_symbols + active_trade_symbols + pending_trade_symbols)
         except Exception as e:
             log.warning(f'get_all_open_or_pending_trades() - Error occurred: {e}')
             return -1
@@ -141,186 +273,183 @@ class TradeManager:
 
 
     def cancel_and_remove_trades(self):
-        ''' Function that removes finished trades from the active_trades list '''
-        i = 0
+        ''' Function that removes finished trades from the active_trades registry '''
         open_trades = self.get_all_open_positions()
-        while i < len(self.active_trades):
-            if self.active_trades[i].trade_status == 2 and open_trades != []:
+        for trade in self.active_trades:
+            if trade.trade_status == 2 and open_trades != []:
                 try:
-                    pop_trade = self.check_position_and_cancel_orders(self.active_trades[i], open_trades)
+                    pop_trade = self.check_position_and_cancel_orders(trade, open_trades)
                     if pop_trade:
-                        log.info(f'cancel_and_remove_trades() - orders cancelled on {self.active_trades[i].symbol} as price surpassed the trading threshold set in live_trading_config.py\n '
-                                 f'Current Price was: {self.active_trades[i].current_price}, Attempted entry price was: {self.active_trades[i].entry_price}, % moved: {abs(100*(self.active_trades[i].entry_price-self.active_trades[i].current_price)/self.active_trades[i].entry_price)}')
-                        self.active_trades.pop(i)
+                        log.info(f'cancel_and_remove_trades() - orders cancelled on {trade.symbol} as price surpassed the trading threshold set in live_trading_config.py\n '
+                                 f'Current Price was: {trade.current_price}, Attempted entry price was: {trade.entry_price}, % moved: {abs(100*(trade.entry_price-trade.current_price)/trade.entry_price)}')
+                        self.active_trades.remove(trade)
                     else:
-                        self.active_trades[i].trade_status = 0
-                        i += 1
+                        trade.trade_status = 0
                 except Exception as e:
                     exc_type, exc_obj, exc_tb = sys.exc_info()
                     fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-                    log.warning(f'cancel_and_remove_trades() - error occurred cancelling a trade on {self.active_trades[i].symbol}, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
-            elif self.active_trades[i].trade_status == 3:
+                    log.warning(f'cancel_and_remove_trades() - error occurred cancelling a trade on {trade.symbol}, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
+            elif trade.trade_status == 3:
                 try:
-                    self.close_position(self.active_trades[i].symbol, self.active_trades[i].trade_direction, self.active_trades[i].position_size)
-                    if self.active_trades[i].SL_id == -1:
-                        log.info(f'cancel_and_remove_trades() - orders cancelled on {self.active_trades[i].symbol} as there was an issue placing the Stop loss')
+                    self.close_position(trade.symbol, trade.trade_direction, trade.position_size)
+                    if trade.SL_id == -1:
+                        log.info(f'cancel_and_remove_trades() - orders cancelled on {trade.symbol} as there was an issue placing the Stop loss')
                     else:
-                        log.info(f'cancel_and_remove_trades() - orders cancelled on {self.active_trades[i].symbol} as there was an issue placing the Take Profit')
-                    self.active_trades.pop(i)
-                except Exception as e:
-                    exc_type, exc_obj, exc_tb = sys.exc_info()
-                    fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-                    log.warning(f'cancel_and_remove_trades() - error occurred cancelling a trade on {self.active_trades[i].symbol}, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
-            elif self.active_trades[i].trade_status == 4:
-                try:
-                    self.client.futures_cancel_all_open_orders(symbol=self.active_trades[i].symbol)
-                    log.info(f'cancel_and_remove_trades() - orders cancelled on {self.active_trades[i].symbol} as Take Profit was hit')
-                    self.active_trades.pop(i)
-                except Exception as e:
-                    exc_type, exc_obj, exc_tb = sys.exc_info()
-                    fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-                    log.warning(f'cancel_and_remove_trades() - error occurred closing open orders on {self.active_trades[i].symbol}, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
-            elif self.active_trades[i].trade_status == 5:
-                try:
-                    self.client.futures_cancel_all_open_orders(symbol=self.active_trades[i].symbol)
-                    log.info(f'cancel_and_remove_trades() - orders cancelled on {self.active_trades[i].symbol} as Stop loss was hit')
-                    self.active_trades.pop(i)
+                        log.info(f'cancel_and_remove_trades() - orders cancelled on {trade.symbol} as there was an issue placing the Take Profit')
+                    self.active_trades.remove(trade)
                 except Exception as e:
                     exc_type, exc_obj, exc_tb = sys.exc_info()
                     fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-                    log.warning(f'cancel_and_remove_trades() - error occurred closing open orders on {self.active_trades[i].symbol}, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
-            elif self.active_trades[i].trade_status == 6:
+                    log.warning(f'cancel_and_remove_trades() - error occurred cancelling a trade on {trade.symbol}, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
+            elif trade.trade_status in (4, 5, 6):
+                reason = {4: 'Take Profit was hit', 5: 'Stop loss was hit', 6: 'trade was closed, possibly by the user'}[trade.trade_status]
                 try:
-                    self.client.futures_cancel_all_open_orders(symbol=self.active_trades[i].symbol)
-                    log.info(f'cancel_and_remove_trades() - orders cancelled on {self.active_trades[i].symbol} as trade was closed, possibly by the user')
-                    self.active_trades.pop(i)
+                    self.client.futures_cancel_all_open_orders(symbol=trade.symbol)
+                    log.info(f'cancel_and_remove_trades() - orders cancelled on {trade.symbol} as {reason}')
+                    self.active_trades.remove(trade)
                 except Exception as e:
                     exc_type, exc_obj, exc_tb = sys.exc_info()
                     fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-                    log.warning(f'cancel_and_remove_trades() - error occurred cancelling a trade on {self.active_trades[i].symbol}, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
-            else:
-                i += 1
+                    log.warning(f'cancel_and_remove_trades() - error occurred closing open orders on {trade.symbol}, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
 
-    def open_trade(self, symbol, trade_direction, OP, tick_size, stop_loss_val, CP):
-        ''' Function to open a new trade '''
-        ticker = self.client.futures_symbol_ticker(symbol = symbol)
-        current_price = float(ticker['price'])
-        account_balance_info = self.client.futures_account_balance()
-        account_balance = 0
-        for balance in account_balance_info:
-            if balance['asset'] == 'USDT':
-                account_balance = balance['balance']
+    def add_trade(self, trade: Trade, SL_id):
+        ''' Registers a new trade with the stop loss placed alongside its entry, so a stop fill is matched before TP & SL are replaced '''
+        trade.SL_id = SL_id
+        self.active_trades.add(trade)
 
-        order_notional = account_balance / 2
-        order_qty = order_notional / current_price
-        market_entry_price = 0
-        market_order_id = ''
+    def async_trade_opened(self, future, symbol, trade_direction, CP, tick_size, index, stop_loss_val, take_profit_val, close_time):
+        ''' Runs when open_trade_async finishes, registers the trade like new_trades_loop does '''
+        try:
+            order_id, order_qty, entry_price, SL_id, trade_status = future.result()
+            if trade_status != -1:
+                self.add_trade(Trade(index, entry_price, order_qty, take_profit_val, stop_loss_val, trade_direction, order_id, symbol, CP, tick_size, close_time), SL_id)
+        except Exception as e:
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+            log.warning(f'async_trade_opened() - error occurred on {symbol}, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
+        finally:
+            with self.pending_symbols_lock:
+                self.pending_symbols.discard(symbol)
+
+    def round_price(self, price: float, CP: int, tick_size: float):
+        if CP == 0:
+            return round(price)
+        return round(round(price / tick_size) * tick_size, CP)
 
+    def round_quantity(self, quantity: float, OP: int):
         if OP == 0:
-            order_qty = round(order_qty)
-        else:
-            order_qty = round(order_qty, OP)
+            return round(quantity)
+        return round(quantity, OP)
 
-        # first order
-        try:
-            if trade_direction == 0:
-                order = self.client.futures_create_order(
-                    symbol=symbol,
-                    side=SIDE_SELL,
-                    type=FUTURE_ORDER_TYPE_MARKET,
-                    quantity=order_qty)
-                market_order_id = order['orderId']
-            if trade_direction == 1:
-                order = self.client.futures_create_order(
-                    symbol=symbol,
-                    side=SIDE_BUY,
-                    type=FUTURE_ORDER_TYPE_MARKET,
-                    quantity=order_qty)
-                market_order_id = order['orderId']
+    def usdt_balance(self, account_balance_info):
+        for balance in account_balance_info:
+            if balance['asset'] == 'USDT':
+                return float(balance['balance'])
+        return 0
 
-            market_entry_price = float(self.client.futures_position_information(symbol=symbol)[0]['entryPrice'])
+    def market_order(self, symbol, trade_direction, order_qty):
+        ''' Parameters of the market entry order '''
+        return {'symbol': symbol, 'side': SIDE_BUY if trade_direction == 1 else SIDE_SELL, 'type': FUTURE_ORDER_TYPE_MARKET, 'quantity': order_qty}
 
-            # average down
-            try:
-                account_balance_info = self.client.futures_account_balance()
-                account_balance = 0
-                for balance in account_balance_info:
-                    if balance['asset'] == 'USDT':
-                        account_balance = balance['balance']
-                order_notional = account_balance
-                if trade_direction == 1:
-                    avg_down_price = (market_entry_price - (SL_mult * stop_loss_val))
-                    avg_down_qty = order_notional / avg_down_price
-                    order = self.client.futures_create_order(
-                        symbol=symbol,
-                        side=SIDE_BUY,
-                        type=FUTURE_ORDER_TYPE_LIMIT,
-                        price=avg_down_price,
-                        timeInForce=TIME_IN_FORCE_GTC,
-                        quantity=avg_down_qty)
-                elif trade_direction == 0:
-                    avg_down_price = (market_entry_price + (SL_mult * stop_loss_val))
-                    avg_down_qty = order_notional / avg_down_price
-                    order = self.client.futures_create_order(
-                        symbol=symbol,
-                        side=SIDE_SELL,
-                        type=FUTURE_ORDER_TYPE_LIMIT,
-                        price=avg_down_price,
-                        timeInForce=TIME_IN_FORCE_GTC,
-                        quantity=avg_down_qty)
+    def average_down_order(self, symbol, trade_direction, market_entry_price, stop_loss_val, account_balance, OP, CP, tick_size):
+        ''' Parameters of the averaging down limit order, SL_mult x ATR away from the entry using the whole balance '''
+        if trade_direction == 1:
+            avg_down_price = self.round_price(market_entry_price - (SL_mult * stop_loss_val), CP, tick_size)
+        else:
+            avg_down_price = self.round_price(market_entry_price + (SL_mult * stop_loss_val), CP, tick_size)
+        avg_down_qty = self.round_quantity(account_balance / avg_down_price, OP)
+        return {'symbol': symbol, 'side': SIDE_BUY if trade_direction == 1 else SIDE_SELL, 'type': FUTURE_ORDER_TYPE_LIMIT,
+                'price': avg_down_price, 'timeInForce': TIME_IN_FORCE_GTC, 'quantity': avg_down_qty}
 
-            except Exception as e:
-                exc_type, exc_obj, exc_tb = sys.exc_info()
-                fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-                log.warning(
-                    f'open_trade() - error occurred placing average down order on {symbol}, OP: {OP}, trade direction: {trade_direction}, '
-                    f'Quantity: {order_qty}, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
+    def stop_loss_order(self, symbol, trade_direction, market_entry_price, stop_loss_val, CP, tick_size, quantity):
+        '''
+        Parameters of the stop market order placed with the entry, here stop loss val should be ATR. Reduce only for the
+        entry quantity rather than closePosition, which batchOrders doesn't take
+        '''
+        if trade_direction == 1:
+            SL = self.round_price(market_entry_price - (SL_mult * stop_loss_val), CP, tick_size)
+        else:
+            SL = self.round_price(market_entry_price + (SL_mult * stop_loss_val), CP, tick_size)
+        return {'symbol': symbol, 'side': SIDE_SELL if trade_direction == 1 else SIDE_BUY, 'type': FUTURE_ORDER_TYPE_STOP_MARKET,
+                'reduceOnly': 'true', 'stopPrice': SL, 'quantity': quantity}
 
-            # stop loss - here stop loss val should be ATR
-            try:
-                if trade_direction == 1:
-                    SL = market_entry_price - (SL_mult * stop_loss_val)
-                if trade_direction == 0:
-                    SL = market_entry_price + (SL_mult * stop_loss_val)
-
-                if CP == 0:
-                    SL = round(SL)
-                else:
-                    SL = round(round(SL / tick_size) * tick_size, CP)
-
-                if trade_direction == 1:
-                    sl_order = self.client.futures_create_order(
-                        symbol=symbol,
-                        side=SIDE_SELL,
-                        type=FUTURE_ORDER_TYPE_STOP_MARKET,
-                        stopprice=SL,
-                        quantity = order_qty + avg_down_qty,
-                        closePosition='true')
-                elif trade_direction == 0:
-                    sl_order = self.client.futures_create_order(
-                        symbol=symbol,
-                        side=SIDE_BUY,
-                        type=FUTURE_ORDER_TYPE_STOP_MARKET,
-                        price=SL,
-                        quantity = order_qty + avg_down_qty,
-                        closePosition = 'true')
+    def order_id(self, result):
+        ''' Order id of a place_orders result, '' when the order failed '''
+        return result['orderId'] if isinstance(result, dict) else ''
 
-            except Exception as e:
-                exc_type, exc_obj, exc_tb = sys.exc_info()
-                fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-                log.warning(
-                    f'open_trade() - error occurred placing stoploss order on {symbol}, OP: {OP}, trade direction: {trade_direction}, '
-                    f'Quantity: {order_qty}, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
+    def open_trade(self, symbol, trade_direction, OP, tick_size, stop_loss_val, CP, close_time=0):
+        ''' Function to open a new trade, returns the entry order id, quantity, entry price, stop loss order id and status '''
+        ticker = self.client.futures_symbol_ticker(symbol = symbol)
+        current_price = float(ticker['price'])
+        account_balance = self.usdt_balance(self.client.futures_account_balance())
+        order_qty = self.round_quantity((account_balance / 2) / current_price, OP)
+        market_entry_price = 0
+        market_order_id = ''
 
+        # first order
+        try:
+            order = self.client.futures_create_order(**self.market_order(symbol, trade_direction, order_qty))
+            market_order_id = order['orderId']
+            if close_time:
+                tracer.since_epoch('kline_close_to_entry_ack', close_time / 1000)
+
+            market_entry_price = float(self.client.futures_position_information(symbol=symbol)[0]['entryPrice'])
         except Exception as e:
             exc_type, exc_obj, exc_tb = sys.exc_info()
             fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
             log.warning(
                 f'open_trade() - error occurred placing market order on {symbol}, OP: {OP}, trade direction: {trade_direction}, '
                 f'Quantity: {order_qty}, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
-            return -1, -1, -1, -1
+            return -1, -1, -1, -1, -1
 
-        return market_order_id, order_qty, market_entry_price, 1
+        # average down & stop loss, both are priced off the entry so they go out together once it's filled
+        orders = {'stoploss': self.stop_loss_order(symbol, trade_direction, market_entry_price, stop_loss_val, CP, tick_size, order_qty)}
+        try:
+            account_balance = self.usdt_balance(self.client.futures_account_balance())
+            orders['average down'] = self.average_down_order(symbol, trade_direction, market_entry_price, stop_loss_val, account_balance, OP, CP, tick_size)
+        except Exception as e:
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+            log.warning(
+                f'open_trade() - error occurred placing average down order on {symbol}, OP: {OP}, trade direction: {trade_direction}, '
+                f'Quantity: {order_qty}, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
+        results = dict(zip(orders, place_orders(self.client, list(orders.values()))))
+        for order_name, result in results.items():
+            if isinstance(result, Exception):
+                log.warning(f'open_trade() - error occurred placing {order_name} order on {symbol}, OP: {OP}, trade direction: {trade_direction}, '
+                            f'Quantity: {order_qty}, Error: {result}')
+        return market_order_id, order_qty, market_entry_price, self.order_id(results['stoploss']), 1
+
+    async def open_trade_async(self, symbol, trade_direction, OP, tick_size, stop_loss_val, CP, close_time=0):
+        ''' open_trade on the async client, requests that don't depend on each other are sent together '''
+        async with self.async_executor.symbol_lock(symbol):
+            ticker, account_balance_info = await asyncio.gather(self.async_executor.request('futures_symbol_ticker', symbol=symbol), self.async_executor.request('futures_account_balance'))
+            current_price = float(ticker['price'])
+            order_qty = self.round_quantity((self.usdt_balance(account_balance_info) / 2) / current_price, OP)
+            try:
+                order = await self.async_executor.request('futures_create_order', **self.market_order(symbol, trade_direction, order_qty))
+                market_order_id = order['orderId']
+                if close_time:
+                    tracer.since_epoch('kline_close_to_entry_ack', close_time / 1000)
+                positions, account_balance_info = await asyncio.gather(self.async_executor.request('futures_position_information', symbol=symbol), self.async_executor.request('futures_account_balance'))
+                market_entry_price = float(positions[0]['entryPrice'])
+            except Exception as e:
+                exc_type, exc_obj, exc_tb = sys.exc_info()
+                fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+                log.warning(
+                    f'open_trade_async() - error occurred placing market order on {symbol}, OP: {OP}, trade direction: {trade_direction}, '
+                    f'Quantity: {order_qty}, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
+                return -1, -1, -1, -1, -1
+
+            ## The averaging down limit and the stop loss are independent, they go out in one batch (or in parallel without batching)
+            avg_down_result, stop_loss_result = await place_orders_async(self.async_executor, [
+                self.average_down_order(symbol, trade_direction, market_entry_price, stop_loss_val, self.usdt_balance(account_balance_info), OP, CP, tick_size),
+                self.stop_loss_order(symbol, trade_direction, market_entry_price, stop_loss_val, CP, tick_size, order_qty)])
+            for order_name, result in [('average down', avg_down_result), ('stoploss', stop_loss_result)]:
+                if isinstance(result, Exception):
+                    log.warning(f'open_trade_async() - error occurred placing {order_name} order on {symbol}, OP: {OP}, trade direction: {trade_direction}, '
+                                f'Quantity: {order_qty}, Error: {result}')
+            return market_order_id, order_qty, market_entry_price, self.order_id(stop_loss_result), 1
 
     def get_account_balance(self):
         ''' Function that returns the USDT balance of the account '''
@@ -334,68 +463,16 @@ class TradeManager:
             fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
             log.warning(f'get_account_balance() - error getting account balance, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
 
-    def place_TP(self, symbol: str, TP: [float, float], trade_direction: int, CP: int, tick_size: float):
-        ''' Function that places a new TP order '''
-        TP_ID = ''
-        TP_val = 0
-        try:
-            order = ''
-            order_side = ''
-            if CP == 0:
-                TP_val = round(TP[0])
-            else:
-                TP_val = round(round(TP[0] / tick_size) * tick_size, CP)
-            if trade_direction == 1:
-                order_side = SIDE_SELL
-            elif trade_direction == 0:
-                order_side = SIDE_BUY
-            order = self.client.futures_create_order(
-                symbol=symbol,
-                side=order_side,
-                type=FUTURE_ORDER_TYPE_TAKE_PROFIT,
-                price=TP_val,
-                stopPrice=TP_val,
-                timeInForce=TIME_IN_FORCE_GTC,
-                reduceOnly='true',
-                quantity=TP[1])
-            TP_ID = order['orderId']
-        except Exception as e:
-            exc_type, exc_obj, exc_tb = sys.exc_info()
-            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-            log.warning(f"place_TP() - Error occurred placing TP on {symbol}, price: {TP_val}, amount: {TP[1]}, Error: {e}, {exc_type, fname, exc_tb.tb_lineno}")
-            return -1
-
-        return TP_ID
-
-    def place_SL(self, symbol: str, SL: float, trade_direction: int, CP: int, tick_size: float, quantity: float):
-        ''' Function that places a new SL order '''
-        order_ID = ''
-        try:
-            if CP == 0:
-                SL = round(SL)
-            else:
-                SL = round(round(SL / tick_size) * tick_size, CP)
-            order_side = ''
-            if trade_direction == 1:
-                order_side = SIDE_SELL
-            elif trade_direction == 0:
-                order_side = SIDE_BUY
-
-            order = self.client.futures_create_order(
-                symbol=symbol,
-                side=order_side,
-                type=FUTURE_ORDER_TYPE_STOP_MARKET,
-                reduceOnly='true',
-                stopPrice=SL,
-                quantity=quantity)
-            order_ID = order['orderId']
-        except Exception as e:
-            exc_type, exc_obj, exc_tb = sys.exc_info()
-            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-            log.warning(f"place_SL() - Error occurred placing SL on {symbol}, price: {SL}, Error: {e}, {exc_type, fname, exc_tb.tb_lineno}")
-            return -1
+    def take_profit_order(self, symbol: str, TP_val: float, quantity: float, trade_direction: int, CP: int, tick_size: float):
+        ''' Parameters of the take profit order, reduce only for the position size '''
+        TP_val = self.round_price(TP_val, CP, tick_size)
+        return {'symbol': symbol, 'side': SIDE_SELL if trade_direction == 1 else SIDE_BUY, 'type': FUTURE_ORDER_TYPE_TAKE_PROFIT,
+                'price': TP_val, 'stopPrice': TP_val, 'timeInForce': TIME_IN_FORCE_GTC, 'reduceOnly': 'true', 'quantity': quantity}
 
-        return order_ID
+    def position_stop_loss_order(self, symbol: str, SL: float, trade_direction: int, CP: int, tick_size: float, quantity: float):
+        ''' Parameters of the stop loss placed once the entry filled, reduce only for the position size '''
+        return {'symbol': symbol, 'side': SIDE_SELL if trade_direction == 1 else SIDE_BUY, 'type': FUTURE_ORDER_TYPE_STOP_MARKET,
+                'reduceOnly': 'true', 'stopPrice': self.round_price(SL, CP, tick_size), 'quantity': quantity}
 
     def close_position(self, symbol: str, trade_direction: int, total_position_size: float):
         '''
@@ -429,42 +506,50 @@ class TradeManager:
 
     def log_trades_loop(self):
         ''' Loop that runs constantly and updates the logs for the user when something happens or when a new candle is received '''
-        while True:
-            try:
-                self.print_trades_q.get()
-                position_information = [position for position in self.client.futures_position_information() if float(position['notional']) != 0.0]
-                win_loss = 'Not available yet'
-                if self.number_of_losses != 0:
-                    win_loss = round(self.number_of_wins / self.number_of_losses, 4)
-                if len(position_information) != 0:
-                    info = {'Symbol': [], 'Position Size': [], 'Direction': [], 'Entry Price': [], 'Market Price': [], 'PNL': []}
-                    orders = self.client.futures_get_open_orders()
-                    open_orders = {f'{str(order["symbol"]) + "_TP"}': float(order['price']) for order in orders if
-                                   order['reduceOnly'] is True and order['type'] == 'TAKE_PROFIT'}
-                    open_orders_SL = {f'{str(order["symbol"]) + "_SL"}': float(order['stopPrice']) for order in orders if
-                                      order['origType'] == 'STOP_MARKET'}
-                    open_orders.update(open_orders_SL)
-                    for position in position_information:
-                        info['Symbol'].append(position['symbol'])
-                        info['Position Size'].append(position['positionAmt'])
-                        if float(position['notional']) > 0:
-                            info['Direction'].append('LONG')
-                        else:
-                            info['Direction'].append('SHORT')
-                        info['Entry Price'].append(position['entryPrice'])
-                        info['Market Price'].append(position['markPrice'])
-                        info['PNL'].append(float(position['unRealizedProfit']))
-                    log.info(f'Account Balance: ${round(self.get_account_balance(), 3)}, Total profit: ${round(self.total_profit, 3)}, PNL: ${round(sum(info["PNL"]),3)}, Wins: {self.number_of_wins}, Losses: {self.number_of_losses}, Win/Loss ratio: {win_loss}, Open Positions: {len(info["Symbol"])}\n' + tabulate(
-                            info, headers='keys', tablefmt='github'))
-                else:
-                    log.info(f'Account Balance: ${round(self.get_account_balance(), 3)}, Total profit: ${round(self.total_profit, 3)}, Wins: {self.number_of_wins}, Losses: {self.number_of_losses}, Win/Loss ratio: {win_loss},  No Open Positions')
-            except Exception as e:
-                exc_type, exc_obj, exc_tb = sys.exc_info()
-                fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-                log.warning(f'log_trades_loop() - Error: {e}, {exc_type, fname, exc_tb.tb_lineno}')
+        with self.client.priority(HOUSEKEEPING_PRIORITY):
+            while True:
+                try:
+                    self.print_trades_q.get()
+                    position_information = [position for position in self.client.futures_position_information() if float(position['notional']) != 0.0]
+                    win_loss = 'Not available yet'
+                    if self.number_of_losses != 0:
+                        win_loss = round(self.number_of_wins / self.number_of_losses, 4)
+                    if len(position_information) != 0:
+                        info = {'Symbol': [], 'Position Size': [], 'Direction': [], 'Entry Price': [], 'Market Price': [], 'PNL': []}
+                        orders = self.client.futures_get_open_orders()
+                        open_orders = {f'{str(order["symbol"]) + "_TP"}': float(order['price']) for order in orders if
+                                       order['reduceOnly'] is True and order['type'] == 'TAKE_PROFIT'}
+                        open_orders_SL = {f'{str(order["symbol"]) + "_SL"}': float(order['stopPrice']) for order in orders if
+                                          order['origType'] == 'STOP_MARKET'}
+                        open_orders.update(open_orders_SL)
+                        for position in position_information:
+                            info['Symbol'].append(position['symbol'])
+                            info['Position Size'].append(position['positionAmt'])
+                            if float(position['notional']) > 0:
+                                info['Direction'].append('LONG')
+                            else:
+                                info['Direction'].append('SHORT')
+                            info['Entry Price'].append(position['entryPrice'])
+                            info['Market Price'].append(position['markPrice'])
+                            info['PNL'].append(float(position['unRealizedProfit']))
+                        log.info(f'Account Balance: ${round(self.get_account_balance(), 3)}, Total profit: ${round(self.total_profit, 3)}, PNL: ${round(sum(info["PNL"]),3)}, Wins: {self.number_of_wins}, Losses: {self.number_of_losses}, Win/Loss ratio: {win_loss}, Open Positions: {len(info["Symbol"])}\n' + tabulate(
+                                info, headers='keys', tablefmt='github'))
+                    else:
+                        log.info(f'Account Balance: ${round(self.get_account_balance(), 3)}, Total profit: ${round(self.total_profit, 3)}, Wins: {self.number_of_wins}, Losses: {self.number_of_losses}, Win/Loss ratio: {win_loss},  No Open Positions')
+                except Exception as e:
+                    exc_type, exc_obj, exc_tb = sys.exc_info()
+                    fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+                    log.warning(f'log_trades_loop() - Error: {e}, {exc_type, fname, exc_tb.tb_lineno}')
 
 
 
-def start_new_trades_loop_multiprocess(client: Client, new_trades_q, print_trades_q):
+def start_new_trades_loop_multiprocess(client: Client, new_trades_q, print_trades_q, metrics_q=None):
+    metrics.reset('trade_manager')
+    tracer.reset()
+    tracer.install_dump_signal()
     TM = TradeManager(client, new_trades_q, print_trades_q)
+    if metrics_q is not None:
+        push_metrics_thread = Thread(target=push_metrics_loop, args=(metrics, metrics_q))
+        push_metrics_thread.daemon = True
+        push_metrics_thread.start()
     TM.new_trades_loop()
\ No newline at end of file
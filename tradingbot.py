@@ -1,34 +1,42 @@
 from ta.momentum import stochrsi_d, stochrsi_k, stoch, stoch_signal, rsi
 from ta.trend import ema_indicator, macd_signal, macd, sma_indicator
 from ta.volatility import average_true_range, bollinger_pband
+import time
+import numpy as np
 import pandas as pd
+from threading import Lock
 import strategy as TS
+from candles import CandleBuffer, candles_in_buffer, heikin_ashi, interval_to_minutes
+from klinecache import parse_klines
+from indicators import IndicatorEngine, check_against_ta, wilder_atr
+from latency import tracer
+from metrics import metrics
 from logger import *
 from configuration import *
-from binance.client import Client
 from binance.enums import SIDE_SELL, SIDE_BUY, FUTURE_ORDER_TYPE_MARKET, FUTURE_ORDER_TYPE_LIMIT, TIME_IN_FORCE_GTC, \
     FUTURE_ORDER_TYPE_STOP_MARKET, FUTURE_ORDER_TYPE_TAKE_PROFIT
 
 class Bot:
     def __init__(self, symbol: str, Open: [float], Close: [float], High: [float], Low: [float], Volume: [float], Date: [str], OP: int, CP: int, index: int, tick: float,
-                 strategy: str, TP_SL_choice: str, SL_mult: float, TP_mult: float, backtesting=0, signal_queue=None, print_trades_q=None):
+                 strategy: str, TP_SL_choice: str, SL_mult: float, TP_mult: float, backtesting=0, signal_queue=None, print_trades_q=None, account_state=None, client=None):
         self.symbol = symbol
-        self.Date = Date
+        self.metric_labels = (('symbol', symbol),)
 
         # Remove extra candle if present
         shortest = min(len(Open), len(Close), len(High), len(Low), len(Volume))
-        self.Open = Open[-shortest:]
-        self.Close = Close[-shortest:]
-        self.High = High[-shortest:]
-        self.Low = Low[-shortest:]
-        self.Volume = Volume[-shortest:]
-        self.client = Client(api_key=API_KEY, api_secret=API_SECRET, testnet=True)
+        capacity = shortest if backtesting else candles_in_buffer(buffer) + buffer_margin
+        self.candles = CandleBuffer(capacity)
+        candle_data = {'Open': Open, 'Close': Close, 'High': High, 'Low': Low, 'Volume': Volume}
+        if len(Date) >= shortest:
+            candle_data['Date'] = Date
+        self.candles.load({name: np.asarray(values[len(values) - shortest:]) for name, values in candle_data.items()})
+        self.candles_lock = Lock()
+        self.client = client  ## shared SharedClient from CustomClient, None when backtesting
 
         self.OP = OP
         self.CP = CP
         self.index = index
         self.add_hist_complete = 0
-        self.Open_H, self.Close_H, self.High_H, self.Low_H = [], [], [], []
         self.tick_size = tick
         self.socket_failed = False
         self.backtesting = backtesting
@@ -37,11 +45,12 @@ class Bot:
         self.TP_SL_choice = TP_SL_choice
         self.SL_mult = SL_mult
         self.TP_mult = TP_mult
-        self.indicators = {}
+        self.engine = IndicatorEngine(SMA_window, RSI_window, RSI_window)
         self.current_index = -1  ## -1 for live Bot to always reference the most recent candle, will update in Backtester
         self.take_profit_val, self.stop_loss_val = [], []
         self.peaks, self.troughs = [], []
         self.signal_queue = signal_queue
+        self.account_state = account_state  ## local position / open order cache, REST is used when it's None
         if self.index == 0:
             self.print_trades_q = print_trades_q
         if backtesting:
@@ -50,21 +59,73 @@ class Bot:
             self.update_TP_SL()
         self.first_interval = False
         self.pop_previous_value = False
+        self.batch = None  ## BatchSignalEvaluator when batch_signal_evaluation is enabled
+        self.reconnect_event = None  ## set by flag_socket_failed() so the socket is reset right away
+        self.interval_ms = interval_to_minutes() * 60_000
+
+    ## Candle columns are contiguous read-only numpy views into the ring buffer, no copies are made
+    @property
+    def Date(self):
+        return self.candles.view('Date')
+
+    @property
+    def Open(self):
+        return self.candles.view('Open')
+
+    @property
+    def High(self):
+        return self.candles.view('High')
+
+    @property
+    def Low(self):
+        return self.candles.view('Low')
+
+    @property
+    def Close(self):
+        return self.candles.view('Close')
+
+    @property
+    def Volume(self):
+        return self.candles.view('Volume')
+
+    @property
+    def Open_H(self):
+        return self.candles.view('Open_H')
+
+    @property
+    def Close_H(self):
+        return self.candles.view('Close_H')
+
+    @property
+    def High_H(self):
+        return self.candles.view('High_H')
+
+    @property
+    def Low_H(self):
+        return self.candles.view('Low_H')
+
+    @property
+    def indicators(self):
+        return {"SMA": {"values": self.candles.view('SMA'), "plotting_axis": 1},
+                "RSI": {"values": self.candles.view('RSI'), "plotting_axis": 3},
+                "ATR": {"values": self.candles.view('ATR')}}
 
     def update_indicators(self):
         ## Calculate indicators
         try:
             match self.strategy:
                 case 'RSI':
-                    CloseS = pd.Series(self.Close)
-                    HighS = pd.Series(self.High)
-                    LowS = pd.Series(self.Low)
-                    self.indicators = {"SMA": {"values": list(sma_indicator(CloseS, window=100)),
-                                                 "plotting_axis": 1},
-                                       "RSI": {"values": list(rsi(CloseS, window= RSI_window)),
-                                               "plotting_axis": 3},
-                                       "ATR": {"values": list(average_true_range(high= HighS, low= LowS, close= CloseS, window= RSI_window))}
-                    }
+                    if self.backtesting:
+                        CloseS = pd.Series(self.Close)
+                        HighS = pd.Series(self.High)
+                        LowS = pd.Series(self.Low)
+                        self.candles.set_column('SMA', sma_indicator(CloseS, window=SMA_window))
+                        self.candles.set_column('RSI', rsi(CloseS, window= RSI_window))
+                        self.candles.set_column('ATR', wilder_atr(HighS, LowS, CloseS, RSI_window))
+                    else:
+                        ## Live Bot only consumes the newest candle, O(1) regardless of the buffer size
+                        SMA, RSI, ATR = self.engine.update(self.Close[-1], self.High[-1], self.Low[-1])
+                        self.candles.set_last(SMA=SMA, RSI=RSI, ATR=ATR)
                 case _:
                     return
         except Exception as e:
@@ -72,97 +133,129 @@ class Bot:
             fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
             log.error(f'update_indicators() - Error occurred with strategy: {self.strategy}, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
 
+    def update_TP_SL(self):
+        ''' ATR based stop distance, SL_mult is applied by TradeManager.open_trade when the stop is placed '''
+        self.stop_loss_val = self.indicators["ATR"]["values"]
+        self.take_profit_val = self.TP_mult * self.stop_loss_val
+
+    def seed_indicators(self):
+        ''' Replays the candle buffer through the indicator engine once the historical data has been joined '''
+        try:
+            self.engine.reset()
+            streamed = np.array([self.engine.update(close, high, low) for close, high, low in zip(self.Close.tolist(), self.High.tolist(), self.Low.tolist())]).reshape(-1, 3)
+            self.candles.set_column('SMA', streamed[:, 0])
+            self.candles.set_column('RSI', streamed[:, 1])
+            self.candles.set_column('ATR', streamed[:, 2])
+            if len(self.Close) >= RSI_window:
+                check_against_ta({name: values["values"] for name, values in self.indicators.items()}, self.Close, self.High, self.Low,
+                                 SMA_window, RSI_window, RSI_window, indicator_tolerance)
+        except Exception as e:
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+            log.error(f'seed_indicators() - Error occurred seeding indicators for {self.symbol}, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
 
     def add_hist(self, Date_temp: [float], Open_temp: [float], Close_temp: [float], High_temp: [float], Low_temp: [float], Volume_temp: [str]):
-        if not self.backtesting:
+        with self.candles_lock:
+            if not self.backtesting:
+                try:
+                    ## Keep only the websocket candles that closed after the last historical candle
+                    first_new = np.searchsorted(self.Date, Date_temp[-1], side='right')
+                    historical = {'Date': Date_temp, 'Open': Open_temp, 'Close': Close_temp, 'High': High_temp, 'Low': Low_temp, 'Volume': Volume_temp}
+                    self.candles.load({name: np.concatenate((np.asarray(values, dtype=self.candles.columns[name].dtype), self.candles.view(name)[first_new:]))
+                                       for name, values in historical.items()})
+                except Exception as e:
+                    exc_type, exc_obj, exc_tb = sys.exc_info()
+                    fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+                    log.error(f'add_hist() - Error occurred joining historical and websocket data, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
             try:
-                while 0 < len(self.Date):
-                    if self.Date[0] > Date_temp[-1]:
-                        Date_temp.append(self.Date.pop(0))
-                        Open_temp.append(self.Open.pop(0))
-                        Close_temp.append(self.Close.pop(0))
-                        High_temp.append(self.High.pop(0))
-                        Low_temp.append(self.Low.pop(0))
-                        Volume_temp.append(self.Volume.pop(0))
-                    else:
-                        self.Date.pop(0)
-                        self.Open.pop(0)
-                        self.Close.pop(0)
-                        self.High.pop(0)
-                        self.Low.pop(0)
-                        self.Volume.pop(0)
-                self.Date = Date_temp
-                self.Open = Open_temp
-                self.Close = Close_temp
-                self.High = High_temp
-                self.Low = Low_temp
-                self.Volume = Volume_temp
+                Open_H, Close_H, High_H, Low_H = heikin_ashi(self.Open, self.High, self.Low, self.Close)
+                self.candles.set_column('Open_H', Open_H)
+                self.candles.set_column('Close_H', Close_H)
+                self.candles.set_column('High_H', High_H)
+                self.candles.set_column('Low_H', Low_H)
             except Exception as e:
                 exc_type, exc_obj, exc_tb = sys.exc_info()
                 fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-                log.error(f'add_hist() - Error occurred joining historical and websocket data, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
-        try:
+                log.error(f'add_hist() - Error occurred creating heikin ashi candles, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
+            if not self.backtesting:
+                self.seed_indicators()
+            self.add_hist_complete = 1
 
-            self.Close_H.append((self.Open[0] + self.Close[0] + self.Low[0] + self.High[0]) / 4)
-            self.Open_H.append((self.Close[0] + self.Open[0]) / 2)
-            self.High_H.append(self.High[0])
-            self.Low_H.append(self.Low[0])
-            for i in range(1, len(self.Close)):
-                self.Open_H.append((self.Open_H[i-1] + self.Close_H[i-1]) / 2)
-                self.Close_H.append((self.Open[i] + self.Close[i] + self.Low[i] + self.High[i]) / 4)
-                self.High_H.append(max(self.High[i], self.Open_H[i], self.Close_H[i]))
-                self.Low_H.append(min(self.Low[i], self.Open_H[i], self.Close_H[i]))
-        except Exception as e:
-            exc_type, exc_obj, exc_tb = sys.exc_info()
-            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
-            log.error(f'add_hist() - Error occurred creating heikin ashi candles, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}')
-        self.add_hist_complete = 1
+    def checkpoint_state(self):
+        '''
+        Candle columns and indicator engine state for checkpoint.py. Once the batch evaluator computes this Bot's indicators
+        its row of the batch engine is saved, with the candles it hasn't consumed yet left out (they are backfilled on restore)
+        '''
+        batch_state = self.batch.engine_state(self) if self.batch is not None else None
+        with self.candles_lock:
+            if batch_state is None:
+                state = {name: self.candles.view(name).copy() for name in self.candles.fields}
+                state['engine'], state['engine_closes'] = self.engine.state()
+                return state
+            engine, engine_until = batch_state
+            consumed = np.searchsorted(self.Date, engine_until, side='right')
+            state = {name: self.candles.view(name)[:consumed].copy() for name in self.candles.fields}
+            state['engine'], state['engine_closes'] = engine.state()
+            return state
+
+    def restore_checkpoint(self, state: {str: np.ndarray}, Date_temp: [float], Open_temp: [float], Close_temp: [float], High_temp: [float], Low_temp: [float], Volume_temp: [float]):
+        '''
+        add_hist from a checkpoint: the checkpointed candles and engine are restored, then the candles that closed since
+        (the backfilled gap, then the websocket candles newer than it) are replayed through the engine one by one
+        '''
+        with self.candles_lock:
+            gap = {'T': Date_temp, 'o': Open_temp, 'c': Close_temp, 'h': High_temp, 'l': Low_temp, 'q': Volume_temp}
+            last_gap = Date_temp[-1] if len(Date_temp) else state['Date'][-1]
+            first_new = np.searchsorted(self.Date, last_gap, side='right')
+            streamed = {'T': self.Date[first_new:], 'o': self.Open[first_new:], 'c': self.Close[first_new:], 'h': self.High[first_new:],
+                        'l': self.Low[first_new:], 'q': self.Volume[first_new:]}
+            streamed = {name: values.copy() for name, values in streamed.items()}
+            self.candles.load({name: state[name] for name in self.candles.fields})
+            self.engine.load_state(state['engine'], state['engine_closes'])
+            for candles in (gap, streamed):
+                for i in np.nonzero(np.asarray(candles['T']) > self.Date[-1])[0]:
+                    self.consume_new_candle({name: values[i] for name, values in candles.items()})
+                    self.update_indicators()
+            self.add_hist_complete = 1
 
     def handle_socket_message(self, msg):
         try:
             if msg != '':
+                received = time.time()
                 payload = msg['k']
                 if payload['x']:
-                    if self.pop_previous_value:
-                        self.remove_last_candle()
-                    self.consume_new_candle(payload)
-                    self.update_indicators()
-                    if self.add_hist_complete:
+                    tracer.record('kline_close_to_receipt', max(0.0, received - payload['T'] / 1000))
+                    metrics.inc('bot_candles_total', self.metric_labels)
+                    if self.add_hist_complete and not self.pop_previous_value:
+                        if payload['T'] <= self.Date[-1]:
+                            metrics.inc('bot_duplicate_candles_total', self.metric_labels)
+                            return  ## resent after a reconnect, already in the buffer
+                        if payload['T'] - self.Date[-1] > self.interval_ms and not self.fill_gap(payload['T']):
+                            return  ## dropped, the next candle retries the backfill over the larger gap
+                    start = time.perf_counter()
+                    with self.candles_lock:
+                        if self.pop_previous_value:
+                            self.remove_last_candle()
+                        self.consume_new_candle(payload)
+                        if self.batch is None or not self.batch.evaluates(self):
+                            self.update_indicators()
+                    tracer.since('indicator_update', start)
+                    if self.batch is not None:
+                        ## Indicators & decisions of every symbol are computed together once the interval has closed
+                        self.batch.submit(self, payload)
+                    elif self.add_hist_complete:
                         log.info(f'Price update for {self.symbol}: Close: {self.Close[-1]}, RSI: {self.indicators["RSI"]["values"][-1]}, SMA: {self.indicators["SMA"]["values"][-1]}, ATR: {self.indicators["ATR"]["values"][-1]}')
+                        start = time.perf_counter()
                         trade_direction, stop_loss_val, take_profit_val= self.make_decision()
+                        tracer.since('decision', start)
                         if trade_direction != -99:
-                            if trade_direction == 1:
-                                # Close all short positions at the market price
-                                self.client.futures_create_order(
-                                    symbol=self.symbol,
-                                    side=SIDE_BUY,
-                                    type=FUTURE_ORDER_TYPE_MARKET,
-                                    quantity=self.get_short_position_qty()
-                                )
-                                # Cancel all short open limit orders
-                                self.cancel_open_orders(side=SIDE_SELL)
-                                # Cancel all stop market order (SIDE_BUY)
-                                self.cancel_stop_market_orders(side=SIDE_BUY)
-                                # Check if there is any long positions or open orders
-                                if not self.get_long_position_qty() > 0 or self.has_open_orders(side=SIDE_BUY):
-                                    stop_loss_val = self.indicators["ATR"]["values"][-1]
-                                    self.signal_queue.put([self.symbol, self.OP, self.CP, self.tick_size, trade_direction, self.index, stop_loss_val, take_profit_val])
-                            if trade_direction == 0:
-                                # Close all long positions at the market price
-                                self.client.futures_create_order(
-                                    symbol=self.symbol,
-                                    side=SIDE_SELL,
-                                    type=FUTURE_ORDER_TYPE_MARKET,
-                                    quantity=self.get_long_position_qty()
-                                )
-                                # Cancel all long open limit orders
-                                self.cancel_open_orders(side=SIDE_BUY)
-                                # Cancel all stop market order (SIDE_SELL)
-                                self.cancel_stop_market_orders(side=SIDE_SELL)
-                                # Check if there is any short position or open orders
-                                if not self.get_short_position_qty() > 0 or self.has_open_orders(side=SIDE_SELL):
-                                    stop_loss_val = self.indicators["ATR"]["values"][-1]
-                                    self.signal_queue.put([self.symbol, self.OP, self.CP, self.tick_size, trade_direction, self.index, stop_loss_val, take_profit_val])
+                            ## A failed order is not a socket failure, the candle was consumed and the socket is healthy
+                            try:
+                                self.apply_decision(trade_direction, take_profit_val, payload['T'])
+                            except Exception as e:
+                                exc_type, exc_obj, exc_tb = sys.exc_info()
+                                fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+                                log.warning(f"handle_socket_message() - Error acting on the {self.symbol} signal, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}")
                         self.remove_first_candle()
                     if self.index == 0:
                         self.print_trades_q.put(True)
@@ -174,9 +267,97 @@ class Bot:
             exc_type, exc_obj, exc_tb = sys.exc_info()
             fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
             log.warning(f"handle_socket_message() - Error in handling of {self.symbol} websocket flagging for reconnection, msg: {msg}, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}")
-            self.socket_failed = True
+            self.flag_socket_failed()
+
+    def flag_socket_failed(self):
+        ''' Marks the socket for reconnection and wakes CustomClient.ping_server_reconnect_sockets '''
+        self.socket_failed = True
+        if self.reconnect_event is not None:
+            self.reconnect_event.set()
+
+    def fill_gap(self, close_time: int):
+        '''
+        Downloads the klines that closed between the newest candle in the buffer and the kline closing at close_time,
+        the ones missed while the socket was down, and consumes them in order. Returns False if they couldn't be downloaded
+        '''
+        last_close = int(self.Date[-1])
+        try:
+            start = time.perf_counter()
+            klines = parse_klines(self.client.futures_historical_klines(self.symbol, interval, start_str=last_close + 1, end_str=close_time - self.interval_ms), close_time)
+            klines = klines[klines['Date'] > last_close]
+            tracer.since('gap_backfill', start)
+        except Exception as e:
+            metrics.inc('bot_gap_backfills_total', self.metric_labels + (('result', 'error'),))
+            exc_type, exc_obj, exc_tb = sys.exc_info()
+            fname = os.path.split(exc_tb.tb_frame.f_code.co_filename)[1]
+            log.warning(f"fill_gap() - {self.symbol} missed candles could not be downloaded, Error Info: {exc_obj, fname, exc_tb.tb_lineno}, Error: {e}")
+            return False
+        missed = round((close_time - last_close) / self.interval_ms) - 1
+        with self.candles_lock:
+            ## The batch engine only ever sees one candle per interval, the Bot's engine is reseeded and handed back to it
+            reseed = self.batch is not None and self.batch.evaluates(self)
+            for kline in klines:
+                self.consume_new_candle({'T': kline['Date'], 'o': kline['Open'], 'h': kline['High'], 'l': kline['Low'], 'c': kline['Close'], 'q': kline['Volume']})
+                if not reseed:
+                    self.update_indicators()
+                self.remove_first_candle()
+            if reseed:
+                self.seed_indicators()
+                self.batch.reload(self)
+        metrics.inc('bot_gap_backfills_total', self.metric_labels + (('result', 'ok'),))
+        log.info(f"fill_gap() - {self.symbol} missed {missed} candles, {len(klines)} backfilled")
+        return True
+
+    def apply_decision(self, trade_direction, take_profit_val, close_time):
+        ''' Closes positions & orders on the other side and signals the TradeManager, close_time is the kline close time (ms) '''
+        if trade_direction == 1:
+            # Close all short positions at the market price
+            short_qty = self.get_short_position_qty()
+            if short_qty > 0:
+                self.client.futures_create_order(
+                    symbol=self.symbol,
+                    side=SIDE_BUY,
+                    type=FUTURE_ORDER_TYPE_MARKET,
+                    quantity=short_qty
+                )
+            # Cancel all short open limit orders
+            self.cancel_open_orders(side=SIDE_SELL)
+            # Cancel all stop market order (SIDE_BUY)
+            self.cancel_stop_market_orders(side=SIDE_BUY)
+            # Check if there is any long positions or open orders
+            if not self.get_long_position_qty() > 0 or self.has_open_orders(side=SIDE_BUY):
+                stop_loss_val = self.indicators["ATR"]["values"][-1]
+                self.put_signal(trade_direction, stop_loss_val, take_profit_val, close_time)
+        if trade_direction == 0:
+            # Close all long positions at the market price
+            long_qty = self.get_long_position_qty()
+            if long_qty > 0:
+                self.client.futures_create_order(
+                    symbol=self.symbol,
+                    side=SIDE_SELL,
+                    type=FUTURE_ORDER_TYPE_MARKET,
+                    quantity=long_qty
+                )
+            # Cancel all long open limit orders
+            self.cancel_open_orders(side=SIDE_BUY)
+            # Cancel all stop market order (SIDE_SELL)
+            self.cancel_stop_market_orders(side=SIDE_SELL)
+            # Check if there is any short position or open orders
+            if not self.get_short_position_qty() > 0 or self.has_open_orders(side=SIDE_SELL):
+                stop_loss_val = self.indicators["ATR"]["values"][-1]
+                self.put_signal(trade_direction, stop_loss_val, take_profit_val, close_time)
+
+    def put_signal(self, trade_direction, stop_loss_val, take_profit_val, close_time):
+        ''' Hands a signal to the TradeManager, with the kline close time (ms) and send time (s) for latency tracing '''
+        start = time.perf_counter()
+        self.signal_queue.put([self.symbol, self.OP, self.CP, self.tick_size, trade_direction, self.index, stop_loss_val, take_profit_val, close_time, time.time()])
+        tracer.since('signal_put', start)
+        metrics.inc('bot_signals_total', self.metric_labels + (('direction', 'long' if trade_direction == 1 else 'short'),))
+        tracer.since_epoch('kline_close_to_signal', close_time / 1000)
 
     def get_short_position_qty(self):
+        if self.account_state is not None:
+            return abs(min(self.account_state.position_qty(self.symbol), 0))
         positions = self.client.futures_position_information(symbol=self.symbol)
         for position in positions:
             if float(position['positionAmt']) < 0:
@@ -184,33 +365,44 @@ class Bot:
         return 0
 
     def get_long_position_qty(self):
+        if self.account_state is not None:
+            return max(self.account_state.position_qty(self.symbol), 0)
         positions = self.client.futures_position_information(symbol=self.symbol)
         for position in positions:
             if float(position['positionAmt']) > 0:
                 return float(position['positionAmt'])
         return 0
 
+    def get_open_orders(self):
+        if self.account_state is not None:
+            return self.account_state.get_open_orders(self.symbol)
+        return self.client.futures_get_open_orders(symbol=self.symbol)
+
+    def cancel_order(self, order_id):
+        self.client.futures_cancel_order(symbol=self.symbol, orderId=order_id)
+        if self.account_state is not None:
+            self.account_state.remove_order(self.symbol, order_id)
+
     def cancel_open_orders(self, side):
-        orders = self.client.futures_get_open_orders(symbol=self.symbol)
+        orders = self.get_open_orders()
         for order in orders:
             if order['side'] == side:
-                self.client.futures_cancel_order(symbol=self.symbol, orderId=order['orderId'])
+                self.cancel_order(order['orderId'])
 
     def cancel_stop_market_orders(self, side):
-        orders = self.client.futures_get_open_orders(symbol=self.symbol)
+        orders = self.get_open_orders()
         for order in orders:
             if order['side'] == side and order['type'] in [FUTURE_ORDER_TYPE_STOP_MARKET,FUTURE_ORDER_TYPE_TAKE_PROFIT]:
-                self.client.futures_cancel_order(symbol=self.symbol, orderId=order['orderId'])
+                self.cancel_order(order['orderId'])
 
     def has_open_orders(self, side):
-        orders = self.client.futures_get_open_orders(symbol=self.symbol)
+        orders = self.get_open_orders()
         for order in orders:
             if order['side'] == side:
                 return True
         return False
 
     def make_decision(self):
-        self.update_indicators()
         ##Initialize vars:
         trade_direction = -99  ## Short (0), Long (1)
         stop_loss_val = -99
@@ -230,7 +422,7 @@ class Bot:
                 self.update_TP_SL()
                 stop_loss_val = -99
                 take_profit_val = -99  # That is worked out later by adding or subtracting:
-                stop_loss_val = TS.SetSLTP(self.stop_loss_val, self.take_profit_val, self.peaks,
+                stop_loss_val, take_profit_val = TS.SetSLTP(self.stop_loss_val, self.take_profit_val, self.peaks,
                                                             self.troughs, self.Close, self.High, self.Low, trade_direction,
                                                             self.SL_mult,
                                                             self.TP_mult, self.TP_SL_choice,
@@ -246,34 +438,19 @@ class Bot:
         return trade_direction, stop_loss_val, take_profit_val
 
     def remove_last_candle(self):
-        self.Date.pop(-1)
-        self.Close.pop(-1)
-        self.Volume.pop(-1)
-        self.High.pop(-1)
-        self.Low.pop(-1)
-        self.Open.pop(-1)
-        self.Open_H.pop(-1)
-        self.Close_H.pop(-1)
-        self.High_H.pop(-1)
-        self.Low_H.pop(-1)
+        self.candles.pop_last()
+        self.engine.rollback()
 
     def remove_first_candle(self):
-        self.Date.pop(0)
-        self.Close.pop(0)
-        self.Volume.pop(0)
-        self.High.pop(0)
-        self.Low.pop(0)
-        self.Open.pop(0)
-        self.Open_H.pop(0)
-        self.Close_H.pop(0)
-        self.Low_H.pop(0)
-        self.High_H.pop(0)
+        self.candles.pop_first()
 
     def consume_new_candle(self, payload):
-        self.Date.append(int(payload['T']))
-        self.Close.append(float(payload['c']))
-        self.Volume.append(float(payload['q']))
-        self.High.append(float(payload['h']))
-        self.Low.append(float(payload['l']))
-        self.Open.append(float(payload['o']))
-
+        Open, High, Low, Close = float(payload['o']), float(payload['h']), float(payload['l']), float(payload['c'])
+        ## Heikin-Ashi candle is built from the previous one, rolling back is just dropping the row
+        Close_H = (Open + Close + Low + High) / 4
+        if len(self.candles) and not np.isnan(self.Open_H[-1]):
+            Open_H = (self.Open_H[-1] + self.Close_H[-1]) / 2
+        else:
+            Open_H = (Close + Open) / 2
+        self.candles.append(Date=int(payload['T']), Close=Close, Volume=float(payload['q']), High=High, Low=Low, Open=Open,
+                            Open_H=Open_H, Close_H=Close_H, High_H=max(High, Open_H, Close_H), Low_H=min(Low, Open_H, Close_H))